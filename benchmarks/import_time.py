@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+Cold-start import time of the entry points.
+
+Each module is imported in a fresh interpreter with `-X importtime`,
+several times, and the median is reported with the slowest imports.
+
+Usage, from the repository root:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --modules spidercreator --runs 10
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+REPO_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES: list[str] = ["spidercreator", "main"]
+
+
+def parse_importtime(stderr: str) -> dict[str, int]:
+    """
+    Parses `-X importtime` output into cumulative microseconds per module.
+    Lines look like: "import time:   self [us] | cumulative | imported package"
+    """
+    MODULE_TO_CUMULATIVE_US: dict[str, int] = {}
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # Header line.
+            continue
+        MODULE_TO_CUMULATIVE_US[fields[2].strip()] = cumulative_us
+
+    return MODULE_TO_CUMULATIVE_US
+
+
+def measure_import(module: str) -> dict[str, int]:
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"Importing {module} failed:\n{completed.stderr[-2000:]}"
+        )
+    return parse_importtime(completed.stderr)
+
+
+def report_module(module: str, runs: int, top: int):
+    totals_ms: list[float] = []
+    last_run: dict[str, int] = {}
+
+    for _ in range(runs):
+        last_run = measure_import(module)
+        totals_ms.append(last_run[module] / 1000)
+
+    print(f"--- {module} ---")
+    print(
+        f"median: {statistics.median(totals_ms):.1f} ms, "
+        f"min: {min(totals_ms):.1f} ms, "
+        f"max: {max(totals_ms):.1f} ms ({runs} runs)"
+    )
+
+    # Top-level packages only: submodules are included in their cumulative.
+    top_level = {
+        name: cumulative_us
+        for name, cumulative_us in last_run.items()
+        if "." not in name and name != module
+    }
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)
+    for name, cumulative_us in slowest[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure cold-start import time of the entry points."
+    )
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES,
+                        help="Modules to import")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10,
+                        help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        report_module(module=module, runs=args.runs, top=args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,9 +18,7 @@ from typing import Any
 
 def map_url_to_exec_context(
     recordings_data,
-    spider_urls: list[str],
-    INITIAL_PORT: int = 8020,
-    port_offset: int = 0
+    spider_urls: list[str]
         ):
     URL_TO_HTML: dict[str, str] = {}
 
@@ -31,53 +29,28 @@ def map_url_to_exec_context(
             if record["url"] == url and url not in seen_urls:
                 seen_urls.append(url)
 
-                port: int = INITIAL_PORT + port_offset
-                port_offset += 1
-
                 # print(record)
                 URL_TO_HTML[url] = {
-                    "html": record["website_html"],
-                    "port": port
+                    "html": record.website_html
                 }
-    return URL_TO_HTML, port_offset
-
+    return URL_TO_HTML
 
-def get_url_to_local_addresses(URL_TO_HTML):
-    URL_TO_LOCAL_ADDRESSES = {}
-    for url in URL_TO_HTML:
-        URL_TO_LOCAL_ADDRESSES[url] = f"http://127.0.0.1:{URL_TO_HTML[url]['port']}"
-    return URL_TO_LOCAL_ADDRESSES
 
-
-def build_http_server_contexts(URL_TO_HTML):
-    # Build a list of contexts:
-    contexts = []
+def build_http_server_contexts(URL_TO_HTML) -> dict[str, HttpServerContext]:
+    # Build a context per URL. Ports are picked by the OS when entered.
+    contexts = {}
     for url, row in URL_TO_HTML.items():
-        contexts.append(
-            HttpServerContext(
-                port=row["port"],
-                html=row["html"]
-            )
-        )
+        contexts[url] = HttpServerContext(html=row["html"])
     return contexts
 
 
-def execute_spider_with_http_server_context(
-    spider_code: str,
-    http_server_contexts: list[HttpServerContext]
-        ) -> str:
-    # Use ExitStack to manage http_server_contexts in a single 'with' block
-    with ExitStack() as stack:
-        for ctx in http_server_contexts:
-            stack.enter_context(ctx)
-
-        spider_code_output_with_local_addresses: str =\
-            execute_spider_with_ptyprocess(
-                spider_code=spider_code
-            )
-
-        print("Done. Exiting the 'with' block will shut down both servers automatically.")
-    return spider_code_output_with_local_addresses
+def get_url_to_local_addresses(
+    http_server_contexts: dict[str, HttpServerContext]
+        ) -> dict[str, str]:
+    URL_TO_LOCAL_ADDRESSES = {}
+    for url, ctx in http_server_contexts.items():
+        URL_TO_LOCAL_ADDRESSES[url] = f"http://127.0.0.1:{ctx.port}"
+    return URL_TO_LOCAL_ADDRESSES
 
 
 @attrs.define()
@@ -106,16 +79,6 @@ class CandSpiderExecutor:
         repr=False
     )
 
-    INITIAL_PORT: int = attrs.field(
-        validator=type_validator(),
-        default=8020
-    )
-
-    port_offset: int = attrs.field(
-        validator=type_validator(),
-        default=0
-    )
-
     URL_TO_LOCAL_ADDRESSES: dict[str, str] = attrs.field(
         validator=type_validator(),
         init=False
@@ -126,7 +89,7 @@ class CandSpiderExecutor:
         init=False
     )
 
-    http_server_contexts: list[HttpServerContext] = attrs.field(
+    http_server_contexts: dict[str, HttpServerContext] = attrs.field(
         validator=type_validator(),
         init=False
     )
@@ -151,41 +114,46 @@ class CandSpiderExecutor:
         print("--- RUNNABLE SPIDER URLS ---")
         print(self.runnable_spider_urls)
 
-        self.URL_TO_HTML, self.port_offset = map_url_to_exec_context(
+        self.URL_TO_HTML = map_url_to_exec_context(
             recordings_data=self.recordings_data,
-            spider_urls=self.runnable_spider_urls,
-            INITIAL_PORT=self.INITIAL_PORT,
-            port_offset=self.port_offset
+            spider_urls=self.runnable_spider_urls
         )
 
-        self.URL_TO_LOCAL_ADDRESSES = get_url_to_local_addresses(
+        self.http_server_contexts = build_http_server_contexts(
             URL_TO_HTML=self.URL_TO_HTML
         )
 
-        print("--- URL TO LOCAL ADDRESSES ---")
-        print(self.URL_TO_LOCAL_ADDRESSES)
+        # Use ExitStack to manage http_server_contexts in a single 'with' block
+        with ExitStack() as stack:
+            for ctx in self.http_server_contexts.values():
+                stack.enter_context(ctx)
+
+            print("--- HTTP SERVER CONTEXTS ---")
+            print(self.http_server_contexts)
 
-        self.spider_code_with_local_addresses =\
-            rewrite_ports_in_spider(
-                spider_code=self.spider_code_runnable,
-                URL_TO_LOCAL_ADDRESSES=self.URL_TO_LOCAL_ADDRESSES
+            # The servers are listening on OS-picked ports from here on.
+            self.URL_TO_LOCAL_ADDRESSES = get_url_to_local_addresses(
+                http_server_contexts=self.http_server_contexts
             )
 
-        print("--- SPIDER WITH LOCAL ADDRESSES ---")
-        print(self.spider_code_with_local_addresses)
+            print("--- URL TO LOCAL ADDRESSES ---")
+            print(self.URL_TO_LOCAL_ADDRESSES)
 
-        self.http_server_contexts = build_http_server_contexts(
-            URL_TO_HTML=self.URL_TO_HTML
-        )
+            self.spider_code_with_local_addresses =\
+                rewrite_ports_in_spider(
+                    spider_code=self.spider_code_runnable,
+                    URL_TO_LOCAL_ADDRESSES=self.URL_TO_LOCAL_ADDRESSES
+                )
 
-        print("--- HTTP SERVER CONTEXTS ---")
-        print(self.http_server_contexts)
+            print("--- SPIDER WITH LOCAL ADDRESSES ---")
+            print(self.spider_code_with_local_addresses)
 
-        self.spider_code_output_with_local_addresses: str =\
-            execute_spider_with_http_server_context(
-                spider_code=self.spider_code_with_local_addresses,
-                http_server_contexts=self.http_server_contexts
-            )
+            self.spider_code_output_with_local_addresses: str =\
+                execute_spider_with_ptyprocess(
+                    spider_code=self.spider_code_with_local_addresses
+                )
+
+            print("Done. Exiting the 'with' block will shut down the servers automatically.")
 
         print("--- SPIDER CODE OUTPUT WITH LOCAL ADDRESSES ---")
         print(self.spider_code_output_with_local_addresses)
@@ -4,13 +4,24 @@ import os
 import tempfile
 from ptyprocess import PtyProcessUnicode
 
+from utils.tracing import span
+
 
 def execute_spider_with_ptyprocess(spider_code: str):
     """
     Run the given Python code in a pseudoterminal (PTY) via ptyprocess
     and return everything printed to stdout.
+    Traced as a `candidate_execution` span.
     """
+    with span(
+            "candidate_execution",
+            code_bytes=len(spider_code.encode("utf-8"))) as execution_span:
+        output: str = _execute_spider_with_ptyprocess(spider_code=spider_code)
+        execution_span.set(output_bytes=len(output.encode("utf-8")))
+    return output
+
 
+def _execute_spider_with_ptyprocess(spider_code: str) -> str:
     # 1) Write the spider code to a temporary file
     with tempfile.NamedTemporaryFile(
             "w", delete=False, suffix=".py") as tmp_file:
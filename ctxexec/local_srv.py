@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import functools
 import os
 import tempfile
 import threading
@@ -7,52 +8,67 @@ import shutil
 import http.server
 import socketserver
 
+from utils.ports import bind_listening_socket
+from utils.ports import get_socket_port
+
 
 class ServerThread(threading.Thread):
     """
     Runs a simple http.server in a separate thread, serving files
     from the given `directory` on `port`.
+
+    The listening socket is bound when the thread is created, in the
+    caller's thread. With port=0 the OS picks a free port, available as
+    `self.port` right away. `ready` is set once the server loop runs.
     """
-    def __init__(self, port, directory):
-        super().__init__()
-        self.port = port
+    def __init__(self, directory, port: int = 0):
+        super().__init__(daemon=True)
         self.directory = directory
-        self.httpd = None
+        self.ready = threading.Event()
+
+        # Our simple handler, serving files from `directory`.
+        # Passing the directory instead of calling os.chdir keeps the
+        # process working directory intact for concurrent pipelines.
+        handler = functools.partial(
+            http.server.SimpleHTTPRequestHandler,
+            directory=self.directory
+        )
+        # Create the server on an already listening socket
+        self.httpd = socketserver.TCPServer(
+            ("127.0.0.1", port), handler, bind_and_activate=False
+        )
+        self.httpd.socket.close()
+        self.httpd.socket = bind_listening_socket(port=port)
+        self.httpd.server_address = self.httpd.socket.getsockname()
+        self.port: int = get_socket_port(self.httpd.socket)
 
     def run(self):
-        # Our simple handler
-        handler = http.server.SimpleHTTPRequestHandler
-        # Create the server
-        with socketserver.TCPServer(
-                ("127.0.0.1", self.port), handler) as httpd:
-            # We'll store httpd so we can shut it down later
-            self.httpd = httpd
-
-            # Make sure we serve files from `directory`
-            os.chdir(self.directory)
-
-            # If port=0, the OS picks a free port.  If not, it uses the given port.
-            actual_port = httpd.server_address[1]
-            print(f"[ServerThread] Serving on port {actual_port} from directory: {self.directory}")
+        print(f"[ServerThread] Serving on port {self.port} from directory: {self.directory}")
+        self.ready.set()
 
-            # Serve forever, or until .shutdown() is called
-            httpd.serve_forever()
+        # Serve forever, or until .shutdown() is called
+        with self.httpd:
+            self.httpd.serve_forever()
 
     def stop(self):
         # Gracefully stop the server if it's running
-        if self.httpd:
+        if self.is_alive():
             self.httpd.shutdown()
             print(f"[ServerThread] Shutting down server on port {self.port}")
+        else:
+            self.httpd.server_close()
 
 
 class HttpServerContext:
     """
     Context manager that starts a local HTTP server (in-process)
     on `port`, serving an `index.html` file containing `html`.
+    With port=0 (the default) the OS picks a free port, available as
+    `self.port` once entered. The server is ready when `__enter__` returns.
     Cleans up (stops server, removes temp dir) when done.
     """
 
-    def __init__(self, port: int, html: str):
+    def __init__(self, html: str, port: int = 0):
         self.port = port
         self.html = html
         self._tmpdir = None
@@ -70,7 +86,9 @@ class HttpServerContext:
             port=self.port,
             directory=self._tmpdir
         )
+        self.port = self._server_thread.port
         self._server_thread.start()
+        self._server_thread.ready.wait(timeout=5)
 
         return self  # So the user can reference this context object if needed
 
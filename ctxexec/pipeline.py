@@ -2,6 +2,9 @@
 
 from ctxexec.cand_sp_exec import CandSpiderExecutor
 
+from utils.budget import get_budget_stop_reason
+from utils.tracing import span
+
 
 def execute_cand_spiders(
     CAND_SPIDER_CREATION_RESULTS,
@@ -10,8 +13,6 @@ def execute_cand_spiders(
         ):
     CAND_SPIDER_EXEC_RESULTS: dict[int, CandSpiderExecutor] = {}
 
-    port_offset: int = 0
-
     actual_exec_instance: int = 0
 
     for key, chunk in CAND_SPIDER_CREATION_RESULTS.items():
@@ -19,15 +20,17 @@ def execute_cand_spiders(
             print(f"{'-' * 50}", key)
             print(f"ACTUAL EXEC INSTANCE: {actual_exec_instance}")
             if chunk is not None and chunk.spider_code not in [None, ""]:
+                stop_reason: str | None = get_budget_stop_reason()
+                if stop_reason is not None:
+                    print(f"Stopping candidate execution early. {stop_reason}")
+                    break
+
                 print("--- EXPLANATION ---")
                 print(chunk.explanation)
 
                 print("--- SPIDER CODE ---")
                 print(chunk.spider_code)
 
-                print("--- PORT OFFSET ---")
-                print(port_offset)
-
                 # input()
 
                 # Recordings data is used in
@@ -42,12 +45,10 @@ def execute_cand_spiders(
                 print("--- CAND SPIDER EXECUTION ---")
                 cand_spider_executor = CandSpiderExecutor(
                     spider_code=chunk.spider_code,
-                    recordings_data=recordings_data,
-                    port_offset=port_offset
+                    recordings_data=recordings_data
                 )
-                cand_spider_executor.start()
-
-                port_offset = cand_spider_executor.port_offset
+                with span("candidate_spider", roi_idx=key):
+                    cand_spider_executor.start()
 
                 print(cand_spider_executor.spider_code_output_with_local_addresses)
 
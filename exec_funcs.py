@@ -2,14 +2,22 @@
 
 import uuid
 
+import os
+import socket
 import threading
 from ptyprocess import PtyProcessUnicode
 from typing import Optional
 
+from enum import StrEnum
+
 import time
 
 import sys
 
+from utils.ports import bind_listening_socket
+from utils.ports import get_socket_port
+from utils.ports import parse_ready_line
+
 
 #######################
 #                     #
@@ -29,19 +37,35 @@ def generate_task_id() -> str:
 ##########################################
 
 
-def run_recording_api_with_pty(port=8000, folder_name="recordings", on_spawn=None):
+def run_recording_api_with_pty(
+    port=8000,
+    folder_name="recordings",
+    on_spawn=None,
+    sock: Optional[socket.socket] = None,
+    on_ready=None
+        ):
     """
     Spawns receive_bu_data.py under a pseudoterminal with the specified
     port and folder name. If on_spawn is given, it is a callback that
     receives the PtyProcessUnicode instance after it is spawned.
+
+    If `sock` is given, it is a listening socket already bound to `port`,
+    and the API serves on it instead of binding the port itself.
+    If on_ready is given, it is called once the API accepts requests.
     """
     cmd = [
-        "python",
+        sys.executable,
         "receive_bu_data.py",
         "--port", str(port),
         "--folder_name", folder_name
     ]
-    process = PtyProcessUnicode.spawn(cmd)
+    pass_fds = ()
+    if sock is not None:
+        # The child must inherit the socket across exec.
+        os.set_inheritable(sock.fileno(), True)
+        cmd += ["--fd", str(sock.fileno())]
+        pass_fds = (sock.fileno(),)
+    process = PtyProcessUnicode.spawn(cmd, pass_fds=pass_fds)
 
     # Let the caller (context manager) keep a reference to the process
     if on_spawn:
@@ -56,6 +80,8 @@ def run_recording_api_with_pty(port=8000, folder_name="recordings", on_spawn=Non
             if not output:  # EOF
                 break
             print(output, end="")
+            if on_ready and parse_ready_line(output) == port:
+                on_ready()
     except (EOFError, KeyboardInterrupt):
         print("\nTerminating the process...")
         process.terminate(force=True)
@@ -66,7 +92,9 @@ def run_recording_api_with_pty(port=8000, folder_name="recordings", on_spawn=Non
 def start_recording_api_thread(
     port=8000,
     folder_name="recordings",
-    on_spawn=None
+    on_spawn=None,
+    sock: Optional[socket.socket] = None,
+    on_ready=None
         ) -> threading.Thread:
     """
     Starts the run_recording_api_with_pty function on a separate daemon thread
@@ -74,7 +102,7 @@ def start_recording_api_thread(
     """
     api_thread = threading.Thread(
         target=run_recording_api_with_pty,
-        args=(port, folder_name, on_spawn),
+        args=(port, folder_name, on_spawn, sock, on_ready),
         daemon=True  # Daemon means it ends with main process
     )
     api_thread.start()
@@ -85,24 +113,50 @@ class RecordingAPIContext:
     """
     Context manager that starts the receive_bu_data.py API in a thread upon
     entering, and terminates it upon exiting.
+
+    The listening socket is bound here and handed to the API process, so
+    with port=None the OS picks a free port, read it from `self.port`.
+    Entering returns only once the API has announced it accepts requests.
     """
-    def __init__(self, port=8000, folder_name="recordings"):
+    def __init__(self, port=None, folder_name="recordings", ready_timeout=30):
         self.port = port
         self.folder_name = folder_name
+        self.ready_timeout = ready_timeout
         self._thread: Optional[threading.Thread] = None
         self._process: Optional[PtyProcessUnicode] = None
+        self._sock: Optional[socket.socket] = None
 
     def __enter__(self):
         """
         Enter the context by starting the API in a background thread.
-        We provide an `on_spawn` callback to capture the PtyProcessUnicode.
+        We provide an `on_spawn` callback to capture the PtyProcessUnicode,
+        and an `on_ready` callback to wait for the API to be up.
         """
         def on_spawn(process):
             self._process = process
 
+        ready = threading.Event()
+
+        self._sock = bind_listening_socket(port=self.port or 0)
+        self.port = get_socket_port(self._sock)
+
         self._thread = start_recording_api_thread(
-            port=self.port, folder_name=self.folder_name, on_spawn=on_spawn
+            port=self.port,
+            folder_name=self.folder_name,
+            on_spawn=on_spawn,
+            sock=self._sock,
+            on_ready=ready.set
         )
+
+        deadline = time.monotonic() + self.ready_timeout
+        while not ready.wait(timeout=0.1):
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                self.__exit__(None, None, None)
+                raise RuntimeError(
+                    f"The recording API on port {self.port} "
+                    f"did not become ready."
+                )
+
         return self  # We could return other info as needed
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -118,6 +172,11 @@ class RecordingAPIContext:
         # Wait for the thread to finish if it's still alive
         if self._thread is not None and self._thread.is_alive():
             self._thread.join()
+
+        # Our copy of the listening socket, the API process had its own.
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
         print("Context closed. The background API has been terminated.")
 
 
@@ -147,18 +206,17 @@ def run_recorder_with_pty(api_port: int, task: str) -> str:
     output_collected = []
     
     try:
-        while process.isalive():
-            # Attempt to read the pseudo-tty output in small chunks
+        while True:
+            # read() blocks until output is available,
+            # and raises EOFError once the child process has ended.
             try:
                 chunk = process.read(1024)
-                if chunk:
-                    # Accumulate output
-                    output_collected.append(chunk)
-                    # For real-time output, uncomment the line below
-                    # print(chunk, end='', flush=True)
             except EOFError:
-                # The child process has ended, stop reading
                 break
+            # Accumulate output
+            output_collected.append(chunk)
+            # For real-time output, uncomment the line below
+            # print(chunk, end='', flush=True)
     finally:
         # Close any open resources
         process.close(force=True)
@@ -167,6 +225,15 @@ def run_recorder_with_pty(api_port: int, task: str) -> str:
     return "".join(output_collected)
 
 
+class RecordingTransport(StrEnum):
+    # The recorder writes steps straight to the session store, see
+    # spidercreator.create_spider_async.
+    IN_PROCESS: str = "in_process"
+    # The recorder runs in its own process and posts steps
+    # to receive_bu_data.py.
+    HTTP: str = "http"
+
+
 #############################
 #                           #
 #   --- SPIDERCREATOR ---   #
@@ -180,6 +247,9 @@ def run_spider_creator_with_pty(task_id: str) -> str:
         python spidercreator.py --task_id <task_id>
     in a pseudo-tty using PtyProcessUnicode and return the process's output.
 
+    Kept for compatibility. In-process callers should use
+    spidercreator.run_spider_creator, which returns a structured result.
+
     :param task_id: The unique task identifier string.
     :return: The full output from the spawned process as a string.
     """
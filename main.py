@@ -1,47 +1,52 @@
 #!/usr/bin/env python3
 
-from exec_funcs import generate_task_id
+import asyncio
 
-from exec_funcs import RecordingAPIContext
-from exec_funcs import run_recorder_with_pty
+from exec_funcs import RecordingTransport
 
-from exec_funcs import run_spider_creator_with_pty
-
-from pathlib import Path
+from spidercreator import BatchTaskStatus
+from spidercreator import create_spider_async
+from spidercreator import create_spiders_batch_async
 
 
 def create_spider(
     browser_use_task: str,
-    api_port: int = 9000
+    api_port: int | None = None,
+    recording_transport: RecordingTransport = RecordingTransport.IN_PROCESS
         ) -> str:
-    # Generate a unique task_id for this session
-    task_id = generate_task_id()
-
-    print(f"task_id: {task_id}")
-
-    # Create a sub-folder per session
-    folder_name = f"recordings/{task_id}"
-
-    Path(folder_name).mkdir(parents=True, exist_ok=True)
-
-    # Start the API in a context manager
-    with RecordingAPIContext(
-        port=api_port,
-        folder_name=folder_name
-            ) as api_ctx:
-        print("Within the with-block: the API is running on a background thread.")
-        # Do whatever logic you want here. For example, sleeping or handling requests:
-
-        run_recorder_with_pty(
-            api_port=api_port,
-            task=browser_use_task
+    """
+    Records `browser_use_task` with browser-use, then generates a spider.
+    Synchronous wrapper around spidercreator.create_spider_async.
+    With RecordingTransport.HTTP, the recording API runs on `api_port`,
+    or on a free port picked by the OS if it is None.
+    """
+    spider_creator_result = asyncio.run(
+        create_spider_async(
+            browser_use_task=browser_use_task,
+            recording_transport=recording_transport,
+            api_port=api_port
         )
+    )
 
-        print("Exiting the with-block now...")
-
-    # Once we leave the with-block, the context manager stops the API process/thread
     print("Main script is done.")
 
-    run_spider_creator_with_pty(task_id=task_id)
-
-    return task_id
+    return spider_creator_result.task_id
+
+
+def create_spiders_batch(
+    browser_use_tasks: list[str],
+    max_concurrency: int = 4,
+    recording_transport: RecordingTransport = RecordingTransport.IN_PROCESS
+        ) -> list[BatchTaskStatus]:
+    """
+    Creates one spider per task, up to `max_concurrency` at a time.
+    Synchronous wrapper around spidercreator.create_spiders_batch_async.
+    Returns one status per task, in input order.
+    """
+    return asyncio.run(
+        create_spiders_batch_async(
+            browser_use_tasks=browser_use_tasks,
+            max_concurrency=max_concurrency,
+            recording_transport=recording_transport
+        )
+    )
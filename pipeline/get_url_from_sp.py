@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
+import functools
+
 from pydantic import BaseModel
 from pydantic import Field
 
-from shared import gpt4o_llm
+from shared import get_stage_llm
 
 from langchain_core.messages import HumanMessage
 
@@ -15,9 +17,11 @@ class URLList(BaseModel):
     )
 
 
-structured_url_list_llm = gpt4o_llm.with_structured_output(
-    URLList
-)
+@functools.cache
+def get_structured_url_list_llm():
+    return get_stage_llm("spider_urls").with_structured_output(
+        URLList
+    )
 
 
 URL_LIST_PROMPT = """
@@ -31,7 +35,7 @@ Give me the list of URLs present in that code.
 
 
 def get_urls_from_spider_code(spider_code: str) -> list[str]:
-    url_list = structured_url_list_llm.invoke(
+    url_list = get_structured_url_list_llm().invoke(
         [
             HumanMessage(
                 content=URL_LIST_PROMPT.format(
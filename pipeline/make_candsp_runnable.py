@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import functools
+
 from utils.utils import extract_first_python_code
 
 from typing import Optional
@@ -7,7 +9,7 @@ from typing import Optional
 from pydantic import BaseModel
 from pydantic import Field
 
-from shared import gpt4o_llm
+from shared import get_stage_llm
 
 from langchain_core.messages import HumanMessage
 
@@ -36,13 +38,15 @@ class SpiderCode(BaseModel):
     )
 
 
-structured_spider_code_improver_llm = gpt4o_llm.with_structured_output(
-    SpiderCode
-)
+@functools.cache
+def get_structured_spider_code_improver_llm():
+    return get_stage_llm("candidate_runnable").with_structured_output(
+        SpiderCode
+    )
 
 
 def make_cand_spider_runnable(spider_code: str):
-    spider_code_improved = structured_spider_code_improver_llm.invoke(
+    spider_code_improved = get_structured_spider_code_improver_llm().invoke(
         [
             HumanMessage(
                 content=SPIDER_REWRITTING_PROMPT.format(
@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
 
-from betterhtmlchunking import DomRepresentation
-from betterhtmlchunking.main import ReprLengthComparisionBy
-# from betterhtmlchunking.main import tag_list_to_filter_out
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from betterhtmlchunking import DomRepresentation
 
 
 def make_dom_representation(
     website_html: str,
     MAX_NODE_REPR_LENGTH: int
-        ) -> DomRepresentation:
+        ) -> "DomRepresentation":
+    # Imported here: betterhtmlchunking is slow to import
+    # and only needed once the pipeline reaches this stage.
+    from betterhtmlchunking import DomRepresentation
+    from betterhtmlchunking.main import ReprLengthComparisionBy
+    # from betterhtmlchunking.main import tag_list_to_filter_out
+
     # Create document representation with 20 character chunks.
     dom_repr = DomRepresentation(
         MAX_NODE_REPR_LENGTH=MAX_NODE_REPR_LENGTH,
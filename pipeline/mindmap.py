@@ -4,9 +4,11 @@ from langchain_core.messages import HumanMessage, SystemMessage
 from pydantic import Field
 from pydantic import BaseModel
 
-import json
+import functools
 
-from shared import o3_llm
+from planning.rec_encoding import MAX_EXTRACTED_CONTENT_TOKENS
+from planning.rec_encoding import encode_recordings
+from shared import get_stage_llm
 
 
 class Mermaid(BaseModel):
@@ -15,7 +17,9 @@ class Mermaid(BaseModel):
     mermaid_code: str = Field(description="Valid mermaid code.")
 
 
-mermaid_structured_llm = o3_llm.with_structured_output(Mermaid)
+@functools.cache
+def get_mermaid_structured_llm():
+    return get_stage_llm("mindmap").with_structured_output(Mermaid)
 
 
 MERMAID_WORK_MINDMAP_PROMPT: str = """
@@ -66,10 +70,18 @@ mindmap
 """
 
 
-def make_mermaid_mindmap(recordings) -> str:
-    mermaid_work_mindmap_final = mermaid_structured_llm.invoke(
+def make_mermaid_mindmap(
+    recordings,
+    max_extracted_content_tokens: int | None = MAX_EXTRACTED_CONTENT_TOKENS
+        ) -> str:
+    mermaid_work_mindmap_final = get_mermaid_structured_llm().invoke(
         [
-            HumanMessage(content=json.dumps(recordings)),
+            HumanMessage(
+                content=encode_recordings(
+                    recordings=recordings,
+                    max_extracted_content_tokens=max_extracted_content_tokens
+                )
+            ),
             SystemMessage(content=MERMAID_WORK_MINDMAP_PROMPT)
         ]
     )
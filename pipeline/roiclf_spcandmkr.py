@@ -1,17 +1,40 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import contextvars
+
 from pydantic import BaseModel
 from pydantic import Field
 
 from langchain_core.messages import HumanMessage
 
-from shared import o3_llm
+from shared import STAGE_TO_MODEL
+from shared import get_stage_llm
+
+from utils.budget import budget_stage
+from utils.budget import get_budget_stop_reason
+from utils.tracing import Span
+from utils.tracing import span
 
-from typing import Optional
+from enum import StrEnum
+
+from typing import Any, Optional
 
 import prettyprinter
+from utils.utils import install_prettyprinter_extras
+
+install_prettyprinter_extras()
+
+
+# ROIs classified at a time, per page.
+ROI_CLASSIFICATION_CONCURRENCY: int = 8
+
+# ROIs the prefilter rejects with less confidence (0 to 100) escalate
+# to the classifier model, see classify_roi.
+ROI_ESCALATION_CONFIDENCE: int = 80
 
-prettyprinter.install_extras()
+# Result of a ROI not classified because the budget ran out.
+ROI_SKIPPED = object()
 
 
 # NOTE: Maybe the criteria in the prompt can be improved.
@@ -79,65 +102,320 @@ def get_html_classification_result_struct(
     return HTMLClassificationResult
 
 
+class ROIPrefilterResult(BaseModel):
+    result: bool = Field(
+        ...,
+        description="Whether the piece of HTML matches what I am planning to do with the HTML."
+    )
+    confidence: int = Field(
+        ...,
+        description="Confidence in the result, from 0 (a guess) to 100 (certain)."
+    )
+    explanation: str = Field(
+        ...,
+        description="Short explanation"
+    )
+
+
+class ROIOutcome(StrEnum):
+    # No text, not sent to any model.
+    NO_TEXT: str = "no_text"
+    # Confidently rejected by the prefilter model.
+    REJECTED: str = "rejected"
+    # Sent to the classifier model after the prefilter.
+    ESCALATED: str = "escalated"
+    # Sent to the classifier model, without prefilter.
+    CLASSIFIED: str = "classified"
+
+
+def get_roi_classification_models() -> dict[str, str | None]:
+    """Models of the cascade, part of the checkpoint inputs."""
+    return {
+        "roi_prefilter": STAGE_TO_MODEL["roi_prefilter"],
+        "roi_classification": STAGE_TO_MODEL["roi_classification"]
+    }
+
+
+def classify_roi(
+    structured_roi_classifier_llm,
+    dom_repr,
+    idx: int,
+    planning: str,
+    HTMLClassificationResult: type[BaseModel],
+    structured_roi_prefilter_llm=None,
+    escalation_confidence: int = ROI_ESCALATION_CONFIDENCE
+        ) -> tuple[Any, ROIOutcome]:
+    """
+    Classifies one ROI and writes its candidate spider. Returns the
+    result and how it was reached.
+
+    ROIs with no text are False, without calling any model. With a
+    prefilter model, ROIs it rejects with at least `escalation_confidence`
+    get a negative result without spider code. The others escalate to
+    the classifier model, and so do those the prefilter gave no answer
+    for or failed on.
+    """
+    roi_html_render: str =\
+        dom_repr.render_system.get_roi_html_render_with_pos_xpath(
+            roi_idx=idx
+        )
+
+    # -> ROI Text render:
+    roi_text_render: str =\
+        dom_repr.render_system.get_roi_text_render_with_pos_xpath(
+            roi_idx=idx
+        )
+
+    if roi_text_render.strip() == "":
+        return False, ROIOutcome.NO_TEXT
+
+    messages: list[HumanMessage] = [
+        HumanMessage(
+            content=ROI_CLASSIFICATION_PROMPT.format(
+                website_html=roi_html_render,
+                planning=planning
+            )
+        )
+    ]
+
+    outcome: ROIOutcome = ROIOutcome.CLASSIFIED
+    if structured_roi_prefilter_llm is not None:
+        # Charged apart, to see what the prefilter costs.
+        with budget_stage("roi_prefilter"):
+            try:
+                prefilter_result = structured_roi_prefilter_llm.invoke(
+                    messages
+                )
+            except Exception as e:
+                # Uncertain: the classifier decides.
+                print(f"ROI {idx} prefilter failed, escalating: {e}")
+                prefilter_result = None
+
+        if prefilter_result is not None and\
+                not prefilter_result.result and\
+                prefilter_result.confidence >= escalation_confidence:
+            print(
+                f"ROI {idx} rejected by the prefilter "
+                f"({prefilter_result.confidence}): "
+                f"{prefilter_result.explanation}"
+            )
+            return (
+                HTMLClassificationResult(
+                    result=False,
+                    explanation=(
+                        f"Rejected by the prefilter, confidence "
+                        f"{prefilter_result.confidence}: "
+                        f"{prefilter_result.explanation}"
+                    ),
+                    spider_code=None
+                ),
+                ROIOutcome.REJECTED
+            )
+        outcome = ROIOutcome.ESCALATED
+
+    html_classification_result = structured_roi_classifier_llm.invoke(messages)
+
+    # One print per ROI, so concurrent classifications don't interleave.
+    print(
+        f"{'*' * 50}\nIDX: {idx}\n{roi_text_render}\n"
+        f"--- HTML CLASSIFICATION RESULT -> IDX: {idx} ---\n"
+        f"{prettyprinter.pformat(html_classification_result)}"
+    )
+
+    return html_classification_result, outcome
+
+
 def classify_roi_html_create_cand_spider(
     dom_repr,
     extracted_content_on_rec: str,
     planning: str,
-    max_exec_amt: int = 75
+    max_exec_amt: int = 75,
+    max_concurrency: int = ROI_CLASSIFICATION_CONCURRENCY,
+    escalation_confidence: int = ROI_ESCALATION_CONFIDENCE
         ):
-
+    """
+    Classifies the first `max_exec_amt` ROIs of the page, in position
+    order, up to `max_concurrency` at a time. The clients throttle and
+    retry the calls, see utils.rate_limiter.
+
+    Classification is a cascade: the roi_prefilter model of
+    STAGE_TO_MODEL rejects the clear negatives, and the rest escalate to
+    the roi_classification model, which writes the candidate spiders
+    (see classify_roi). The escalation rate is recorded on the
+    `roi_cascade` span, see print_roi_cascade_report.
+
+    Returns the results by ROI index, in position order whatever the
+    finishing order. ROIs not started because the budget ran out (see
+    utils.budget) are left out. If a classification fails, the ROIs not
+    started yet are cancelled, and the running ones finish before the
+    error is raised.
+    """
     HTMLClassificationResult = get_html_classification_result_struct(
         extracted_content_on_rec=extracted_content_on_rec
     )
 
-    structured_roi_classifier_llm = o3_llm.with_structured_output(
+    structured_roi_classifier_llm = get_stage_llm(
+        "roi_classification"
+    ).with_structured_output(
         HTMLClassificationResult
     )
 
-    CAND_SPIDER_CREATION_RESULTS: dict[int, bool] = {}
+    structured_roi_prefilter_llm = None
+    if STAGE_TO_MODEL["roi_prefilter"] is not None:
+        structured_roi_prefilter_llm = get_stage_llm(
+            "roi_prefilter"
+        ).with_structured_output(
+            ROIPrefilterResult
+        )
 
-    exec_amt: int = 0
+    roi_idxs: list[int] = list(
+        dom_repr.tree_regions_system.sorted_roi_by_pos_xpath
+    )[:max_exec_amt]
+
+    def run_classification(idx: int):
+        # Checked when the ROI starts, not when it is queued.
+        if get_budget_stop_reason() is not None:
+            return ROI_SKIPPED
+        return classify_roi(
+            structured_roi_classifier_llm=structured_roi_classifier_llm,
+            dom_repr=dom_repr,
+            idx=idx,
+            planning=planning,
+            HTMLClassificationResult=HTMLClassificationResult,
+            structured_roi_prefilter_llm=structured_roi_prefilter_llm,
+            escalation_confidence=escalation_confidence
+        )
 
-    # --- Classify ROI:
-    for idx in dom_repr.tree_regions_system.sorted_roi_by_pos_xpath:
-        print("*" * 50)
-        print(f"IDX: {idx}")
-        roi_html_render: str =\
-            dom_repr.render_system.get_roi_html_render_with_pos_xpath(
-                roi_idx=idx
+    with span(
+            "roi_cascade",
+            **get_roi_classification_models(),
+            escalation_confidence=escalation_confidence) as cascade_span:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, max_concurrency)) as executor:
+            IDX_TO_FUTURE: dict[int, concurrent.futures.Future] = {
+                idx: executor.submit(
+                    contextvars.copy_context().run,
+                    run_classification,
+                    idx
+                )
+                for idx in roi_idxs
+            }
+            concurrent.futures.wait(
+                IDX_TO_FUTURE.values(),
+                return_when=concurrent.futures.FIRST_EXCEPTION
             )
+            # After a failure, ROIs not started yet are not paid for:
+            # the stage is checkpointed whole, so their results would
+            # be lost anyway.
+            for future in IDX_TO_FUTURE.values():
+                future.cancel()
+
+        for idx, future in IDX_TO_FUTURE.items():
+            if not future.cancelled() and future.exception() is not None:
+                print(f"ROI {idx} classification failed.")
+                raise future.exception()
+
+        CAND_SPIDER_CREATION_RESULTS: dict[int, Any] = {}
+        OUTCOME_TO_AMT: dict[str, int] = {
+            outcome: 0 for outcome in ROIOutcome
+        }
+        skipped_amt: int = 0
+        for idx, future in IDX_TO_FUTURE.items():
+            if future.result() is ROI_SKIPPED:
+                skipped_amt += 1
+                continue
+            result, outcome = future.result()
+            CAND_SPIDER_CREATION_RESULTS[idx] = result
+            OUTCOME_TO_AMT[outcome] += 1
+
+        cascade_span.set(**OUTCOME_TO_AMT)
+
+    if skipped_amt:
+        print(
+            f"Stopped ROI classification early, {skipped_amt} ROIs skipped. "
+            f"{get_budget_stop_reason()}"
+        )
 
-        # -> ROI Text render:
-        roi_text_render: str =\
-            dom_repr.render_system.get_roi_text_render_with_pos_xpath(
-                roi_idx=idx
-            )
-        print(roi_text_render)
-
-        if roi_text_render.strip() != "":
-            html_classification_result = structured_roi_classifier_llm.invoke(
-                [
-                    HumanMessage(
-                        content=ROI_CLASSIFICATION_PROMPT.format(
-                            website_html=roi_html_render,
-                            planning=planning
-                        )
-                    )
-                ]
-            )
+    if structured_roi_prefilter_llm is not None:
+        prefiltered_amt: int = (
+            OUTCOME_TO_AMT[ROIOutcome.REJECTED]
+            + OUTCOME_TO_AMT[ROIOutcome.ESCALATED]
+        )
+        escalation_rate: float = (
+            OUTCOME_TO_AMT[ROIOutcome.ESCALATED] / prefiltered_amt
+            if prefiltered_amt else 0.0
+        )
+        print(
+            f"ROI cascade: {prefiltered_amt} ROIs prefiltered, "
+            f"{OUTCOME_TO_AMT[ROIOutcome.REJECTED]} rejected, "
+            f"{OUTCOME_TO_AMT[ROIOutcome.ESCALATED]} escalated "
+            f"({escalation_rate:.0%})."
+        )
 
-            print(f"--- HTML CLASSIFICATION RESULT -> IDX: {idx} ---")
-            prettyprinter.cpprint(html_classification_result)
+    return CAND_SPIDER_CREATION_RESULTS
 
-            classification_result = html_classification_result
-        else:
-            classification_result = False
 
-        CAND_SPIDER_CREATION_RESULTS[idx] = classification_result
+def print_roi_cascade_report(spans: list[Span]):
+    """Prints the escalation rate of the ROI cascade over a run."""
+    cascade_spans: list[Span] = [
+        cascade_span for cascade_span in spans
+        if cascade_span.name == "roi_cascade"
+        and cascade_span.attributes.get("roi_prefilter") is not None
+    ]
+    if not cascade_spans:
+        return
 
-        exec_amt += 1
+    rejected_amt: int = sum(
+        cascade_span.attributes.get(ROIOutcome.REJECTED, 0)
+        for cascade_span in cascade_spans
+    )
+    escalated_amt: int = sum(
+        cascade_span.attributes.get(ROIOutcome.ESCALATED, 0)
+        for cascade_span in cascade_spans
+    )
+    prefiltered_amt: int = rejected_amt + escalated_amt
+    escalation_rate: float = (
+        escalated_amt / prefiltered_amt if prefiltered_amt else 0.0
+    )
+    attributes = cascade_spans[0].attributes
+
+    print("\n--- ROI CASCADE ---")
+    print(
+        f"{len(cascade_spans)} pages, {prefiltered_amt} ROIs prefiltered by "
+        f"{attributes['roi_prefilter']}: {rejected_amt} rejected, "
+        f"{escalated_amt} escalated to {attributes['roi_classification']} "
+        f"({escalation_rate:.0%}) at confidence "
+        f"{attributes['escalation_confidence']}."
+    )
 
-        if exec_amt >= max_exec_amt:
-            break
 
-    return CAND_SPIDER_CREATION_RESULTS
+def dump_cand_spider_creation_results(
+    CAND_SPIDER_CREATION_RESULTS: dict[int, Any]
+        ) -> dict[str, Any]:
+    """
+    JSON-serializable form of the results, for checkpoints. False (no
+    text) and None (no answer from the model) are kept as they are.
+    """
+    return {
+        str(idx): (
+            result.model_dump() if result not in [False, None] else result
+        )
+        for idx, result in CAND_SPIDER_CREATION_RESULTS.items()
+    }
+
+
+def load_cand_spider_creation_results(
+    data: dict[str, Any],
+    extracted_content_on_rec: str
+        ) -> dict[int, Any]:
+    """Inverse of dump_cand_spider_creation_results."""
+    HTMLClassificationResult = get_html_classification_result_struct(
+        extracted_content_on_rec=extracted_content_on_rec
+    )
+    return {
+        int(idx): (
+            HTMLClassificationResult.model_validate(result)
+            if result not in [False, None] else result
+        )
+        for idx, result in data.items()
+    }
@@ -6,9 +6,10 @@ from pydantic import BaseModel
 
 from utils.utils import extract_first_python_code
 
+import functools
 import json
 
-from shared import gpt4o_llm
+from shared import get_stage_llm
 
 from typing import Optional
 
@@ -37,9 +38,11 @@ class SpiderCode(BaseModel):
     )
 
 
-structured_spider_code_improver_llm = gpt4o_llm.with_structured_output(
-    SpiderCode
-)
+@functools.cache
+def get_structured_spider_code_improver_llm():
+    return get_stage_llm("address_remapping").with_structured_output(
+        SpiderCode
+    )
 
 
 def rewrite_ports_in_spider(
@@ -47,7 +50,7 @@ def rewrite_ports_in_spider(
     URL_TO_LOCAL_ADDRESSES: dict[str, str]
         ):
     spider_code_with_local_addresses =\
-        structured_spider_code_improver_llm.invoke(
+        get_structured_spider_code_improver_llm().invoke(
             [
                 HumanMessage(
                     content=SPIDER_ADDRESS_REMAPPING_PROMPT.format(
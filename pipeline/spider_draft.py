@@ -4,7 +4,9 @@ from typing import Any
 
 from langchain_core.messages import HumanMessage
 
-from shared import o3_llm
+from planning.rec_encoding import MAX_EXTRACTED_CONTENT_TOKENS
+from planning.rec_encoding import encode_recordings
+from shared import get_stage_llm
 
 
 DRAFT_SCRAPY_SPIDER_CREATION_PROMPT: str = """
@@ -30,13 +32,17 @@ It is based on what the user had seen.
 
 def make_scrapy_spider_draft(
     recordings: list[dict[str, Any]],
-    mermaid_code: str
+    mermaid_code: str,
+    max_extracted_content_tokens: int | None = MAX_EXTRACTED_CONTENT_TOKENS
         ) -> str:
-    scrapy_spider_draft = o3_llm.invoke(
+    scrapy_spider_draft = get_stage_llm("spider_draft").invoke(
         [
             HumanMessage(
                 content=DRAFT_SCRAPY_SPIDER_CREATION_PROMPT.format(
-                    recordings=recordings,
+                    recordings=encode_recordings(
+                        recordings=recordings,
+                        max_extracted_content_tokens=max_extracted_content_tokens
+                    ),
                     mindmap=mermaid_code
                 )
             )
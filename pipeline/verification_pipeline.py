@@ -1,12 +1,23 @@
 #!/usr/bin/env python3
 
-import time
-
 from pipeline.verify_sp_execution import verify_spider_exec_result
+from pipeline.verify_sp_execution import verify_spider_exec_results_listwise
+from pipeline.verify_sp_execution import VerificationMode
 from pipeline.verify_sp_execution import XPathExecutionVerificationResult
 
+from planning.rec_encoding import count_tokens
+
 from typing import Any
 
+from utils.budget import get_budget_stop_reason
+
+
+# Candidates per listwise verification call, and tokens of their code
+# and outputs. Calls stay well under the context window: rankings get
+# worse on very long prompts.
+LISTWISE_VERIFICATION_MAX_CANDIDATES: int = 8
+LISTWISE_VERIFICATION_MAX_TOKENS: int = 100_000
+
 
 def get_verification_criteria(plan_json: dict[str, Any]) -> str:
     verification_criteria: str = "\n".join(
@@ -38,30 +49,240 @@ def sort_spider_eval_results(
     return sorted_eval_results
 
 
-def run_verification_on_cand_spider_exec_results(
+def get_listwise_verification_chunk(
+    KEY_TO_TOKENS: dict[int, int],
+    max_candidates: int = LISTWISE_VERIFICATION_MAX_CANDIDATES,
+    max_tokens: int = LISTWISE_VERIFICATION_MAX_TOKENS
+        ) -> list[int]:
+    """
+    Takes the first keys of KEY_TO_TOKENS, in order, that fit in
+    `max_candidates` candidates and `max_tokens` tokens. A candidate
+    longer than `max_tokens` is taken on its own.
+    """
+    chunk: list[int] = []
+    chunk_tokens: int = 0
+    for key, tokens in KEY_TO_TOKENS.items():
+        if chunk and (
+                len(chunk) >= max_candidates
+                or chunk_tokens + tokens > max_tokens):
+            break
+        chunk.append(key)
+        chunk_tokens += tokens
+    return chunk
+
+
+def run_per_candidate_verification(
+    keys: list[int],
     CAND_SPIDER_EXEC_RESULTS: dict[int, Any],
     extracted_content_on_rec: str,
-    verification_criteria: str
-        ):
-    CAND_SPIDER_EXEC_EVAL_RESULT: dict[
-        int, XPathExecutionVerificationResult] = {}
+    verification_criteria: str,
+    CAND_SPIDER_EXEC_EVAL_RESULT: dict[int, XPathExecutionVerificationResult],
+    early_stop_score: int | None = None
+        ) -> bool:
+    """
+    Verifies the candidates of `keys` one call each, adding their
+    evaluations to CAND_SPIDER_EXEC_EVAL_RESULT.
+    Returns whether verification should stop: a candidate scored at
+    least `early_stop_score`, or the budget is used up.
+    """
+    for key in keys:
+        stop_reason: str | None = get_budget_stop_reason()
+        if stop_reason is not None:
+            print(f"Stopping verification early. {stop_reason}")
+            return True
 
-    for key, cand_spider_executor in CAND_SPIDER_EXEC_RESULTS.items():
-        time.sleep(5)
         print(f"Key: {key}")
-        spider_code_runnable: str = cand_spider_executor.spider_code_runnable
-        spider_output: str =\
-            cand_spider_executor.spider_code_output_with_local_addresses
+        cand_spider_executor = CAND_SPIDER_EXEC_RESULTS[key]
+        xpath_verification_result = verify_spider_exec_result(
+            spider_code_runnable=cand_spider_executor.spider_code_runnable,
+            verification_criteria=verification_criteria,
+            extracted_content_on_rec=extracted_content_on_rec,
+            spider_output=
+                cand_spider_executor.spider_code_output_with_local_addresses
+        )
+
+        CAND_SPIDER_EXEC_EVAL_RESULT[key] = xpath_verification_result
+
+        if early_stop_score is not None and\
+                xpath_verification_result.score >= early_stop_score:
+            print(
+                f"Candidate {key} scored {xpath_verification_result.score}"
+                f" >= {early_stop_score}. Stopping verification early."
+            )
+            return True
+
+    return False
+
+
+def run_listwise_verification(
+    keys: list[int],
+    CAND_SPIDER_EXEC_RESULTS: dict[int, Any],
+    extracted_content_on_rec: str,
+    verification_criteria: str,
+    CAND_SPIDER_EXEC_EVAL_RESULT: dict[int, XPathExecutionVerificationResult],
+    early_stop_score: int | None = None,
+    max_chunk_candidates: int = LISTWISE_VERIFICATION_MAX_CANDIDATES,
+    max_chunk_tokens: int = LISTWISE_VERIFICATION_MAX_TOKENS
+        ):
+    """
+    Verifies the candidates of `keys` a chunk per call (see
+    get_listwise_verification_chunk), adding their evaluations to
+    CAND_SPIDER_EXEC_EVAL_RESULT.
+
+    The best candidate so far joins each later chunk, within its limits,
+    so scores stay comparable across chunks: its new score replaces the
+    old one. It is left out of a chunk it would not fit in.
+    Candidates of a failed call, or left out of its answer, are
+    verified one by one instead.
+    """
+    KEY_TO_SPIDER: dict[int, tuple[str, str]] = {
+        key: (
+            CAND_SPIDER_EXEC_RESULTS[key].spider_code_runnable,
+            CAND_SPIDER_EXEC_RESULTS[key].spider_code_output_with_local_addresses
+        )
+        for key in keys
+    }
+    KEY_TO_TOKENS: dict[int, int] = {
+        key: count_tokens(spider_code_runnable + spider_output)
+        for key, (spider_code_runnable, spider_output)
+        in KEY_TO_SPIDER.items()
+    }
 
-        if spider_output.strip() != "":
-            xpath_verification_result = verify_spider_exec_result(
-                spider_code_runnable=spider_code_runnable,
+    remaining_keys: list[int] = list(keys)
+    listwise_call_amt: int = 0
+    fallback_amt: int = 0
+    while remaining_keys:
+        stop_reason: str | None = get_budget_stop_reason()
+        if stop_reason is not None:
+            print(f"Stopping verification early. {stop_reason}")
+            break
+
+        REMAINING_KEY_TO_TOKENS: dict[int, int] = {
+            key: KEY_TO_TOKENS[key] for key in remaining_keys
+        }
+        chunk: list[int] = []
+        if CAND_SPIDER_EXEC_EVAL_RESULT and\
+                max_chunk_candidates > 1:
+            best_key: int = max(
+                CAND_SPIDER_EXEC_EVAL_RESULT,
+                key=lambda key: CAND_SPIDER_EXEC_EVAL_RESULT[key].score
+            )
+            # The slot and the tokens of the best candidate are
+            # reserved in the chunk.
+            chunk = get_listwise_verification_chunk(
+                KEY_TO_TOKENS=REMAINING_KEY_TO_TOKENS,
+                max_candidates=max_chunk_candidates - 1,
+                max_tokens=max_chunk_tokens - KEY_TO_TOKENS[best_key]
+            )
+            chunk_tokens: int = sum(KEY_TO_TOKENS[key] for key in chunk)
+            if KEY_TO_TOKENS[best_key] + chunk_tokens > max_chunk_tokens:
+                chunk = []
+        if chunk:
+            chunk_keys: list[int] = [best_key, *chunk]
+        else:
+            chunk = get_listwise_verification_chunk(
+                KEY_TO_TOKENS=REMAINING_KEY_TO_TOKENS,
+                max_candidates=max_chunk_candidates,
+                max_tokens=max_chunk_tokens
+            )
+            chunk_keys = list(chunk)
+        remaining_keys = remaining_keys[len(chunk):]
+
+        print(f"Keys: {chunk_keys}")
+        listwise_call_amt += 1
+        try:
+            KEY_TO_VERIFICATION_RESULT = verify_spider_exec_results_listwise(
+                KEY_TO_SPIDER={key: KEY_TO_SPIDER[key] for key in chunk_keys},
                 verification_criteria=verification_criteria,
+                extracted_content_on_rec=extracted_content_on_rec
+            )
+        except Exception as e:
+            print(f"Listwise verification failed: {e}")
+            KEY_TO_VERIFICATION_RESULT = {}
+
+        CAND_SPIDER_EXEC_EVAL_RESULT.update(KEY_TO_VERIFICATION_RESULT)
+
+        missing_keys: list[int] = [
+            key for key in chunk if key not in KEY_TO_VERIFICATION_RESULT
+        ]
+        if missing_keys:
+            print(f"Verifying candidates {missing_keys} one by one.")
+            fallback_amt += len(missing_keys)
+            stopped: bool = run_per_candidate_verification(
+                keys=missing_keys,
+                CAND_SPIDER_EXEC_RESULTS=CAND_SPIDER_EXEC_RESULTS,
                 extracted_content_on_rec=extracted_content_on_rec,
-                spider_output=spider_output
+                verification_criteria=verification_criteria,
+                CAND_SPIDER_EXEC_EVAL_RESULT=CAND_SPIDER_EXEC_EVAL_RESULT,
+                early_stop_score=early_stop_score
             )
+            if stopped:
+                break
+
+        best_score: int = max(
+            [
+                CAND_SPIDER_EXEC_EVAL_RESULT[key].score
+                for key in chunk_keys
+                if key in CAND_SPIDER_EXEC_EVAL_RESULT
+            ],
+            default=0
+        )
+        if early_stop_score is not None and best_score >= early_stop_score:
+            print(
+                f"A candidate scored {best_score} >= {early_stop_score}. "
+                "Stopping verification early."
+            )
+            break
+
+    print(
+        f"Verified {len(CAND_SPIDER_EXEC_EVAL_RESULT)} candidates in "
+        f"{listwise_call_amt} listwise calls "
+        f"({fallback_amt} verified one by one)."
+    )
+
+
+def run_verification_on_cand_spider_exec_results(
+    CAND_SPIDER_EXEC_RESULTS: dict[int, Any],
+    extracted_content_on_rec: str,
+    verification_criteria: str,
+    early_stop_score: int | None = None,
+    verification_mode: VerificationMode = VerificationMode.LISTWISE
+        ):
+    """
+    Verifies the output of each executed candidate spider and returns
+    the evaluations sorted by score, best first.
+    Candidates are scored together a chunk per call, or one call each
+    with VerificationMode.PER_CANDIDATE.
+    Stops once a candidate scores at least `early_stop_score`, or when
+    the budget is used up (see utils.budget).
+    """
+    CAND_SPIDER_EXEC_EVAL_RESULT: dict[
+        int, XPathExecutionVerificationResult] = {}
 
-            CAND_SPIDER_EXEC_EVAL_RESULT[key] = xpath_verification_result
+    keys: list[int] = [
+        key for key, cand_spider_executor in CAND_SPIDER_EXEC_RESULTS.items()
+        if cand_spider_executor.spider_code_output_with_local_addresses
+        .strip() != ""
+    ]
+
+    if verification_mode == VerificationMode.LISTWISE:
+        run_listwise_verification(
+            keys=keys,
+            CAND_SPIDER_EXEC_RESULTS=CAND_SPIDER_EXEC_RESULTS,
+            extracted_content_on_rec=extracted_content_on_rec,
+            verification_criteria=verification_criteria,
+            CAND_SPIDER_EXEC_EVAL_RESULT=CAND_SPIDER_EXEC_EVAL_RESULT,
+            early_stop_score=early_stop_score
+        )
+    else:
+        run_per_candidate_verification(
+            keys=keys,
+            CAND_SPIDER_EXEC_RESULTS=CAND_SPIDER_EXEC_RESULTS,
+            extracted_content_on_rec=extracted_content_on_rec,
+            verification_criteria=verification_criteria,
+            CAND_SPIDER_EXEC_EVAL_RESULT=CAND_SPIDER_EXEC_EVAL_RESULT,
+            early_stop_score=early_stop_score
+        )
 
     CAND_SPIDER_EXEC_EVAL_RESULT: dict[
         int, XPathExecutionVerificationResult] = sort_spider_eval_results(
@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 
+import functools
+
 from pydantic import BaseModel
 from pydantic import Field
 
-from shared import gpt4o_llm
+from shared import get_stage_llm
 
 from langchain_core.messages import HumanMessage
 
+from enum import StrEnum
+
+
+class VerificationMode(StrEnum):
+    # Candidates scored together, a few per call.
+    LISTWISE = "listwise"
+    # One call per candidate.
+    PER_CANDIDATE = "per_candidate"
+
+
 XPATH_EXECUTION_VERIFICATION_PROMPT: str = """
 Spider Code:
 ```python
@@ -40,6 +52,48 @@ and provide a brief explanation of your evaluation.
 """
 
 
+LISTWISE_VERIFICATION_PROMPT: str = """
+Verification criteria:
+```
+{verification_criteria}
+```
+
+What is expected is: {extracted_content_on_rec}
+
+Candidate spiders:
+{candidates}
+
+You are an expert in web data extraction and information analysis
+with over 10 years of experience.
+- The website is already loaded. You don't need to verify that.
+- From the verification criteria, verify what makes sense to be verified.
+  For example, you can't verify clicks since you can't make a click.
+- Your task is to evaluate the results obtained by different web
+spiders that have extracted information from a specific website.
+For each result, analyze the amount of key data extracted,
+its relevance, and its completeness.
+- Compare the candidates with each other. Rank them from best to worst
+and assign each a score from 0 to 100 based on these criteria, so that
+a better candidate never gets a lower score.
+- Return one result per candidate, with its candidate id and
+a brief explanation of your evaluation.
+- Ignore encoding issues.
+"""
+
+LISTWISE_CANDIDATE_PROMPT: str = """
+--- CANDIDATE {candidate_id} ---
+Spider Code:
+```python
+{spider_code_runnable}
+```
+
+Spider execution result:
+```
+{spider_output}
+```
+"""
+
+
 class XPathExecutionVerificationResult(BaseModel):
     score: int = Field(
         ...,
@@ -51,9 +105,33 @@ class XPathExecutionVerificationResult(BaseModel):
     )
 
 
-structured_xpath_execution_verifier_llm = gpt4o_llm.with_structured_output(
-    XPathExecutionVerificationResult
-)
+class CandidateVerificationResult(BaseModel):
+    candidate_id: int = Field(
+        ...,
+        description="Id of the candidate."
+    )
+    score: int = Field(
+        ...,
+        description="Score from 0 to 100 based on the verification criteria."
+    )
+    explanation: str = Field(
+        ...,
+        description="Explanation"
+    )
+
+
+class ListwiseVerificationResult(BaseModel):
+    ranking: list[CandidateVerificationResult] = Field(
+        ...,
+        description="One result per candidate, from best to worst."
+    )
+
+
+@functools.cache
+def get_structured_xpath_execution_verifier_llm():
+    return get_stage_llm("verification").with_structured_output(
+        XPathExecutionVerificationResult
+    )
 
 
 def verify_spider_exec_result(
@@ -62,6 +140,9 @@ def verify_spider_exec_result(
     extracted_content_on_rec: str,
     spider_output: str
         ) -> XPathExecutionVerificationResult:
+    structured_xpath_execution_verifier_llm =\
+        get_structured_xpath_execution_verifier_llm()
+
     xpath_verification_result = structured_xpath_execution_verifier_llm.invoke(
         [
             HumanMessage(
@@ -76,3 +157,59 @@ def verify_spider_exec_result(
     )
 
     return xpath_verification_result
+
+
+@functools.cache
+def get_structured_listwise_verifier_llm():
+    return get_stage_llm("verification").with_structured_output(
+        ListwiseVerificationResult
+    )
+
+
+def verify_spider_exec_results_listwise(
+    KEY_TO_SPIDER: dict[int, tuple[str, str]],
+    verification_criteria: str,
+    extracted_content_on_rec: str
+        ) -> dict[int, XPathExecutionVerificationResult]:
+    """
+    Scores the candidates of `KEY_TO_SPIDER` (key -> runnable code and
+    output) against each other in one call. Returns their results best
+    first. Candidates the model left out are missing from the results.
+    """
+    structured_listwise_verifier_llm = get_structured_listwise_verifier_llm()
+
+    candidates: str = "".join(
+        LISTWISE_CANDIDATE_PROMPT.format(
+            candidate_id=key,
+            spider_code_runnable=spider_code_runnable,
+            spider_output=spider_output
+        )
+        for key, (spider_code_runnable, spider_output)
+        in KEY_TO_SPIDER.items()
+    )
+
+    listwise_verification_result = structured_listwise_verifier_llm.invoke(
+        [
+            HumanMessage(
+                content=LISTWISE_VERIFICATION_PROMPT.format(
+                    verification_criteria=verification_criteria,
+                    extracted_content_on_rec=extracted_content_on_rec,
+                    candidates=candidates
+                )
+            )
+        ]
+    )
+
+    KEY_TO_VERIFICATION_RESULT: dict[
+        int, XPathExecutionVerificationResult] = {}
+    for candidate_result in listwise_verification_result.ranking:
+        key: int = candidate_result.candidate_id
+        # Ids the model made up or repeated.
+        if key not in KEY_TO_SPIDER or key in KEY_TO_VERIFICATION_RESULT:
+            continue
+        KEY_TO_VERIFICATION_RESULT[key] = XPathExecutionVerificationResult(
+            score=candidate_result.score,
+            explanation=candidate_result.explanation
+        )
+
+    return KEY_TO_VERIFICATION_RESULT
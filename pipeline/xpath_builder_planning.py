@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
-from shared import o3_llm
+import functools
+
+from shared import get_stage_llm
 
 from langchain_core.messages import HumanMessage
 
@@ -29,7 +31,7 @@ def make_non_structured_planning(
     mermaid_code: str,
     scrapy_spider: str
         ) -> str:
-    xpath_builder_planning = o3_llm.invoke(
+    xpath_builder_planning = get_stage_llm("non_structured_planning").invoke(
         [
             HumanMessage(
                 content=XPATH_BUILDER_PLANNING_PROMPT.format(
@@ -66,9 +68,11 @@ class Planning(BaseModel):
     summary: str = Field(..., description="Summary")
 
 
-structured_xpath_builder_llm = o3_llm.with_structured_output(
-    Planning
-)
+@functools.cache
+def get_structured_xpath_builder_llm():
+    return get_stage_llm("structured_planning").with_structured_output(
+        Planning
+    )
 
 
 def make_structured_planning(
@@ -76,6 +80,8 @@ def make_structured_planning(
     scrapy_spider_draft: str
         ) -> Planning:
 
+    structured_xpath_builder_llm = get_structured_xpath_builder_llm()
+
     xpath_builder_structured_planning = structured_xpath_builder_llm.invoke(
         [
             HumanMessage(
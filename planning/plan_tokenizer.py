@@ -7,7 +7,6 @@ import attrs
 from attrs_strict import type_validator
 
 import validators
-import tldextract
 
 from enum import StrEnum
 
@@ -21,6 +20,9 @@ def validate_url(url: str) -> bool:
     Returns:
         bool: True if the domain structure is valid, False otherwise.
     """
+    # Imported here: tldextract pulls in requests and filelock.
+    import tldextract
+
     extracted = tldextract.extract(url)
 
     # Ensure there is a valid domain and suffix
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import functools
+import json
+
+from typing import Any
+
+
+# Tokens of extracted content kept per frame, see truncate_to_tokens.
+MAX_EXTRACTED_CONTENT_TOKENS: int = 1000
+
+# Tokenizer of o3 and gpt-4.1.
+PROMPT_TOKEN_ENCODING: str = "o200k_base"
+
+# Rough characters per token, when the tokenizer can't be loaded.
+CHARS_PER_TOKEN: int = 4
+
+# Keys of browser-use action dicts (mostly of `interacted_element`)
+# with layout details the pipeline never uses.
+ACTION_DROPPED_KEYS: set[str] = {
+    "entire_parent_branch_path",
+    "highlight_index",
+    "page_coordinates",
+    "viewport_coordinates",
+    "viewport_info",
+    "shadow_root"
+}
+
+
+@functools.cache
+def get_token_encoding():
+    """The tiktoken encoding of the prompts, None if it can't be loaded."""
+    import tiktoken
+
+    try:
+        return tiktoken.get_encoding(PROMPT_TOKEN_ENCODING)
+    except Exception as e:
+        # tiktoken downloads encodings on first use.
+        print(
+            f"Could not load the {PROMPT_TOKEN_ENCODING} tokenizer ({e}), "
+            f"estimating {CHARS_PER_TOKEN} characters per token."
+        )
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens of `text` in prompts (estimated without the tokenizer)."""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keeps the first `max_tokens` tokens of `text`, noting the cut."""
+    encoding = get_token_encoding()
+    if encoding is None:
+        max_chars: int = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        dropped_tokens: int = (len(text) - max_chars) // CHARS_PER_TOKEN
+        return f"{text[:max_chars]} [... {dropped_tokens} tokens truncated]"
+
+    tokens: list[int] = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    dropped_tokens = len(tokens) - max_tokens
+    return (
+        f"{encoding.decode(tokens[:max_tokens])}"
+        f" [... {dropped_tokens} tokens truncated]"
+    )
+
+
+def drop_empty(value: Any, dropped_keys: set[str] = frozenset()) -> Any:
+    """
+    Removes None values, the keys in `dropped_keys`, and the dicts and
+    lists left empty, at any depth.
+    """
+    if isinstance(value, dict):
+        compact_dict: dict[str, Any] = {}
+        for key, item in value.items():
+            if key in dropped_keys:
+                continue
+            item = drop_empty(item, dropped_keys=dropped_keys)
+            if item is None or item == {} or item == []:
+                continue
+            compact_dict[key] = item
+        return compact_dict
+    if isinstance(value, list):
+        compact_list: list[Any] = []
+        for item in value:
+            item = drop_empty(item, dropped_keys=dropped_keys)
+            if item is None or item == {} or item == []:
+                continue
+            compact_list.append(item)
+        return compact_list
+    return value
+
+
+def encode_recordings(
+    recordings: list[dict[str, Any]],
+    max_extracted_content_tokens: int | None = MAX_EXTRACTED_CONTENT_TOKENS
+        ) -> str:
+    """
+    Compact JSON of filtered recording frames (see RecordingInterpreter)
+    for prompts:
+    - Each frame gets its `step` number.
+    - Null fields and layout details of actions are dropped.
+    - Model thoughts and extracted content repeating those of the
+      previous frame are dropped, and so are frames left repeating the
+      previous frame.
+    - Extracted content is cut to `max_extracted_content_tokens`
+      (None keeps it whole).
+    """
+    encoded_frames: list[dict[str, Any]] = []
+    previous_frame: dict[str, Any] = {}
+
+    for step, frame in enumerate(recordings):
+        compact_frame: dict[str, Any] = drop_empty(
+            {
+                "url": frame.get("url"),
+                "model_thoughts": frame.get("model_thoughts"),
+                "model_actions": frame.get("model_actions"),
+                "extracted_content": frame.get("extracted_content")
+            },
+            dropped_keys=ACTION_DROPPED_KEYS
+        )
+        if compact_frame == previous_frame:
+            continue
+
+        encoded_frame: dict[str, Any] = {"step": step, **compact_frame}
+        for field in ["model_thoughts", "extracted_content"]:
+            if field in compact_frame and\
+                    compact_frame[field] == previous_frame.get(field):
+                del encoded_frame[field]
+        previous_frame = compact_frame
+
+        extracted_content = encoded_frame.get("extracted_content")
+        if isinstance(extracted_content, str) and\
+                max_extracted_content_tokens is not None:
+            encoded_frame["extracted_content"] = truncate_to_tokens(
+                text=extracted_content,
+                max_tokens=max_extracted_content_tokens
+            )
+
+        encoded_frames.append(encoded_frame)
+
+    return json.dumps(encoded_frames, ensure_ascii=False, separators=(",", ":"))
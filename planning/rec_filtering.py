@@ -11,6 +11,8 @@ from typing import Any
 
 from enum import StrEnum
 
+from utils.recordings import RecordingStep
+
 
 class TokenType(StrEnum):
     KEEP_GOING: str = "keep_going"
@@ -19,7 +21,7 @@ class TokenType(StrEnum):
 
 @attrs.define()
 class RecordingInterpreter:
-    recordings: list[dict[str, Any]] = attrs.field(
+    recordings: list[RecordingStep] = attrs.field(
         validator=type_validator()
     )
 
@@ -51,7 +53,8 @@ class RecordingInterpreter:
             print(f"I: {self.i}")
             self.actual_token = TokenType.KEEP_GOING
 
-            self.actual_frame = self.recordings[self.i].copy()
+            # Only step metadata: HTML and screenshots are never read here.
+            self.actual_frame = self.recordings[self.i].get_metadata()
             self.i += 1
         else:
             self.actual_token = TokenType.EOF
@@ -74,16 +77,18 @@ class RecordingInterpreter:
             self.advance()
             # prettyprinter.cpprint(self.actual_frame)
 
+            record = self.actual_frame
+
             # Make a deep copy so as not to mutate the original
-            record = copy.deepcopy(self.actual_frame)
-
-            filtered_frame = {
-                "url": record["url"],
-                "model_thoughts": record["model_thoughts"],
-                # "model_outputs": record["model_outputs"],
-                "model_actions": record["model_actions"],
-                "extracted_content": record["extracted_content"]
-            }
+            filtered_frame = copy.deepcopy(
+                {
+                    "url": record["url"],
+                    "model_thoughts": record["model_thoughts"],
+                    # "model_outputs": record["model_outputs"],
+                    "model_actions": record["model_actions"],
+                    "extracted_content": record["extracted_content"]
+                }
+            )
 
             self.filtered_recording[self.i - 1] = filtered_frame
 
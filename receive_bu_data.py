@@ -1,14 +1,27 @@
 #!/usr/bin/env python3
 
-import json
-from pathlib import Path
+import asyncio
+import contextlib
 
-from fastapi import FastAPI, Request
-import prettyprinter
+from fastapi import FastAPI, HTTPException, Request
 
-prettyprinter.install_extras()
+from utils.ports import format_ready_line
+from utils.session_store import SessionStore
+from utils.wire_format import decode_step_batch
+from utils.utils import install_prettyprinter_extras
 
-app = FastAPI()
+install_prettyprinter_extras()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup is done: tell the parent process (see
+    # exec_funcs.RecordingAPIContext) that steps can be posted.
+    print(format_ready_line(port=app.state.port), flush=True)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/post_agent_history_step")
@@ -18,41 +31,49 @@ async def post_agent_history_step(request: Request):
     print("-> Browser Use Recorder. Recording received!")
     # prettyprinter.cpprint(data)
 
-    # Retrieve the folder name from app.state
-    recordings_folder_name = app.state.folder_name
-    print("RECORDINGS FOLDER NAME")
-    print(recordings_folder_name)
-
-    # Ensure the folder exists
-    recordings_folder = Path(recordings_folder_name)
-    recordings_folder.mkdir(parents=True, exist_ok=True)
-
-    # Determine the next file number by examining existing .json files
-    existing_numbers = []
-    for item in recordings_folder.iterdir():
-        if item.is_file() and item.suffix == ".json":
-            try:
-                file_num = int(item.stem)
-                existing_numbers.append(file_num)
-            except ValueError:
-                # Ignore files that don't have an integer as the stem
-                pass
-
-    if existing_numbers:
-        next_number = max(existing_numbers) + 1
-    else:
-        next_number = 1
-
-    # Construct the file path
-    file_path = recordings_folder / f"{next_number}.json"
+    # The session store is created once, at startup, from --folder_name.
+    session_store: SessionStore = app.state.session_store
 
-    # Save the JSON data to the file
-    with file_path.open("w") as f:
-        json.dump(data, f, indent=2)
+    # Compressing, hashing and writing are blocking, keep them off the
+    # event loop.
+    file_path = await asyncio.to_thread(session_store.save_step, data=data)
 
     return {"status": "ok", "message": f"Saved to {file_path}"}
 
 
+@app.post("/post_agent_history_steps")
+async def post_agent_history_steps(request: Request):
+    """
+    Batch ingest path. Takes steps in the binary format of
+    utils.wire_format and writes their blobs to disk as received.
+    Decoding and saving run on worker threads.
+    """
+    body: bytes = await request.body()
+
+    try:
+        records, blobs = await asyncio.to_thread(decode_step_batch, body=body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    print(f"-> Browser Use Recorder. {len(records)} recordings received!")
+
+    session_store: SessionStore = app.state.session_store
+
+    try:
+        file_paths = await asyncio.to_thread(
+            session_store.save_step_batch,
+            records=records,
+            blobs=blobs
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "status": "ok",
+        "message": f"Saved to {[str(path) for path in file_paths]}"
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     import argparse
@@ -62,9 +83,19 @@ if __name__ == "__main__":
                         help="Port number on which the API will run")
     parser.add_argument("--folder_name", type=str, default="recordings",
                         help="Name of the folder where recordings will be saved")
+    parser.add_argument("--fd", type=int, default=None,
+                        help="File descriptor of an already listening socket "
+                             "to serve on, bound to --port by the parent")
     args = parser.parse_args()
 
-    # Store folder name in app's state so the route can see it
-    app.state.folder_name = args.folder_name
+    # Store the session store in app's state so the route can see it
+    app.state.session_store = SessionStore(folder_name=args.folder_name)
+    print("RECORDINGS FOLDER NAME")
+    print(args.folder_name)
+
+    app.state.port = args.port
 
-    uvicorn.run(app, host="0.0.0.0", port=args.port)
+    if args.fd is not None:
+        uvicorn.run(app, fd=args.fd)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-import requests
+import base64
+import functools
+import httpx
 
 from dotenv import load_dotenv
 from pyobjtojson import obj_to_json
@@ -10,136 +12,448 @@ from browser_use import Agent
 
 import prettyprinter
 
-prettyprinter.install_extras()
+from utils.session_store import SessionStore
+from utils.session_store import get_html_blob_ref
+from utils.session_store import get_screenshot_ref
+from utils.session_store import split_step_payloads
+from utils.wire_format import WIRE_CONTENT_TYPE
+from utils.wire_format import encode_step_batch
+from utils.utils import install_prettyprinter_extras
+
+install_prettyprinter_extras()
 
 load_dotenv()
 
-# 1. Setup an argument parser
-parser = argparse.ArgumentParser(description="Run the Agent with command-line args for port and task.")
-parser.add_argument(
-    "--port", 
-    type=int, 
-    default=9000, 
-    help="API port to send requests to. Default is 9000."
-)
-parser.add_argument(
-    "--task",
-    type=str,
-    help="Task prompt string to use for the agent."
-)
-args = parser.parse_args()
-
-# 2. Retrieve the port and task from arguments
-API_PORT = args.port
-TASK_PROMPT = args.task
-
-
-def send_agent_history_step(data):
-    """Send the agent history step data to the specified port."""
-    url = f"http://127.0.0.1:{API_PORT}/post_agent_history_step"
-    response = requests.post(url, json=data)
-    return response.json()
-
-
-async def record_activity(agent_obj):
-    """Hook function to record and send step-by-step agent activity."""
-    website_html = None
-    website_screenshot = None
-    urls_json_last_elem = None
-    model_thoughts_last_elem = None
-    model_outputs_json_last_elem = None
-    model_actions_json_last_elem = None
-    extracted_content_json_last_elem = None
 
-    print('--- ON_STEP_START ---')
-    website_html: str = await agent_obj.browser_context.get_page_html()
-    website_screenshot: str = await agent_obj.browser_context.take_screenshot()
+##########################
+#                        #
+#   --- STEP SINKS ---   #
+#                        #
+##########################
 
-    print("--> History:")
-    if hasattr(agent_obj, "state"):
-        history = agent_obj.state.history
-    else:
-        history = None
+# A recording sink receives the agent steps built by record_activity.
+# It has three coroutines: start(), send(data) and close(), which
+# flushes pending steps.
+# - AgentStepSender uploads steps to receive_bu_data.py over HTTP.
+#   Its `sent_blob_refs` are the blobs the server confirmed, the only
+#   ones later steps may reference (see PageSnapshotTracker).
+# - SessionStoreSink writes them to the session store in this process.
 
-    model_thoughts = obj_to_json(
-        obj=history.model_thoughts(),
-        check_circular=False
-    )
 
-    if len(model_thoughts) > 0:
-        model_thoughts_last_elem = model_thoughts[-1]
+class SessionStoreSink:
+    """
+    Writes agent steps straight to a SessionStore, with no HTTP server
+    in between. Compressing and writing happen on a worker thread so the
+    agent's event loop is not blocked.
+    """
+    def __init__(self, folder_name: str):
+        self.session_store = SessionStore(folder_name=folder_name)
 
-    model_outputs = agent_obj.state.history.model_outputs()
-    model_outputs_json = obj_to_json(
-        obj=model_outputs,
-        check_circular=False
-    )
+    async def start(self):
+        pass
 
-    if len(model_outputs_json) > 0:
-        model_outputs_json_last_elem = model_outputs_json[-1]
+    async def send(self, data: dict):
+        file_path = await asyncio.to_thread(
+            self.session_store.save_step, data
+        )
+        print(f"Saved to {file_path}")
 
-    model_actions = agent_obj.state.history.model_actions()
-    model_actions_json = obj_to_json(
-        obj=model_actions,
-        check_circular=False
-    )
+    async def close(self):
+        pass
 
-    if len(model_actions_json) > 0:
-        model_actions_json_last_elem = model_actions_json[-1]
 
-    extracted_content = agent_obj.state.history.extracted_content()
-    extracted_content_json = obj_to_json(
-        obj=extracted_content,
-        check_circular=False
-    )
-    if len(extracted_content_json) > 0:
-        extracted_content_json_last_elem = extracted_content_json[-1]
+class AgentStepSender:
+    """
+    Uploads agent steps to the recording API in the background.
 
-    print("--- URLS ---")
-    urls = agent_obj.state.history.urls()
-    prettyprinter.cpprint(urls)
-    urls_json = obj_to_json(
-        obj=urls,
-        check_circular=False
+    Steps go into a bounded queue and a single worker task posts them,
+    in order, over a persistent pooled connection. Uploads overlap with
+    the agent's next step, and `send` only waits when the queue is full.
+
+    Steps waiting in the queue are sent together, in the compressed binary
+    format of utils.wire_format. HTML and screenshot blobs the server
+    already has are not sent again.
+    Posts that failed in transit or on the server side are retried with
+    exponential backoff.
+    Call `close` when the agent is done to flush the queue.
+    """
+    def __init__(
+        self,
+        api_port: int,
+        max_queue_size: int = 8,
+        max_batch_size: int = 8,
+        max_retries: int = 5,
+        retry_base_delay: float = 0.5
+            ):
+        self.url = f"http://127.0.0.1:{api_port}/post_agent_history_steps"
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.sent_blob_refs: set[str] = set()
+        self._client: httpx.AsyncClient | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=60)
+        self._worker = asyncio.create_task(self._run())
+
+    async def send(self, data: dict):
+        await self.queue.put(data)
+
+    def _get_batch(self, first_data: dict) -> list[dict]:
+        batch: list[dict] = [first_data]
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    def _encode_batch(self, batch: list[dict]) -> tuple[bytes, set[str]]:
+        records: list[dict] = []
+        blobs: dict[str, bytes] = {}
+        for data in batch:
+            record, step_blobs = split_step_payloads(data=data)
+            records.append(record)
+            for blob_ref, content in step_blobs.items():
+                if blob_ref not in self.sent_blob_refs:
+                    blobs[blob_ref] = content
+        return encode_step_batch(records=records, blobs=blobs), set(blobs)
+
+    async def _run(self):
+        while True:
+            batch = self._get_batch(first_data=await self.queue.get())
+            try:
+                # Compressing multi-megabyte pages is CPU work,
+                # keep it off the agent's event loop.
+                body, blob_refs = await asyncio.to_thread(
+                    self._encode_batch, batch
+                )
+                if await self._post_with_retry(body=body):
+                    self.sent_blob_refs.update(blob_refs)
+            except Exception as e:
+                print(f"Error sending agent steps: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _post_with_retry(self, body: bytes) -> bool:
+        """
+        Posts `body` and returns whether the server accepted it. Only
+        transport errors and 5xx and 429 responses are retried: other
+        rejections would fail again, so the steps are dropped at once.
+        """
+        for attempt in range(self.max_retries):
+            try:
+                response = await self._client.post(
+                    self.url,
+                    content=body,
+                    headers={"Content-Type": WIRE_CONTENT_TYPE}
+                )
+            except httpx.TransportError as e:
+                error = e
+            else:
+                if response.is_success:
+                    return True
+                if response.status_code != 429 and\
+                        response.status_code < 500:
+                    print(
+                        "Dropping agent steps rejected by the server: "
+                        f"{response.status_code} {response.text}"
+                    )
+                    return False
+                error = f"{response.status_code} {response.text}"
+
+            delay: float = self.retry_base_delay * 2 ** attempt
+            print(f"Error sending agent steps (attempt {attempt + 1}): {error}")
+            await asyncio.sleep(delay)
+
+        print(f"Dropping agent steps after {self.max_retries} attempts.")
+        return False
+
+    async def close(self):
+        """Waits until every queued step is sent, then stops the worker."""
+        await self.queue.join()
+        if self._worker is not None:
+            self._worker.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class HistoryStepSerializer:
+    """
+    Serializes the agent history incrementally.
+
+    Only the history entries added since the previous call are serialized,
+    and the last serialized element of each field is remembered, so the
+    cost per step does not grow with the session length.
+    """
+    FIELDS: list[str] = [
+        "url",
+        "model_thoughts",
+        "model_outputs",
+        "model_actions",
+        "extracted_content"
+    ]
+
+    def __init__(self):
+        self.serialized_history_len: int = 0
+        self.last_elems: dict = {field: None for field in self.FIELDS}
+
+    def update(self, history) -> dict:
+        # The history accessors only iterate `history.history`, so running
+        # them on the new entries gives the same last elements as running
+        # them on the whole history.
+        new_history = history.model_copy(
+            update={"history": history.history[self.serialized_history_len:]}
+        )
+        self.serialized_history_len = len(history.history)
+
+        new_elems: dict = {
+            "url": new_history.urls(),
+            "model_thoughts": new_history.model_thoughts(),
+            "model_outputs": new_history.model_outputs(),
+            "model_actions": new_history.model_actions(),
+            "extracted_content": new_history.extracted_content()
+        }
+
+        for field, elems in new_elems.items():
+            if len(elems) > 0:
+                self.last_elems[field] = obj_to_json(
+                    obj=elems[-1],
+                    check_circular=False
+                )
+
+        return dict(self.last_elems)
+
+
+# Installs a MutationObserver once per document and returns keys that
+# change when the DOM changes (dom_key) or the visible area moves
+# (viewport_key). Much cheaper than reading the page HTML.
+PAGE_STATE_JS: str = """
+() => {
+    if (window.__spidercreator_page_state === undefined) {
+        const state = {
+            doc_id: Math.random().toString(36).slice(2),
+            mutations: 0
+        };
+        new MutationObserver((records) => {
+            state.mutations += records.length;
+        }).observe(document, {
+            subtree: true,
+            childList: true,
+            attributes: true,
+            characterData: true
+        });
+        window.__spidercreator_page_state = state;
+    }
+    const state = window.__spidercreator_page_state;
+    return {
+        dom_key: [location.href, state.doc_id, state.mutations].join("|"),
+        viewport_key: [
+            window.scrollX, window.scrollY,
+            window.innerWidth, window.innerHeight
+        ].join("|")
+    };
+}
+"""
+
+
+async def _return_none():
+    return None
+
+
+class PageSnapshotTracker:
+    """
+    Captures the page HTML and screenshot only when they may have changed.
+
+    The HTML is captured when the DOM changed since the previous step,
+    and the screenshot when the DOM or the viewport changed. Otherwise
+    the step references the previous snapshot, if its blob was delivered.
+    If it was not (e.g. its upload was dropped), the previous snapshot is
+    sent again instead.
+    If the page state can't be read, both are captured.
+    """
+    def __init__(self):
+        self.dom_key: str | None = None
+        self.viewport_key: str | None = None
+        self.website_html: str | None = None
+        self.website_html_ref: str | None = None
+        self.website_screenshot: str | None = None
+        self.website_screenshot_ref: str | None = None
+
+    async def get_page_state(self, browser_context) -> dict | None:
+        try:
+            page = await browser_context.get_current_page()
+            return await page.evaluate(PAGE_STATE_JS)
+        except Exception as e:
+            print(f"Could not read page state: {e}")
+            return None
+
+    async def capture(
+        self,
+        browser_context,
+        delivered_blob_refs: set[str] | None = None
+            ) -> dict:
+        """
+        Returns the snapshot fields of a step: `website_html` and
+        `website_screenshot` when captured, or the references of the
+        previous snapshot (`website_html_ref`, `website_screenshot_ref`).
+
+        Only blobs in `delivered_blob_refs` are referenced. None means
+        the sink delivers every step it accepts.
+        """
+        def is_delivered(blob_ref: str) -> bool:
+            return delivered_blob_refs is None or\
+                blob_ref in delivered_blob_refs
+
+        page_state = await self.get_page_state(browser_context)
+
+        html_changed: bool = (
+            page_state is None
+            or page_state["dom_key"] != self.dom_key
+            or self.website_html_ref is None
+        )
+        screenshot_changed: bool = (
+            html_changed
+            or page_state["viewport_key"] != self.viewport_key
+            or self.website_screenshot_ref is None
+        )
+
+        # Run the captures that are needed concurrently.
+        website_html, website_screenshot = await asyncio.gather(
+            browser_context.get_page_html()
+            if html_changed else _return_none(),
+            browser_context.take_screenshot()
+            if screenshot_changed else _return_none()
+        )
+
+        if page_state is not None:
+            self.dom_key = page_state["dom_key"]
+            self.viewport_key = page_state["viewport_key"]
+        else:
+            self.dom_key, self.viewport_key = None, None
+
+        snapshot: dict = {}
+
+        if html_changed:
+            self.website_html, self.website_html_ref = website_html, None
+            if isinstance(website_html, str):
+                self.website_html_ref = get_html_blob_ref(website_html)
+            snapshot["website_html"] = website_html
+        elif not is_delivered(self.website_html_ref):
+            print("--> Page HTML unchanged, not delivered yet: resending.")
+            snapshot["website_html"] = self.website_html
+        else:
+            print("--> Page HTML unchanged.")
+            snapshot["website_html_ref"] = self.website_html_ref
+
+        if screenshot_changed:
+            self.website_screenshot = website_screenshot
+            self.website_screenshot_ref = None
+            if isinstance(website_screenshot, str):
+                self.website_screenshot_ref = get_screenshot_ref(
+                    base64.b64decode(website_screenshot)
+                )
+            snapshot["website_screenshot"] = website_screenshot
+        elif not is_delivered(self.website_screenshot_ref):
+            print(
+                "--> Page screenshot unchanged, not delivered yet: resending."
+            )
+            snapshot["website_screenshot"] = self.website_screenshot
+        else:
+            print("--> Page screenshot unchanged.")
+            snapshot["website_screenshot_ref"] = self.website_screenshot_ref
+
+        return snapshot
+
+
+async def record_activity(
+    agent_obj,
+    recording_sink,
+    history_step_serializer: HistoryStepSerializer,
+    page_snapshot_tracker: PageSnapshotTracker
+        ):
+    """Hook function to record and send step-by-step agent activity."""
+    print('--- ON_STEP_START ---')
+    snapshot: dict = await page_snapshot_tracker.capture(
+        browser_context=agent_obj.browser_context,
+        delivered_blob_refs=getattr(recording_sink, "sent_blob_refs", None)
     )
 
-    if len(urls_json) > 0:
-        urls_json_last_elem = urls_json[-1]
-        prettyprinter.cpprint(urls_json_last_elem)
+    print("--> History:")
+    if hasattr(agent_obj, "state"):
+        history = agent_obj.state.history
+    else:
+        history = None
+
+    last_elems: dict = history_step_serializer.update(history=history)
+
+    print("--- URLS ---")
+    prettyprinter.cpprint(last_elems["url"])
 
     model_step_summary = {
-        "website_html": website_html,
-        "website_screenshot": website_screenshot,
-        "url": urls_json_last_elem,
-        "model_thoughts": model_thoughts_last_elem,
-        "model_outputs": model_outputs_json_last_elem,
-        "model_actions": model_actions_json_last_elem,
-        "extracted_content": extracted_content_json_last_elem
+        **snapshot,
+        "url": last_elems["url"],
+        "model_thoughts": last_elems["model_thoughts"],
+        "model_outputs": last_elems["model_outputs"],
+        "model_actions": last_elems["model_actions"],
+        "extracted_content": last_elems["extracted_content"]
     }
 
     print("--- MODEL STEP SUMMARY ---")
 
-    # Send data to the local server
-    send_agent_history_step(data=model_step_summary)
+    # Hand the step to the sink (local server or session store)
+    await recording_sink.send(data=model_step_summary)
 
 
-async def run_agent():
-    # 3. Construct your LLM and agent
+async def run_agent(task: str, recording_sink, max_steps: int = 30):
+    """
+    Run the agent on `task` with a maximum of `max_steps` steps,
+    recording each step into `recording_sink`.
+    """
     gpt41_model = ChatOpenAI(model="gpt-4.1")
     agent = Agent(
-        task=TASK_PROMPT,
+        task=task,
         llm=gpt41_model
     )
 
-    """Run the agent with a maximum of 30 steps, recording each step."""
+    await recording_sink.start()
+
     try:
         await agent.run(
-            on_step_start=record_activity,
-            max_steps=30
+            on_step_start=functools.partial(
+                record_activity,
+                recording_sink=recording_sink,
+                history_step_serializer=HistoryStepSerializer(),
+                page_snapshot_tracker=PageSnapshotTracker()
+            ),
+            max_steps=max_steps
         )
     except Exception as e:
         print(e)
+    finally:
+        # Flush the steps still waiting to be saved
+        await recording_sink.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(run_agent())
+    # Setup an argument parser
+    parser = argparse.ArgumentParser(description="Run the Agent with command-line args for port and task.")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=9000,
+        help="API port to send requests to. Default is 9000."
+    )
+    parser.add_argument(
+        "--task",
+        type=str,
+        help="Task prompt string to use for the agent."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(
+        run_agent(
+            task=args.task,
+            recording_sink=AgentStepSender(api_port=args.port)
+        )
+    )
@@ -1,18 +1,195 @@
 #!/usr/bin/env python3
 
-from langchain.chat_models import init_chat_model
-
-gpt4o_llm = init_chat_model(
-    # model="gpt-4o",
-    model="gpt-4.1",
-    model_provider="openai"
-)
-gpt41_llm = init_chat_model(
-    model="gpt-4.1",
-    model_provider="openai"
-)
-
-o3_llm = init_chat_model(
-    model="o3",
-    model_provider="openai"
-)
+import contextlib
+import functools
+import os
+from enum import StrEnum
+from pathlib import Path
+
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from langchain_core.caches import BaseCache
+
+
+# Chat models used by the pipeline, by their historical names.
+# gpt4o_llm kept its name but runs gpt-4.1.
+LLM_NAME_TO_MODEL: dict[str, str] = {
+    "gpt4o_llm": "gpt-4.1",
+    "gpt41_llm": "gpt-4.1",
+    "o3_llm": "o3"
+}
+
+# Model of each pipeline stage, see get_stage_llm. roi_prefilter is the
+# cheap first pass of the ROI classification cascade (None disables it),
+# see pipeline.roiclf_spcandmkr.
+STAGE_TO_MODEL: dict[str, str | None] = {
+    "mindmap": "o3",
+    "spider_draft": "o3",
+    "non_structured_planning": "o3",
+    "structured_planning": "o3",
+    "roi_prefilter": "gpt-4.1-mini",
+    "roi_classification": "o3",
+    "candidate_runnable": "gpt-4.1",
+    "spider_urls": "gpt-4.1",
+    "address_remapping": "gpt-4.1",
+    "verification": "gpt-4.1",
+    "spider_combination": "gpt-4.1"
+}
+
+
+class LLMBackend(StrEnum):
+    # The OpenAI API.
+    LIVE: str = "live"
+    # The OpenAI API, saving every response as a fixture.
+    RECORD: str = "record"
+    # Recorded fixtures only, offline.
+    REPLAY: str = "replay"
+    # Deterministic placeholder answers, offline.
+    STUB: str = "stub"
+
+
+# Read when a model is built. Environment variables, so a backend can
+# also be picked from the shell, e.g. for a benchmark script, without
+# changing code.
+LLM_BACKEND_ENV_VAR: str = "SPIDERCREATOR_LLM_BACKEND"
+LLM_FIXTURES_ENV_VAR: str = "SPIDERCREATOR_LLM_FIXTURES"
+LLM_FIXTURES_PATH: Path = Path("fixtures") / "llm"
+
+
+def get_llm_backend() -> tuple[LLMBackend, Path]:
+    """Returns the backend of the chat models and its fixtures folder."""
+    return (
+        LLMBackend(os.environ.get(LLM_BACKEND_ENV_VAR, LLMBackend.LIVE)),
+        Path(os.environ.get(LLM_FIXTURES_ENV_VAR, LLM_FIXTURES_PATH))
+    )
+
+
+def set_llm_backend(
+    backend: LLMBackend,
+    fixtures_path: Path = LLM_FIXTURES_PATH
+        ):
+    """
+    Serves the chat models from `backend`. Call it before the first LLM
+    call: models already built are dropped, but the structured output
+    wrappers of the pipeline keep the model they were built with.
+    """
+    os.environ[LLM_BACKEND_ENV_VAR] = LLMBackend(backend)
+    os.environ[LLM_FIXTURES_ENV_VAR] = str(fixtures_path)
+    get_chat_model.cache_clear()
+
+
+@functools.cache
+def get_chat_model(model: str):
+    """
+    Returns the OpenAI chat model client for `model`, built on first use.
+    One client is shared per model, so importing the pipeline does not
+    import langchain's providers nor set up OpenAI clients.
+
+    With the record and replay backends (see set_llm_backend), the
+    client saves its responses as fixtures, or is served only from them.
+    With the stub backend, a StubChatModel stands in for the client.
+    Calls to the model are throttled by its process-wide rate limiter,
+    see utils.rate_limiter.
+    """
+    from langchain.chat_models import init_chat_model
+    from openai import DefaultHttpxClient
+
+    from utils.llm_backend import FixtureStore
+    from utils.llm_backend import StubChatModel
+    from utils.llm_callbacks import BudgetCallbackHandler
+    from utils.llm_callbacks import RateLimitCallbackHandler
+    from utils.llm_callbacks import TracingCallbackHandler
+    from utils.rate_limiter import LLM_MAX_RETRIES
+    from utils.rate_limiter import get_rate_limiter
+
+    llm_backend, fixtures_path = get_llm_backend()
+    if llm_backend == LLMBackend.STUB:
+        return StubChatModel(
+            model_name=model,
+            # Never served from the LLM cache: its answers are free, and
+            # cached ones would lose their schema.
+            cache=False,
+            callbacks=[TracingCallbackHandler(), BudgetCallbackHandler()]
+        )
+
+    BACKEND_KWARGS: dict = {}
+    if llm_backend in [LLMBackend.RECORD, LLMBackend.REPLAY]:
+        # Takes the place of the global LLM cache for this client.
+        BACKEND_KWARGS["cache"] = FixtureStore(
+            folder=fixtures_path,
+            replay=llm_backend == LLMBackend.REPLAY
+        )
+    if llm_backend == LLMBackend.REPLAY and\
+            "OPENAI_API_KEY" not in os.environ:
+        # Never used: calls without a fixture raise before the API.
+        BACKEND_KWARGS["api_key"] = "replay"
+
+    # Shared by all the stages and threads calling the model.
+    rate_limiter = get_rate_limiter(model=model)
+
+    return init_chat_model(
+        model=model,
+        model_provider="openai",
+        rate_limiter=rate_limiter,
+        # The OpenAI client retries with jittered exponential backoff and
+        # honors Retry-After. 429s also pause the other callers.
+        max_retries=LLM_MAX_RETRIES,
+        http_client=DefaultHttpxClient(
+            event_hooks={"response": [rate_limiter.on_http_response]}
+        ),
+        # Record LLM spans and charge usage while a tracer or a budget
+        # controller is current, see utils.tracing and utils.budget, and
+        # debit the tokens from the model's quota.
+        callbacks=[
+            TracingCallbackHandler(),
+            BudgetCallbackHandler(),
+            RateLimitCallbackHandler(rate_limiter=rate_limiter)
+        ],
+        **BACKEND_KWARGS
+    )
+
+
+@contextlib.contextmanager
+def using_llm_cache(llm_cache: "BaseCache | None") -> Iterator[None]:
+    """
+    Serves the calls of every chat model from `llm_cache` while entered
+    (e.g. a utils.llm_cache.SQLiteLLMCache). Clients are built with no
+    cache of their own, so they all use LangChain's global cache.
+    """
+    from langchain_core.globals import get_llm_cache
+    from langchain_core.globals import set_llm_cache
+
+    previous_llm_cache = get_llm_cache()
+    set_llm_cache(llm_cache)
+    try:
+        yield
+    finally:
+        set_llm_cache(previous_llm_cache)
+
+
+def get_stage_llm(stage: str):
+    """The chat model of `stage`, per STAGE_TO_MODEL."""
+    model: str | None = STAGE_TO_MODEL[stage]
+    if model is None:
+        raise ValueError(f"Stage {stage} has no model.")
+    return get_chat_model(model=model)
+
+
+def get_gpt4o_llm():
+    return get_chat_model(model=LLM_NAME_TO_MODEL["gpt4o_llm"])
+
+
+def get_gpt41_llm():
+    return get_chat_model(model=LLM_NAME_TO_MODEL["gpt41_llm"])
+
+
+def get_o3_llm():
+    return get_chat_model(model=LLM_NAME_TO_MODEL["o3_llm"])
+
+
+def __getattr__(name: str):
+    # `from shared import o3_llm` keeps working, building the client then.
+    if name in LLM_NAME_TO_MODEL:
+        return get_chat_model(model=LLM_NAME_TO_MODEL[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,111 +1,386 @@
 #!/usr/bin/env python3
 
 import argparse
-import os
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import time
 from pathlib import Path
 import prettyprinter
-import pyhtml2md
 
-prettyprinter.install_extras()
+import attrs
+from attrs_strict import type_validator
+
+from typing import TYPE_CHECKING
+
+from utils.utils import install_prettyprinter_extras
+
+install_prettyprinter_extras()
 
 # -------------------------------------------------------------------
 # Importing your existing modules/functions
 # (Adjust these imports to match your actual project structure)
 # -------------------------------------------------------------------
+from utils.budget import BUDGET_REPORT_FILENAME
+from utils.budget import BudgetController
+from utils.budget import BudgetLimits
+from utils.budget import budget_stage
+from utils.budget import budget_to
+from utils.checkpoints import CHECKPOINTS_FOLDER_NAME
+from utils.checkpoints import CheckpointStore
 from utils.recordings import load_recordings
-from utils.utils import b64_to_png
+from utils.recordings import RecordingStep
+from utils.stage_graph import StageGraph
+from utils.tracing import TRACE_FILENAME
+from utils.tracing import Tracer
+from utils.tracing import span
+from utils.tracing import tracing_to
 
+from planning.rec_encoding import MAX_EXTRACTED_CONTENT_TOKENS
 from planning.rec_filtering import RecordingInterpreter
 from pipeline.mindmap import make_mermaid_mindmap
 from pipeline.spider_draft import make_scrapy_spider_draft
 from pipeline.xpath_builder_planning import make_non_structured_planning
 from pipeline.xpath_builder_planning import make_structured_planning
+from pipeline.xpath_builder_planning import InUrl
 from pipeline.xpath_builder_planning import Planning
 from planning.plan_tokenizer import PlanningTokenizer
 from planning.planner_to_rec import make_planner_idx_to_recording_idx
 from pipeline.make_dom_repr import make_dom_representation
-from betterhtmlchunking import DomRepresentation
 from pipeline.roiclf_spcandmkr import classify_roi_html_create_cand_spider
+from pipeline.roiclf_spcandmkr import ROI_CLASSIFICATION_CONCURRENCY
+from pipeline.roiclf_spcandmkr import ROI_ESCALATION_CONFIDENCE
+from pipeline.roiclf_spcandmkr import get_roi_classification_models
+from pipeline.roiclf_spcandmkr import print_roi_cascade_report
+from pipeline.roiclf_spcandmkr import dump_cand_spider_creation_results
+from pipeline.roiclf_spcandmkr import load_cand_spider_creation_results
 from ctxexec.pipeline import execute_cand_spiders
 from pipeline.verify_sp_execution import verify_spider_exec_result
 from pipeline.verify_sp_execution import XPathExecutionVerificationResult
 from pipeline.verification_pipeline import get_verification_criteria
 from pipeline.verification_pipeline import run_verification_on_cand_spider_exec_results
+from pipeline.verify_sp_execution import VerificationMode
 from pipeline.sp_combination import get_spider_combination
 
+from exec_funcs import generate_task_id
+from exec_funcs import RecordingTransport
+from shared import LLM_FIXTURES_PATH
+from shared import LLMBackend
+from shared import STAGE_TO_MODEL
+from shared import get_llm_backend
+from shared import set_llm_backend
+from shared import using_llm_cache
 
-def main():
+if TYPE_CHECKING:
+    from betterhtmlchunking import DomRepresentation
+    from utils.llm_cache import SQLiteLLMCache
+
+
+@attrs.define()
+class SpiderCreatorResult:
+    task_id: str = attrs.field(
+        validator=type_validator()
+    )
+
+    spider_code: str = attrs.field(
+        validator=type_validator()
+    )
+
+    spider_code_path: str = attrs.field(
+        validator=type_validator()
+    )
+
+    PLANNER_IDX_TO_RESULT: dict[int, dict[str, str]] = attrs.field(
+        validator=type_validator(),
+        repr=False
+    )
+
+
+def classify_rois(
+    website_html: str,
+    plan_json: dict,
+    extracted_content_on_rec: str,
+    max_roi_concurrency: int = ROI_CLASSIFICATION_CONCURRENCY,
+    roi_escalation_confidence: int = ROI_ESCALATION_CONFIDENCE
+        ) -> dict:
     """
-    Main entry point. Parses --task_id from the command line,
-    then uses that to decide where to read recordings from
-    and where to save results.
+    Builds the DOM representation of the page, then classifies its
+    regions of interest and writes candidate spiders for them.
     """
-    # Store the original working directory.
-    # We'll return to it before writing results.
-    original_cwd = os.getcwd()
+    # Make DOM representation
+    html_bytes: int = len(website_html.encode("utf-8"))
+    with span("dom_build", html_bytes=html_bytes) as dom_span:
+        dom_repr: "DomRepresentation" = make_dom_representation(
+            website_html=website_html,
+            MAX_NODE_REPR_LENGTH=32768  # 16384*2
+        )
+        roi_amt: int = len(dom_repr.tree_regions_system.sorted_roi_by_pos_xpath)
+        dom_span.set(roi_amt=roi_amt)
+    print(f"Regions of interest amount: {roi_amt}")
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--task_id",
-        required=True,
-        help="Task ID for reading from 'recordings/{task_id}' and saving results to 'results/{task_id}'"
-    )
-    args = parser.parse_args()
+    # Print minimal ROI info
+    for idx_roi in dom_repr.tree_regions_system.sorted_roi_by_pos_xpath:
+        print("-" * 50)
+        print(f"ROI IDX: {idx_roi}")
+        print(
+            dom_repr.render_system.get_roi_text_render_with_pos_xpath(
+                roi_idx=idx_roi
+            )
+        )
 
-    # -------------------------------------------------
-    # 1) Prepare Folders
-    # -------------------------------------------------
-    task_id = args.task_id
+    prettyprinter.cpprint(plan_json)
 
-    # Read from: recordings/{task_id}/
-    recordings_folder = Path("recordings") / task_id
-    # Write results to: results/{task_id}/
-    results_folder = Path("results") / task_id
-    results_folder.mkdir(parents=True, exist_ok=True)
+    # Classification + Candidate Spider Generation
+    with budget_stage("roi_classification"),\
+            span("roi_classification", roi_amt=roi_amt) as roi_span:
+        CAND_SPIDER_CREATION_RESULTS = classify_roi_html_create_cand_spider(
+            dom_repr=dom_repr,
+            extracted_content_on_rec=extracted_content_on_rec,
+            planning=plan_json,
+            max_exec_amt=75,
+            max_concurrency=max_roi_concurrency,
+            escalation_confidence=roi_escalation_confidence
+        )
+        roi_span.set(classified_amt=len(CAND_SPIDER_CREATION_RESULTS))
 
-    # -------------------------------------------------
-    # 2) Load the Recordings
-    # -------------------------------------------------
-    recordings_data = load_recordings(directory=str(recordings_folder))
+    return CAND_SPIDER_CREATION_RESULTS
 
-    # -------------------------------------------------
-    # 3) Existing Logic (Slightly Adapted)
-    # -------------------------------------------------
 
-    recordings_itpr = RecordingInterpreter(recordings=recordings_data)
-    recordings_itpr.start()
+def run_planner_iteration(
+    planner_idx: int,
+    plan: InUrl,
+    SELECTED_RECORDING: RecordingStep,
+    recordings_data: list[RecordingStep],
+    checkpoint_store: CheckpointStore,
+    early_stop_score: int | None = None,
+    max_roi_concurrency: int = ROI_CLASSIFICATION_CONCURRENCY,
+    roi_escalation_confidence: int = ROI_ESCALATION_CONFIDENCE,
+    verification_mode: VerificationMode = VerificationMode.LISTWISE
+        ) -> dict[str, str]:
+    """
+    Builds, runs and verifies candidate spiders for one URL of the plan.
+    Returns the best candidate's runnable code and output.
+    Verification stops at the first candidate scoring `early_stop_score`.
+    Up to `max_roi_concurrency` ROIs of the page are classified at a time.
+    ROIs the prefilter model rejects with less than
+    `roi_escalation_confidence` escalate to the classifier model.
+    Candidates are verified as set by `verification_mode`.
+    """
+    website_html: str = SELECTED_RECORDING.website_html
+    # Markdown of the page, unused for now. Example usage:
+    # import pyhtml2md
+    # markdown = pyhtml2md.convert(website_html)
+    website_url: str = SELECTED_RECORDING["url"]
+    extracted_content_on_rec: str = SELECTED_RECORDING["extracted_content"]
 
-    prettyprinter.cpprint(recordings_itpr.filtered_recording)
+    print("\n--- WEBSITE URL ON RECORDING ---")
+    print(website_url)
+    print("--- PLAN ---")
+    prettyprinter.cpprint(plan.model_dump())
+
+    # Screenshots are only read when asked for. Example usage:
+    # website_screenshot: bytes = SELECTED_RECORDING.website_screenshot
 
-    # '''
-    # --- Mindmap ---
-    mermaid_code: str = make_mermaid_mindmap(
-        recordings=recordings_itpr.get_filtered_recordings_list()
+    plan_json = plan.model_dump()
+
+    # The most expensive stage of an iteration, checkpointed on its own.
+    CAND_SPIDER_CREATION_RESULTS = checkpoint_store.run_stage(
+        stage=f"planner_{planner_idx}_roi_classification",
+        inputs={
+            "website_html": website_html,
+            "plan_json": plan_json,
+            "extracted_content_on_rec": extracted_content_on_rec,
+            "roi_models": get_roi_classification_models(),
+            "roi_escalation_confidence": roi_escalation_confidence
+        },
+        compute=functools.partial(
+            classify_rois,
+            website_html=website_html,
+            plan_json=plan_json,
+            extracted_content_on_rec=extracted_content_on_rec,
+            max_roi_concurrency=max_roi_concurrency,
+            roi_escalation_confidence=roi_escalation_confidence
+        ),
+        dump=dump_cand_spider_creation_results,
+        load=functools.partial(
+            load_cand_spider_creation_results,
+            extracted_content_on_rec=extracted_content_on_rec
+        )
     )
+
+    # Print quick summary
+    for key, chunk in CAND_SPIDER_CREATION_RESULTS.items():
+        if chunk not in [False, None]:
+            print(f"\n{'-' * 50} {key}")
+            print(f"Have desired content?: {chunk.result}\n")
+            if chunk.spider_code is not None:
+                print(chunk.spider_code)
+            print("--- EXPLANATION ---")
+            print(chunk.explanation)
+
+    # Execute Candidate Spiders
+    with budget_stage("candidate_execution"):
+        CAND_SPIDER_EXEC_RESULTS = execute_cand_spiders(
+            CAND_SPIDER_CREATION_RESULTS=CAND_SPIDER_CREATION_RESULTS,
+            recordings_data=recordings_data
+        )
+
+    # Print the results
+    for key, cand_spider_exec_obj in CAND_SPIDER_EXEC_RESULTS.items():
+        print("\n" + "*" * 80)
+        print(f"Key: {key}")
+        print(cand_spider_exec_obj.spider_code)
+        print("Result:")
+        print(cand_spider_exec_obj.spider_code_output_with_local_addresses[:5000])
+
+    # Verification
+    verification_criteria: str = get_verification_criteria(
+        plan_json=plan_json)
+    print("\n--- VERIFICATION CRITERIA ---")
+    print(verification_criteria)
+
+    with budget_stage("verification"),\
+            span("verification", candidate_amt=len(CAND_SPIDER_EXEC_RESULTS)):
+        CAND_SPIDER_EXEC_EVAL_RESULT = run_verification_on_cand_spider_exec_results(
+            CAND_SPIDER_EXEC_RESULTS=CAND_SPIDER_EXEC_RESULTS,
+            extracted_content_on_rec=extracted_content_on_rec,
+            verification_criteria=verification_criteria,
+            early_stop_score=early_stop_score,
+            verification_mode=verification_mode
+        )
+
+    for key, xpath_verification_result in CAND_SPIDER_EXEC_EVAL_RESULT.items():
+        print("\n" + "*" * 80)
+        print(f"Key: {key}")
+        sp_exec_ver_res = xpath_verification_result.model_dump()
+        prettyprinter.cpprint(sp_exec_ver_res)
+
+    if CAND_SPIDER_EXEC_EVAL_RESULT:
+        selected_key: int = list(CAND_SPIDER_EXEC_EVAL_RESULT.keys())[0]
+        spider_code_runnable: str = CAND_SPIDER_EXEC_RESULTS[selected_key].spider_code_runnable
+        spider_output: str = CAND_SPIDER_EXEC_RESULTS[selected_key].spider_code_output_with_local_addresses
+    else:
+        spider_code_runnable, spider_output = "", ""
+
+    print("\n--- SPIDER CODE RUNNABLE ---")
+    print(spider_code_runnable)
+    print("--- SPIDER OUTPUT ---")
+    print(spider_output)
+
+    return {
+        "spider_code_runnable": spider_code_runnable,
+        "spider_output": spider_output
+    }
+
+
+# -------------------------------------------------------------------
+# Pipeline stages.
+# Each stage is named after its output. Its keyword arguments are the
+# outputs of other stages, or initial values of the run (see
+# run_spider_creator). Outputs are checkpointed, see CheckpointStore.
+
+
+def run_mindmap_stage(
+    filtered_recordings: list,
+    checkpoint_store: CheckpointStore,
+    max_extracted_content_tokens: int | None
+        ) -> str:
+    with budget_stage("mindmap"):
+        mermaid_code: str = checkpoint_store.run_stage(
+            stage="mindmap",
+            inputs={
+                "recordings": filtered_recordings,
+                "max_extracted_content_tokens": max_extracted_content_tokens,
+                "model": STAGE_TO_MODEL["mindmap"]
+            },
+            compute=functools.partial(
+                make_mermaid_mindmap,
+                recordings=filtered_recordings,
+                max_extracted_content_tokens=max_extracted_content_tokens
+            )
+        )
     print("\n--- MERMAID WORK MINDMAP ---")
     print(mermaid_code)
+    return mermaid_code
 
-    # --- Spider Draft ---
-    scrapy_spider_draft: str = make_scrapy_spider_draft(
-        recordings=recordings_itpr.get_filtered_recordings_list(),
-        mermaid_code=mermaid_code
-    )
+
+def run_spider_draft_stage(
+    filtered_recordings: list,
+    mermaid_code: str,
+    checkpoint_store: CheckpointStore,
+    max_extracted_content_tokens: int | None
+        ) -> str:
+    with budget_stage("spider_draft"):
+        scrapy_spider_draft: str = checkpoint_store.run_stage(
+            stage="spider_draft",
+            inputs={
+                "recordings": filtered_recordings,
+                "mermaid_code": mermaid_code,
+                "max_extracted_content_tokens": max_extracted_content_tokens,
+                "model": STAGE_TO_MODEL["spider_draft"]
+            },
+            compute=functools.partial(
+                make_scrapy_spider_draft,
+                recordings=filtered_recordings,
+                mermaid_code=mermaid_code,
+                max_extracted_content_tokens=max_extracted_content_tokens
+            )
+        )
     print("\n--- SCRAPY SPIDER DRAFT ---")
     print(scrapy_spider_draft)
+    return scrapy_spider_draft
 
-    # --- XPATH Builder Planning (Non-structured) ---
-    xpath_builder_non_structured_planning = make_non_structured_planning(
-        mermaid_code=mermaid_code,
-        scrapy_spider=scrapy_spider_draft
-    )
+
+def run_non_structured_planning_stage(
+    mermaid_code: str,
+    scrapy_spider_draft: str,
+    checkpoint_store: CheckpointStore
+        ) -> str:
+    """
+    Same prompt as the structured planning, as free text. Nothing
+    consumes it, so it only runs when requested for debugging.
+    """
+    with budget_stage("non_structured_planning"):
+        xpath_builder_non_structured_planning: str = checkpoint_store.run_stage(
+            stage="non_structured_planning",
+            inputs={
+                "mermaid_code": mermaid_code,
+                "scrapy_spider_draft": scrapy_spider_draft,
+                "model": STAGE_TO_MODEL["non_structured_planning"]
+            },
+            compute=functools.partial(
+                make_non_structured_planning,
+                mermaid_code=mermaid_code,
+                scrapy_spider=scrapy_spider_draft
+            )
+        )
     print("\n--- XPATH BUILDER NON-STRUCTURED PLANNING ---")
     print(xpath_builder_non_structured_planning)
+    return xpath_builder_non_structured_planning
 
-    # --- XPATH Builder Planning (Structured) ---
-    xpath_builder_structured_planning: Planning = make_structured_planning(
-        mermaid_code=mermaid_code,
-        scrapy_spider_draft=scrapy_spider_draft
-    )
+
+def run_structured_planning_stage(
+    mermaid_code: str,
+    scrapy_spider_draft: str,
+    checkpoint_store: CheckpointStore
+        ) -> Planning:
+    with budget_stage("structured_planning"):
+        xpath_builder_structured_planning: Planning = checkpoint_store.run_stage(
+            stage="structured_planning",
+            inputs={
+                "mermaid_code": mermaid_code,
+                "scrapy_spider_draft": scrapy_spider_draft,
+                "model": STAGE_TO_MODEL["structured_planning"]
+            },
+            compute=functools.partial(
+                make_structured_planning,
+                mermaid_code=mermaid_code,
+                scrapy_spider_draft=scrapy_spider_draft
+            ),
+            dump=Planning.model_dump,
+            load=Planning.model_validate
+        )
     print("\n--- XPATH BUILDER STRUCTURED PLANNING ---")
     print("--> In URLs:")
     for recording in xpath_builder_structured_planning.in_url_list:
@@ -113,7 +388,13 @@ def main():
         prettyprinter.cpprint(recording.model_dump())
     print("--> Summary:")
     prettyprinter.cpprint(xpath_builder_structured_planning.summary)
+    return xpath_builder_structured_planning
+
 
+def run_planner_to_recording_stage(
+    recordings_itpr: RecordingInterpreter,
+    xpath_builder_structured_planning: Planning
+        ) -> dict[int, int]:
     planning_tokenizer = PlanningTokenizer(
         structured_planning=xpath_builder_structured_planning
     )
@@ -125,13 +406,41 @@ def main():
 
     print("\n--- PLANNER IDX TO RECORDING IDX ---")
     prettyprinter.cpprint(PLANNER_IDX_TO_RECORDING_IDX)
+    return PLANNER_IDX_TO_RECORDING_IDX
 
-    # -------------------------------------------------
-    # 4) Execute the Plan
-    # -------------------------------------------------
-    PLANNER_IDX_TO_RESULT: dict = {}
 
-    for planner_idx, recording_idx in PLANNER_IDX_TO_RECORDING_IDX.items():
+# Stages of STAGE_TO_MODEL run in a planner iteration, besides the ROI
+# classification (see get_roi_classification_models).
+PLANNER_ITERATION_STAGES: list[str] = [
+    "candidate_runnable",
+    "spider_urls",
+    "address_remapping",
+    "verification"
+]
+
+
+def run_planner_iterations_stage(
+    PLANNER_IDX_TO_RECORDING_IDX: dict[int, int],
+    xpath_builder_structured_planning: Planning,
+    recordings_itpr: RecordingInterpreter,
+    recordings_data: list[RecordingStep],
+    checkpoint_store: CheckpointStore,
+    max_planner_concurrency: int,
+    early_stop_score: int | None,
+    max_roi_concurrency: int,
+    roi_escalation_confidence: int,
+    verification_mode: VerificationMode
+        ) -> dict[int, dict[str, str]]:
+    """
+    Runs one planner iteration per planned URL, up to
+    `max_planner_concurrency` at a time. Iterations share no state, and
+    their local servers listen on ports picked by the OS.
+
+    Results are merged in planner index order, whatever the finishing
+    order. If an iteration fails, the others still finish (and are
+    checkpointed) before the error is raised.
+    """
+    def run_iteration(planner_idx: int, recording_idx: int):
         print("\n", "-" * 50)
         print(f"PLANNER IDX: {planner_idx}")
         print(f"RECORDING IDX: {recording_idx}")
@@ -139,125 +448,272 @@ def main():
         plan = xpath_builder_structured_planning.in_url_list[planner_idx]
         SELECTED_RECORDING = recordings_itpr.recordings[recording_idx]
 
-        website_html: str = SELECTED_RECORDING["website_html"]
-        markdown = pyhtml2md.convert(website_html)  # Example usage
-        website_url: str = SELECTED_RECORDING["url"]
-        extracted_content_on_rec: str = SELECTED_RECORDING["extracted_content"]
-        website_screenshot = SELECTED_RECORDING["website_screenshot"]
+        with span("planner_iteration", planner_idx=planner_idx):
+            return checkpoint_store.run_stage(
+                stage=f"planner_{planner_idx}",
+                inputs={
+                    "plan_json": plan.model_dump(),
+                    "url": SELECTED_RECORDING["url"],
+                    "website_html": SELECTED_RECORDING.website_html,
+                    "extracted_content_on_rec":
+                        SELECTED_RECORDING["extracted_content"],
+                    "early_stop_score": early_stop_score,
+                    "roi_models": get_roi_classification_models(),
+                    "models": {
+                        stage: STAGE_TO_MODEL[stage]
+                        for stage in PLANNER_ITERATION_STAGES
+                    },
+                    "roi_escalation_confidence": roi_escalation_confidence,
+                    "verification_mode": verification_mode
+                },
+                compute=functools.partial(
+                    run_planner_iteration,
+                    planner_idx=planner_idx,
+                    plan=plan,
+                    SELECTED_RECORDING=SELECTED_RECORDING,
+                    recordings_data=recordings_data,
+                    checkpoint_store=checkpoint_store,
+                    early_stop_score=early_stop_score,
+                    max_roi_concurrency=max_roi_concurrency,
+                    roi_escalation_confidence=roi_escalation_confidence,
+                    verification_mode=verification_mode
+                )
+            )
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, max_planner_concurrency)) as executor:
+        PLANNER_IDX_TO_FUTURE: dict[int, concurrent.futures.Future] = {
+            planner_idx: executor.submit(
+                contextvars.copy_context().run,
+                run_iteration,
+                planner_idx,
+                recording_idx
+            )
+            for planner_idx, recording_idx
+            in PLANNER_IDX_TO_RECORDING_IDX.items()
+        }
+        concurrent.futures.wait(PLANNER_IDX_TO_FUTURE.values())
+
+    PLANNER_IDX_TO_RESULT: dict = {}
+    for planner_idx, future in PLANNER_IDX_TO_FUTURE.items():
+        if future.exception() is not None:
+            print(f"Planner iteration {planner_idx} failed.")
+            raise future.exception()
+        PLANNER_IDX_TO_RESULT[planner_idx] = future.result()
 
-        print("\n--- WEBSITE URL ON RECORDING ---")
-        print(website_url)
-        print("--- PLAN ---")
-        prettyprinter.cpprint(plan.model_dump())
+    print("\n--- PLANNER IDX TO RESULT ---")
+    prettyprinter.cpprint(PLANNER_IDX_TO_RESULT)
+    return PLANNER_IDX_TO_RESULT
 
-        # Example usage: b64_to_png(website_screenshot, f"output_{recording_idx}.png")
 
-        # Make DOM representation
-        dom_repr: DomRepresentation = make_dom_representation(
-            website_html=website_html,
-            MAX_NODE_REPR_LENGTH=32768  # 16384*2
-        )
-        roi_amt: int = len(dom_repr.tree_regions_system.sorted_roi_by_pos_xpath)
-        print(f"Regions of interest amount: {roi_amt}")
-
-        # Print minimal ROI info
-        for idx_roi in dom_repr.tree_regions_system.sorted_roi_by_pos_xpath:
-            print("-" * 50)
-            print(f"ROI IDX: {idx_roi}")
-            print(
-                dom_repr.render_system.get_roi_text_render_with_pos_xpath(
-                    roi_idx=idx_roi
-                )
+def run_spider_combination_stage(
+    PLANNER_IDX_TO_RESULT: dict[int, dict[str, str]],
+    xpath_builder_structured_planning: Planning,
+    checkpoint_store: CheckpointStore
+        ) -> str:
+    with budget_stage("spider_combination"):
+        spider_code: str = checkpoint_store.run_stage(
+            stage="spider_combination",
+            inputs={
+                "PLANNER_IDX_TO_RESULT": PLANNER_IDX_TO_RESULT,
+                "planning": xpath_builder_structured_planning.model_dump(),
+                "model": STAGE_TO_MODEL["spider_combination"]
+            },
+            compute=functools.partial(
+                get_spider_combination,
+                PLANNER_IDX_TO_RESULT=PLANNER_IDX_TO_RESULT,
+                xpath_builder_structured_planning=xpath_builder_structured_planning
             )
+        )
 
-        plan_json = plan.model_dump()
-        prettyprinter.cpprint(plan_json)
+    print("\n--- SPIDER COMBINATION ---")
+    print(spider_code)
+    return spider_code
 
-        # Classification + Candidate Spider Generation
-        CAND_SPIDER_CREATION_RESULTS = classify_roi_html_create_cand_spider(
-            dom_repr=dom_repr,
-            extracted_content_on_rec=extracted_content_on_rec,
-            planning=plan_json,
-            max_exec_amt=75
-        )
 
-        # Print quick summary
-        for key, chunk in CAND_SPIDER_CREATION_RESULTS.items():
-            if chunk not in [False, None]:
-                print(f"\n{'-' * 50} {key}")
-                print(f"Have desired content?: {chunk.result}\n")
-                if chunk.spider_code is not None:
-                    print(chunk.spider_code)
-                print("--- EXPLANATION ---")
-                print(chunk.explanation)
-
-        # Execute Candidate Spiders
-        CAND_SPIDER_EXEC_RESULTS = execute_cand_spiders(
-            CAND_SPIDER_CREATION_RESULTS=CAND_SPIDER_CREATION_RESULTS,
-            recordings_data=recordings_data
-        )
+def build_spider_creator_graph() -> StageGraph:
+    stage_graph = StageGraph()
+
+    stage_graph.add_stage(
+        name="mermaid_code",
+        func=run_mindmap_stage,
+        inputs=[
+            "filtered_recordings",
+            "checkpoint_store",
+            "max_extracted_content_tokens"
+        ]
+    )
+    stage_graph.add_stage(
+        name="scrapy_spider_draft",
+        func=run_spider_draft_stage,
+        inputs=[
+            "filtered_recordings",
+            "mermaid_code",
+            "checkpoint_store",
+            "max_extracted_content_tokens"
+        ]
+    )
+    stage_graph.add_stage(
+        name="xpath_builder_non_structured_planning",
+        func=run_non_structured_planning_stage,
+        inputs=["mermaid_code", "scrapy_spider_draft", "checkpoint_store"],
+        debug_only=True
+    )
+    stage_graph.add_stage(
+        name="xpath_builder_structured_planning",
+        func=run_structured_planning_stage,
+        inputs=["mermaid_code", "scrapy_spider_draft", "checkpoint_store"]
+    )
+    stage_graph.add_stage(
+        name="PLANNER_IDX_TO_RECORDING_IDX",
+        func=run_planner_to_recording_stage,
+        inputs=["recordings_itpr", "xpath_builder_structured_planning"]
+    )
+    stage_graph.add_stage(
+        name="PLANNER_IDX_TO_RESULT",
+        func=run_planner_iterations_stage,
+        inputs=[
+            "PLANNER_IDX_TO_RECORDING_IDX",
+            "xpath_builder_structured_planning",
+            "recordings_itpr",
+            "recordings_data",
+            "checkpoint_store",
+            "max_planner_concurrency",
+            "early_stop_score",
+            "max_roi_concurrency",
+            "roi_escalation_confidence",
+            "verification_mode"
+        ]
+    )
+    stage_graph.add_stage(
+        name="spider_code",
+        func=run_spider_combination_stage,
+        inputs=[
+            "PLANNER_IDX_TO_RESULT",
+            "xpath_builder_structured_planning",
+            "checkpoint_store"
+        ]
+    )
 
-        # Print the results
-        for key, cand_spider_exec_obj in CAND_SPIDER_EXEC_RESULTS.items():
-            print("\n" + "*" * 80)
-            print(f"Key: {key}")
-            print(cand_spider_exec_obj.spider_code)
-            print("Result:")
-            print(cand_spider_exec_obj.spider_code_output_with_local_addresses[:5000])
+    return stage_graph
 
-        # Verification
-        verification_criteria: str = get_verification_criteria(
-            plan_json=plan_json)
-        print("\n--- VERIFICATION CRITERIA ---")
-        print(verification_criteria)
 
-        CAND_SPIDER_EXEC_EVAL_RESULT = run_verification_on_cand_spider_exec_results(
-            CAND_SPIDER_EXEC_RESULTS=CAND_SPIDER_EXEC_RESULTS,
-            extracted_content_on_rec=extracted_content_on_rec,
-            verification_criteria=verification_criteria
-        )
+def run_spider_creator(
+    task_id: str,
+    resume: bool = False,
+    debug_stages: list[str] | None = None,
+    max_planner_concurrency: int = 4,
+    max_roi_concurrency: int = ROI_CLASSIFICATION_CONCURRENCY,
+    roi_escalation_confidence: int = ROI_ESCALATION_CONFIDENCE,
+    budget: BudgetController | None = None,
+    early_stop_score: int | None = None,
+    verification_mode: VerificationMode = VerificationMode.LISTWISE,
+    llm_cache: "SQLiteLLMCache | None" = None,
+    max_extracted_content_tokens: int | None = MAX_EXTRACTED_CONTENT_TOKENS
+        ) -> SpiderCreatorResult:
+    """
+    Generates a spider from the recordings in 'recordings/{task_id}'
+    and saves it to 'results/{task_id}/spider_code.py'.
 
-        for key, xpath_verification_result in CAND_SPIDER_EXEC_EVAL_RESULT.items():
-            print("\n" + "*" * 80)
-            print(f"Key: {key}")
-            sp_exec_ver_res = xpath_verification_result.model_dump()
-            prettyprinter.cpprint(sp_exec_ver_res)
-
-        if CAND_SPIDER_EXEC_EVAL_RESULT:
-            selected_key: int = list(CAND_SPIDER_EXEC_EVAL_RESULT.keys())[0]
-            spider_code_runnable: str = CAND_SPIDER_EXEC_RESULTS[selected_key].spider_code_runnable
-            spider_output: str = CAND_SPIDER_EXEC_RESULTS[selected_key].spider_code_output_with_local_addresses
-        else:
-            spider_code_runnable, spider_output = "", ""
-
-        print("\n--- SPIDER CODE RUNNABLE ---")
-        print(spider_code_runnable)
-        print("--- SPIDER OUTPUT ---")
-        print(spider_output)
-
-        PLANNER_IDX_TO_RESULT[planner_idx] = {
-            "spider_code_runnable": spider_code_runnable,
-            "spider_output": spider_output
-        }
+    Stages run as a dependency graph, see build_spider_creator_graph.
+    Debug-only stages (e.g. "xpath_builder_non_structured_planning")
+    run only if listed in `debug_stages`. Up to `max_planner_concurrency`
+    planned URLs are processed at a time, each classifying up to
+    `max_roi_concurrency` ROIs at a time.
 
-    print("\n--- PLANNER IDX TO RESULT ---")
-    prettyprinter.cpprint(PLANNER_IDX_TO_RESULT)
+    Models are picked per stage by shared.STAGE_TO_MODEL. ROIs go
+    through a cascade: those the roi_prefilter model rejects with at
+    least `roi_escalation_confidence` (0 to 100) never reach the
+    roi_classification model.
 
-    # Combine final spider code
-    spider_code: str = get_spider_combination(
-        PLANNER_IDX_TO_RESULT=PLANNER_IDX_TO_RESULT,
-        xpath_builder_structured_planning=xpath_builder_structured_planning
+    `budget` limits tokens, dollars and wall time of the task and of its
+    stages, see utils.budget. Verification of a planned URL stops at the
+    first candidate scoring `early_stop_score` (None to verify all).
+    Candidates are scored together, a few per call, or one call each
+    with VerificationMode.PER_CANDIDATE.
+
+    With an `llm_cache`, identical LLM calls (same model, prompt and
+    output schema) are served from it instead of the API.
+
+    Recordings are sent to the mindmap and draft prompts compacted (see
+    planning.rec_encoding), with the extracted content of each step cut
+    to `max_extracted_content_tokens`.
+
+    The output of every stage is checkpointed under
+    'results/{task_id}/checkpoints'. With resume=True, stages (and
+    planner iterations) whose inputs did not change are loaded from
+    their checkpoints instead of being run again.
+    """
+    # -------------------------------------------------
+    # 1) Prepare Folders
+    # -------------------------------------------------
+
+    # Read from: recordings/{task_id}/
+    recordings_folder = Path("recordings") / task_id
+    # Write results to: results/{task_id}/
+    results_folder = Path("results") / task_id
+    results_folder.mkdir(parents=True, exist_ok=True)
+
+    checkpoint_store = CheckpointStore(
+        folder=results_folder / CHECKPOINTS_FOLDER_NAME,
+        resume=resume
     )
 
-    print("\n--- SPIDER COMBINATION ---")
-    print(spider_code)
-    # '''
+    # -------------------------------------------------
+    # 2) Load the Recordings
+    # -------------------------------------------------
+    recordings_data = load_recordings(directory=str(recordings_folder))
+
+    # -------------------------------------------------
+    # 3) Run the Stages
+    # -------------------------------------------------
+
+    recordings_itpr = RecordingInterpreter(recordings=recordings_data)
+    recordings_itpr.start()
+
+    prettyprinter.cpprint(recordings_itpr.filtered_recording)
 
-    # spider_code = SPIDER_COMBINATION
-    os.chdir(original_cwd)
+    stage_graph = build_spider_creator_graph()
+
+    # Spans of every stage, LLM call and candidate execution.
+    tracer = Tracer(trace_path=results_folder / TRACE_FILENAME)
+
+    if budget is None:
+        # Unlimited, usage is still reported.
+        budget = BudgetController()
+
+    with tracing_to(tracer), budget_to(budget), using_llm_cache(llm_cache):
+        STAGE_OUTPUTS = stage_graph.run(
+            initial_values={
+                "recordings_data": recordings_data,
+                "recordings_itpr": recordings_itpr,
+                "filtered_recordings":
+                    recordings_itpr.get_filtered_recordings_list(),
+                "checkpoint_store": checkpoint_store,
+                "max_planner_concurrency": max_planner_concurrency,
+                "max_roi_concurrency": max_roi_concurrency,
+                "roi_escalation_confidence": roi_escalation_confidence,
+                "early_stop_score": early_stop_score,
+                "verification_mode": verification_mode,
+                "max_extracted_content_tokens": max_extracted_content_tokens
+            },
+            targets=["spider_code", "PLANNER_IDX_TO_RESULT"],
+            debug_stages=debug_stages
+        )
+
+    stage_graph.print_timing_report()
+    tracer.print_summary()
+    print_roi_cascade_report(spans=tracer.spans)
+    budget.print_report()
+    budget.save_report(report_path=results_folder / BUDGET_REPORT_FILENAME)
+    if llm_cache is not None:
+        llm_cache.print_stats()
+
+    spider_code: str = STAGE_OUTPUTS["spider_code"]
+    PLANNER_IDX_TO_RESULT = STAGE_OUTPUTS["PLANNER_IDX_TO_RESULT"]
 
     # -------------------------------------------------
-    # 5) Write the Final Spider Code to results/<task_id>/
+    # 4) Write the Final Spider Code to results/<task_id>/
     # -------------------------------------------------
     # Write spider code to results/{task_id}/spider_code.py
     spider_code_path = results_folder / "spider_code.py"
@@ -269,6 +725,394 @@ def main():
     print(f"\n[INFO] Final spider code has been saved to: {spider_code_path}")
     print("[INFO] Done.")
 
+    return SpiderCreatorResult(
+        task_id=task_id,
+        spider_code=spider_code,
+        spider_code_path=str(spider_code_path),
+        PLANNER_IDX_TO_RESULT=PLANNER_IDX_TO_RESULT
+    )
+
+
+async def create_spider_async(
+    browser_use_task: str,
+    recording_transport: RecordingTransport = RecordingTransport.IN_PROCESS,
+    api_port: int | None = None,
+    task_id: str | None = None,
+    budget: BudgetController | None = None
+        ) -> SpiderCreatorResult:
+    """
+    Records `browser_use_task` with browser-use and generates a spider,
+    all in this process. Returns the structured result.
+    With RecordingTransport.HTTP, the recorder runs under a PTY and posts
+    steps to the recording API on `api_port`, or on a free port picked by
+    the OS if it is None.
+    `budget` limits the spider generation, see run_spider_creator.
+    """
+    # Generate a unique task_id for this session
+    if task_id is None:
+        task_id = generate_task_id()
+
+    print(f"task_id: {task_id}")
+
+    # Create a sub-folder per session
+    folder_name = f"recordings/{task_id}"
+    Path(folder_name).mkdir(parents=True, exist_ok=True)
+
+    if recording_transport == RecordingTransport.IN_PROCESS:
+        # Imported here: browser_use is only needed when recording.
+        from record_activity import run_agent
+        from record_activity import SessionStoreSink
+
+        await run_agent(
+            task=browser_use_task,
+            recording_sink=SessionStoreSink(folder_name=folder_name)
+        )
+    elif recording_transport == RecordingTransport.HTTP:
+        from exec_funcs import RecordingAPIContext
+        from exec_funcs import run_recorder_with_pty
+
+        def record_with_http_api():
+            with RecordingAPIContext(
+                    port=api_port, folder_name=folder_name) as api_ctx:
+                # The API is ready, and its port known, once entered.
+                run_recorder_with_pty(
+                    api_port=api_ctx.port,
+                    task=browser_use_task
+                )
+
+        await asyncio.to_thread(record_with_http_api)
+    else:
+        raise ValueError(
+            f"Unknown recording transport: {recording_transport}"
+        )
+
+    # The pipeline makes blocking LLM calls, keep it off the event loop.
+    return await asyncio.to_thread(
+        run_spider_creator,
+        task_id=task_id,
+        budget=budget
+    )
+
+
+@attrs.define()
+class BatchTaskStatus:
+    browser_use_task: str = attrs.field(
+        validator=type_validator()
+    )
+
+    task_id: str = attrs.field(
+        validator=type_validator()
+    )
+
+    succeeded: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+
+    spider_code_path: str | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    error: str | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    elapsed_seconds: float = attrs.field(
+        validator=type_validator(),
+        default=0.0
+    )
+
+
+def print_batch_summary(batch_statuses: list[BatchTaskStatus]):
+    print("\n--- BATCH SUMMARY ---")
+    for status in batch_statuses:
+        outcome: str = "OK" if status.succeeded else "FAILED"
+        detail = status.spider_code_path if status.succeeded else status.error
+        print(
+            f"[{outcome}] {status.task_id} "
+            f"({status.elapsed_seconds:.1f}s): {detail}"
+        )
+    succeeded_amt: int = sum(status.succeeded for status in batch_statuses)
+    print(f"{succeeded_amt}/{len(batch_statuses)} spiders created.")
+
+
+async def create_spiders_batch_async(
+    browser_use_tasks: list[str],
+    max_concurrency: int = 4,
+    recording_transport: RecordingTransport = RecordingTransport.IN_PROCESS
+        ) -> list[BatchTaskStatus]:
+    """
+    Creates one spider per task, running up to `max_concurrency` tasks
+    at a time in this process. The LLM clients are shared by all tasks.
+
+    Every task gets its own task_id (and recordings/results folders).
+    Recording API and candidate spider servers listen on free ports
+    picked by the OS, so concurrent tasks never collide.
+    A failed task does not stop the others. Returns one status per task,
+    in input order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_task(browser_use_task: str) -> BatchTaskStatus:
+        status = BatchTaskStatus(
+            browser_use_task=browser_use_task,
+            task_id=generate_task_id()
+        )
+        async with semaphore:
+            start_time: float = time.monotonic()
+            try:
+                spider_creator_result = await create_spider_async(
+                    browser_use_task=browser_use_task,
+                    recording_transport=recording_transport,
+                    task_id=status.task_id
+                )
+                status.succeeded = True
+                status.spider_code_path = spider_creator_result.spider_code_path
+            except Exception as e:
+                print(f"Task {status.task_id} failed: {e}")
+                status.error = f"{type(e).__name__}: {e}"
+            status.elapsed_seconds = time.monotonic() - start_time
+        return status
+
+    batch_statuses: list[BatchTaskStatus] = await asyncio.gather(
+        *[
+            run_task(browser_use_task=browser_use_task)
+            for browser_use_task in browser_use_tasks
+        ]
+    )
+
+    print_batch_summary(batch_statuses=batch_statuses)
+
+    return list(batch_statuses)
+
+
+def get_optional_int(value: str) -> int | None:
+    """argparse type of integer options that take 'none'."""
+    if value.lower() == "none":
+        return None
+    return int(value)
+
+
+def main():
+    """
+    Main entry point. Parses --task_id (and --resume) from the command line,
+    then uses that to decide where to read recordings from
+    and where to save results.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--task_id",
+        required=True,
+        help="Task ID for reading from 'recordings/{task_id}' and saving results to 'results/{task_id}'"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Load unchanged stages from 'results/{task_id}/checkpoints' instead of running them again"
+    )
+    parser.add_argument(
+        "--debug_stages",
+        nargs="*",
+        default=[],
+        help="Debug-only stages to run too, e.g. xpath_builder_non_structured_planning"
+    )
+    parser.add_argument(
+        "--max_planner_concurrency",
+        type=int,
+        default=4,
+        help="Planned URLs processed at a time"
+    )
+    parser.add_argument(
+        "--max_roi_concurrency",
+        type=int,
+        default=ROI_CLASSIFICATION_CONCURRENCY,
+        help="ROIs of a page classified at a time"
+    )
+    parser.add_argument(
+        "--roi_escalation_confidence",
+        type=int,
+        default=ROI_ESCALATION_CONFIDENCE,
+        help="ROIs the prefilter model rejects with less confidence (0-100) escalate to the classifier model"
+    )
+    parser.add_argument(
+        "--stage_model",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("STAGE", "MODEL"),
+        help="Model of a stage, e.g. --stage_model roi_prefilter gpt-4.1-nano ('none' disables the ROI prefilter)"
+    )
+    parser.add_argument("--max_tokens", type=int, default=None,
+                        help="Token budget of the task")
+    parser.add_argument("--max_dollars", type=float, default=None,
+                        help="Dollar budget of the task")
+    parser.add_argument("--max_seconds", type=float, default=None,
+                        help="Wall time budget of the task")
+    parser.add_argument(
+        "--stage_budget",
+        nargs=3,
+        action="append",
+        default=[],
+        metavar=("STAGE", "LIMIT", "VALUE"),
+        help="Budget of a stage, e.g. --stage_budget roi_classification max_dollars 5"
+    )
+    parser.add_argument(
+        "--early_stop_score",
+        type=get_optional_int,
+        default=None,
+        help="Stop verifying a planned URL once a candidate scores this much ('none', the default, verifies all)"
+    )
+    parser.add_argument(
+        "--verification_mode",
+        choices=list(VerificationMode),
+        default=VerificationMode.LISTWISE,
+        help="listwise (candidates scored together, a few per call) or per_candidate (one call each)"
+    )
+    parser.add_argument(
+        "--llm_cache",
+        action="store_true",
+        help="Serve identical LLM calls from the LLM cache. Off by default, so reruns sample fresh answers"
+    )
+    parser.add_argument(
+        "--llm_cache_bypass",
+        action="store_true",
+        help="Skip LLM cache lookups but store the fresh responses"
+    )
+    parser.add_argument(
+        "--llm_cache_path",
+        type=Path,
+        default=None,
+        help="SQLite file of the LLM cache, 'results/llm_cache.sqlite3' by default"
+    )
+    parser.add_argument(
+        "--llm_cache_ttl",
+        type=float,
+        default=None,
+        help="Seconds an LLM cache entry stays valid, 30 days by default"
+    )
+    parser.add_argument(
+        "--llm_cache_max_mb",
+        type=float,
+        default=None,
+        help="Size of the LLM cache before evicting, 1024 MB by default"
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=int,
+        default=None,
+        help="Requests per minute quota of each model, see utils.rate_limiter"
+    )
+    parser.add_argument(
+        "--tokens_per_minute",
+        type=int,
+        default=None,
+        help="Tokens per minute quota of each model, see utils.rate_limiter"
+    )
+    parser.add_argument(
+        "--llm_backend",
+        choices=list(LLMBackend),
+        default=None,
+        help="live (default), record (also save responses as fixtures), replay (fixtures only, offline) or stub (offline placeholders)"
+    )
+    parser.add_argument(
+        "--llm_fixtures",
+        type=Path,
+        default=LLM_FIXTURES_PATH,
+        help="Fixtures folder of the record and replay LLM backends"
+    )
+    parser.add_argument(
+        "--max_extracted_content_tokens",
+        type=int,
+        default=MAX_EXTRACTED_CONTENT_TOKENS,
+        help="Tokens of extracted content per recording step in the mindmap and draft prompts"
+    )
+    args = parser.parse_args()
+
+    if args.llm_backend is not None:
+        set_llm_backend(
+            backend=args.llm_backend,
+            fixtures_path=args.llm_fixtures
+        )
+    print(f"LLM backend: {get_llm_backend()[0]}")
+
+    from utils.rate_limiter import MODEL_TO_RATE_LIMITS
+
+    # Before any model is built, their limiters read the quotas then.
+    for rate_limits in MODEL_TO_RATE_LIMITS.values():
+        if args.requests_per_minute is not None:
+            rate_limits.requests_per_minute = args.requests_per_minute
+        if args.tokens_per_minute is not None:
+            rate_limits.tokens_per_minute = args.tokens_per_minute
+
+    for stage, model in args.stage_model:
+        if stage not in STAGE_TO_MODEL:
+            parser.error(f"Unknown stage: {stage}")
+        if model.lower() == "none" and stage != "roi_prefilter":
+            parser.error(f"Stage {stage} needs a model.")
+        STAGE_TO_MODEL[stage] = None if model.lower() == "none" else model
+
+    STAGE_TO_LIMITS: dict[str, BudgetLimits] = {}
+    for stage, limit, value in args.stage_budget:
+        stage_limits = STAGE_TO_LIMITS.setdefault(stage, BudgetLimits())
+        if limit not in ["max_tokens", "max_dollars", "max_seconds"]:
+            parser.error(f"Unknown budget limit: {limit}")
+        setattr(
+            stage_limits,
+            limit,
+            int(value) if limit == "max_tokens" else float(value)
+        )
+
+    budget = BudgetController(
+        task_limits=BudgetLimits(
+            max_tokens=args.max_tokens,
+            max_dollars=args.max_dollars,
+            max_seconds=args.max_seconds
+        ),
+        STAGE_TO_LIMITS=STAGE_TO_LIMITS
+    )
+
+    llm_cache: "SQLiteLLMCache | None" = None
+    if args.llm_cache:
+        from utils.llm_cache import LLM_CACHE_MAX_BYTES
+        from utils.llm_cache import LLM_CACHE_PATH
+        from utils.llm_cache import LLM_CACHE_TTL_SECONDS
+        from utils.llm_cache import SQLiteLLMCache
+
+        llm_cache = SQLiteLLMCache(
+            db_path=(
+                args.llm_cache_path
+                if args.llm_cache_path is not None
+                else LLM_CACHE_PATH
+            ),
+            ttl_seconds=(
+                args.llm_cache_ttl
+                if args.llm_cache_ttl is not None
+                else LLM_CACHE_TTL_SECONDS
+            ),
+            max_bytes=(
+                int(args.llm_cache_max_mb * 1024 * 1024)
+                if args.llm_cache_max_mb is not None
+                else LLM_CACHE_MAX_BYTES
+            ),
+            bypass=args.llm_cache_bypass
+        )
+
+    run_spider_creator(
+        task_id=args.task_id,
+        resume=args.resume,
+        debug_stages=args.debug_stages,
+        max_planner_concurrency=args.max_planner_concurrency,
+        max_roi_concurrency=args.max_roi_concurrency,
+        roi_escalation_confidence=args.roi_escalation_confidence,
+        budget=budget,
+        early_stop_score=args.early_stop_score,
+        verification_mode=VerificationMode(args.verification_mode),
+        llm_cache=llm_cache,
+        max_extracted_content_tokens=args.max_extracted_content_tokens
+    )
+
 
 if __name__ == "__main__":
     main()
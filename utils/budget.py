@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+import contextlib
+import contextvars
+import json
+import threading
+import time
+from pathlib import Path
+
+import attrs
+from attrs_strict import type_validator
+
+from typing import Any, Iterator
+
+
+BUDGET_REPORT_FILENAME: str = "budget_report.json"
+
+# USD per million (input, output) tokens.
+MODEL_TO_PRICE_PER_MILLION_TOKENS: dict[str, tuple[float, float]] = {
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4o": (2.50, 10.00),
+    "o3": (2.00, 8.00),
+    "o4-mini": (1.10, 4.40)
+}
+
+# The budget controller of the current run and the budget stage the
+# current code runs in. Like tracing, they follow copied contexts.
+CURRENT_BUDGET: contextvars.ContextVar["BudgetController | None"] =\
+    contextvars.ContextVar("CURRENT_BUDGET", default=None)
+CURRENT_BUDGET_STAGE: contextvars.ContextVar[str | None] =\
+    contextvars.ContextVar("CURRENT_BUDGET_STAGE", default=None)
+# Stop reasons seen by the enclosing tracking_budget_stops blocks,
+# innermost last. The lists are shared with copied contexts, so stops
+# in worker threads are seen too.
+CURRENT_BUDGET_STOPS: contextvars.ContextVar[tuple[list[str], ...]] =\
+    contextvars.ContextVar("CURRENT_BUDGET_STOPS", default=())
+
+
+def get_dollar_cost(
+    model: str | None,
+    input_tokens: int,
+    output_tokens: int
+        ) -> float:
+    """Cost of a call, 0 for models without a known price."""
+    price = MODEL_TO_PRICE_PER_MILLION_TOKENS.get(model or "")
+    if price is None:
+        # Dated snapshots, e.g. "o3-2025-04-16".
+        for model_prefix, model_price in sorted(
+                MODEL_TO_PRICE_PER_MILLION_TOKENS.items(),
+                key=lambda item: len(item[0]),
+                reverse=True):
+            if (model or "").startswith(model_prefix + "-"):
+                price = model_price
+                break
+    if price is None:
+        return 0.0
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+@attrs.define()
+class BudgetLimits:
+    """Limits of a task or a stage. None means unlimited."""
+    max_tokens: int | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    max_dollars: float | None = attrs.field(
+        converter=attrs.converters.optional(float),
+        validator=type_validator(),
+        default=None
+    )
+
+    max_seconds: float | None = attrs.field(
+        converter=attrs.converters.optional(float),
+        validator=type_validator(),
+        default=None
+    )
+
+
+@attrs.define()
+class BudgetUsage:
+    input_tokens: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    output_tokens: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    dollars: float = attrs.field(
+        validator=type_validator(),
+        default=0.0
+    )
+
+    llm_calls: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    # time.monotonic() when the usage started being tracked.
+    start_monotonic: float = attrs.field(
+        validator=type_validator(),
+        factory=time.monotonic
+    )
+
+    # Last time work of the stage ended, see budget_stage.
+    # None while running (and for the task).
+    end_monotonic: float | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    # budget_stage blocks of the stage running now. Concurrent planner
+    # iterations overlap in the same stages.
+    active_entries: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    # Set the first time a limit stops work, see get_stop_reason.
+    stop_reason: str | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def seconds(self) -> float:
+        """Wall time from the first start to the last end."""
+        end_monotonic: float = self.end_monotonic or time.monotonic()
+        return end_monotonic - self.start_monotonic
+
+    def exceeded_limit(self, limits: BudgetLimits) -> str | None:
+        """Returns which limit is reached, or None."""
+        if limits.max_tokens is not None and self.tokens >= limits.max_tokens:
+            return f"{self.tokens} tokens >= max_tokens {limits.max_tokens}"
+        if limits.max_dollars is not None and self.dollars >= limits.max_dollars:
+            return f"${self.dollars:.2f} >= max_dollars {limits.max_dollars}"
+        if limits.max_seconds is not None and self.seconds >= limits.max_seconds:
+            return f"{self.seconds:.0f}s >= max_seconds {limits.max_seconds}"
+        return None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "dollars": round(self.dollars, 6),
+            "llm_calls": self.llm_calls,
+            "seconds": round(self.seconds, 3),
+            "stop_reason": self.stop_reason
+        }
+
+
+@attrs.define()
+class BudgetController:
+    """
+    Tracks LLM token usage, dollar cost and wall time of a task, in total
+    and per budget stage, against optional limits.
+
+    Usage is recorded by BudgetCallbackHandler for every chat model call
+    made while the controller is current (see `budget_to`), and charged
+    to the budget stage of the caller (see `budget_stage`).
+
+    Limits stop iterative stages early (ROI classification, candidate
+    execution, verification), which check `get_stop_reason` before each
+    item. Single-call stages only report their usage.
+    """
+    task_limits: BudgetLimits = attrs.field(
+        validator=type_validator(),
+        factory=BudgetLimits
+    )
+
+    STAGE_TO_LIMITS: dict[str, BudgetLimits] = attrs.field(
+        validator=type_validator(),
+        factory=dict
+    )
+
+    task_usage: BudgetUsage = attrs.field(
+        validator=type_validator(),
+        factory=BudgetUsage
+    )
+
+    STAGE_TO_USAGE: dict[str, BudgetUsage] = attrs.field(
+        validator=type_validator(),
+        factory=dict
+    )
+
+    _lock: threading.Lock = attrs.field(
+        init=False,
+        factory=threading.Lock,
+        repr=False
+    )
+
+    def get_stage_usage(self, stage: str) -> BudgetUsage:
+        with self._lock:
+            if stage not in self.STAGE_TO_USAGE:
+                # Stage wall time counts from its first use.
+                self.STAGE_TO_USAGE[stage] = BudgetUsage()
+            return self.STAGE_TO_USAGE[stage]
+
+    def enter_stage(self, stage: str) -> BudgetUsage:
+        """Starts (or resumes) the clock of `stage`, see budget_stage."""
+        stage_usage: BudgetUsage = self.get_stage_usage(stage)
+        with self._lock:
+            stage_usage.active_entries += 1
+            stage_usage.end_monotonic = None
+        return stage_usage
+
+    def exit_stage(self, stage_usage: BudgetUsage):
+        """Stops the clock of a stage once no block of it is running."""
+        with self._lock:
+            stage_usage.active_entries -= 1
+            if stage_usage.active_entries == 0:
+                stage_usage.end_monotonic = time.monotonic()
+
+    def record_usage(
+        self,
+        model: str | None,
+        input_tokens: int,
+        output_tokens: int,
+        stage: str | None = None
+            ):
+        dollars: float = get_dollar_cost(
+            model=model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens
+        )
+        usages: list[BudgetUsage] = [self.task_usage]
+        if stage is not None:
+            usages.append(self.get_stage_usage(stage))
+
+        with self._lock:
+            for usage in usages:
+                usage.input_tokens += input_tokens
+                usage.output_tokens += output_tokens
+                usage.dollars += dollars
+                usage.llm_calls += 1
+
+    def get_stop_reason(self, stage: str | None = None) -> str | None:
+        """
+        Returns why work should stop, if the task budget or the budget
+        of `stage` is used up. None means go on.
+        """
+        checks: list[tuple[str, BudgetUsage, BudgetLimits]] = [
+            ("task", self.task_usage, self.task_limits)
+        ]
+        if stage is not None and stage in self.STAGE_TO_LIMITS:
+            checks.append(
+                (
+                    f"stage {stage}",
+                    self.get_stage_usage(stage),
+                    self.STAGE_TO_LIMITS[stage]
+                )
+            )
+
+        for scope, usage, limits in checks:
+            exceeded: str | None = usage.exceeded_limit(limits)
+            if exceeded is not None:
+                stop_reason: str = f"{scope} budget: {exceeded}"
+                with self._lock:
+                    if usage.stop_reason is None:
+                        usage.stop_reason = stop_reason
+                return stop_reason
+        return None
+
+    def get_report(self) -> dict[str, Any]:
+        return {
+            "task": {
+                "limits": attrs.asdict(self.task_limits),
+                "usage": self.task_usage.to_dict()
+            },
+            "stages": {
+                stage: {
+                    "limits": attrs.asdict(
+                        self.STAGE_TO_LIMITS.get(stage, BudgetLimits())
+                    ),
+                    "usage": usage.to_dict()
+                }
+                for stage, usage in self.STAGE_TO_USAGE.items()
+            }
+        }
+
+    def save_report(self, report_path: Path):
+        with report_path.open("w", encoding="utf-8") as f:
+            json.dump(self.get_report(), f, indent=4)
+
+    def print_report(self):
+        print("\n--- BUDGET REPORT ---")
+        print(
+            f"{'STAGE':<28}{'CALLS':>7}{'IN TOKENS':>12}"
+            f"{'OUT TOKENS':>12}{'DOLLARS':>10}{'SECONDS':>10}"
+        )
+        rows: list[tuple[str, BudgetUsage]] = [
+            *self.STAGE_TO_USAGE.items(),
+            ("TOTAL", self.task_usage)
+        ]
+        for stage, usage in rows:
+            print(
+                f"{stage:<28}{usage.llm_calls:>7}{usage.input_tokens:>12}"
+                f"{usage.output_tokens:>12}{usage.dollars:>10.2f}"
+                f"{usage.seconds:>10.1f}"
+            )
+            if usage.stop_reason is not None:
+                print(f"{'':<28}Stopped early: {usage.stop_reason}")
+
+
+@contextlib.contextmanager
+def budget_to(budget: BudgetController) -> Iterator[BudgetController]:
+    """Makes `budget` the budget controller of the current context."""
+    token = CURRENT_BUDGET.set(budget)
+    try:
+        yield budget
+    finally:
+        CURRENT_BUDGET.reset(token)
+
+
+@contextlib.contextmanager
+def budget_stage(stage: str) -> Iterator[None]:
+    """Charges LLM usage of the enclosed block to `stage`."""
+    budget = CURRENT_BUDGET.get()
+    stage_usage: BudgetUsage | None = None
+    if budget is not None:
+        # Starts the stage clock on first use.
+        stage_usage = budget.enter_stage(stage)
+    token = CURRENT_BUDGET_STAGE.set(stage)
+    try:
+        yield
+    finally:
+        CURRENT_BUDGET_STAGE.reset(token)
+        if stage_usage is not None:
+            budget.exit_stage(stage_usage)
+
+
+@contextlib.contextmanager
+def tracking_budget_stops() -> Iterator[list[str]]:
+    """
+    Collects the stop reasons returned by get_budget_stop_reason in the
+    enclosed block, i.e. whether work in it was cut short by the budget.
+    """
+    stop_reasons: list[str] = []
+    token = CURRENT_BUDGET_STOPS.set(
+        (*CURRENT_BUDGET_STOPS.get(), stop_reasons)
+    )
+    try:
+        yield stop_reasons
+    finally:
+        CURRENT_BUDGET_STOPS.reset(token)
+
+
+def get_budget_stop_reason() -> str | None:
+    """
+    Why the current budget stage should stop, or None to go on
+    (always None without a current budget controller).
+    """
+    budget = CURRENT_BUDGET.get()
+    if budget is None:
+        return None
+    stop_reason: str | None = budget.get_stop_reason(
+        stage=CURRENT_BUDGET_STAGE.get()
+    )
+    if stop_reason is not None:
+        for stop_reasons in CURRENT_BUDGET_STOPS.get():
+            stop_reasons.append(stop_reason)
+    return stop_reason
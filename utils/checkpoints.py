@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import attrs
+from attrs_strict import type_validator
+
+from typing import Any, Callable
+
+from utils.budget import tracking_budget_stops
+
+
+CHECKPOINTS_FOLDER_NAME: str = "checkpoints"
+
+
+def get_inputs_hash(inputs: Any) -> str:
+    """
+    SHA-256 of the JSON form of a stage's inputs. Keys are sorted, and
+    values JSON can't encode are hashed through their str().
+    """
+    inputs_json: str = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(inputs_json.encode("utf-8")).hexdigest()
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+@attrs.define()
+class CheckpointStore:
+    """
+    Persists the output of pipeline stages under
+    `results/<task_id>/checkpoints/<stage>.json`, keyed by the hash of
+    the stage inputs.
+
+    Outputs are saved unless the budget cut the stage short (see
+    utils.budget): a truncated output must not pass for a complete one
+    on resume. With resume=True, a stage whose inputs hash matches its
+    saved checkpoint is loaded instead of computed again.
+    """
+    folder: Path = attrs.field(
+        validator=type_validator()
+    )
+
+    resume: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+
+    def __attrs_post_init__(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def get_checkpoint_path(self, stage: str) -> Path:
+        return self.folder / f"{stage}.json"
+
+    def load(self, stage: str, inputs_hash: str) -> tuple[bool, Any]:
+        """
+        Returns (True, output) if the stage has a checkpoint for these
+        inputs, (False, None) otherwise.
+        """
+        checkpoint_path = self.get_checkpoint_path(stage)
+        if not checkpoint_path.is_file():
+            return False, None
+
+        try:
+            with checkpoint_path.open("r", encoding="utf-8") as f:
+                checkpoint: dict[str, Any] = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Ignoring unreadable checkpoint: {checkpoint_path}")
+            return False, None
+
+        if checkpoint.get("inputs_hash") != inputs_hash:
+            return False, None
+        return True, checkpoint["output"]
+
+    def save(self, stage: str, inputs_hash: str, output: Any):
+        checkpoint_path = self.get_checkpoint_path(stage)
+        # Write to a temporary file first, so an interrupted run never
+        # leaves a truncated checkpoint behind.
+        tmp_path = checkpoint_path.with_name(
+            f"{checkpoint_path.name}.{threading.get_ident()}.tmp"
+        )
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"inputs_hash": inputs_hash, "output": output}, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def run_stage(
+        self,
+        stage: str,
+        inputs: Any,
+        compute: Callable[[], Any],
+        dump: Callable[[Any], Any] = _identity,
+        load: Callable[[Any], Any] = _identity
+            ) -> Any:
+        """
+        Runs `compute` and checkpoints its output, or loads the output
+        from a previous run when resuming with the same `inputs`.
+
+        `dump` turns the output into JSON-serializable data and `load`
+        turns it back, e.g. `Planning.model_dump` / `Planning.model_validate`.
+        """
+        inputs_hash: str = get_inputs_hash(inputs)
+
+        if self.resume:
+            found, output = self.load(stage=stage, inputs_hash=inputs_hash)
+            if found:
+                print(f"[CHECKPOINT] Resumed stage '{stage}'.")
+                return load(output)
+
+        with tracking_budget_stops() as stop_reasons:
+            result = compute()
+        if stop_reasons:
+            print(
+                f"[CHECKPOINT] Not saving stage '{stage}', stopped early. "
+                f"{stop_reasons[0]}"
+            )
+            return result
+
+        self.save(stage=stage, inputs_hash=inputs_hash, output=dump(result))
+        return result
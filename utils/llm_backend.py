@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from types import NoneType, UnionType
+
+from pydantic import BaseModel
+
+from langchain_core.caches import BaseCache
+from langchain_core.caches import RETURN_VAL_TYPE
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration
+from langchain_core.outputs import ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from typing import Any, Callable, Union, get_args, get_origin
+
+from utils.llm_cache import dump_generations
+from utils.llm_cache import get_cache_key
+from utils.llm_cache import get_llm_string_model
+from utils.llm_cache import load_generations
+
+
+# Addresses of the local servers candidate spiders run against. Their
+# ports are picked by the OS, so they differ between runs.
+LOCAL_ADDRESS_PATTERN: re.Pattern = re.compile(r"http://127\.0\.0\.1:\d+")
+LOCAL_ADDRESS_PLACEHOLDER: str = "http://127.0.0.1:<port>"
+
+# Other output of candidate spider runs that differs between runs, with
+# its placeholder: the temporary file each candidate runs from (see
+# ctxexec.exec_sp), in tracebacks, and object addresses, in reprs.
+VOLATILE_OUTPUT_PATTERN_TO_PLACEHOLDER: dict[re.Pattern, str] = {
+    re.compile(
+        re.escape(tempfile.gettempdir()) + r"[\\/]tmp\w+\.py"
+    ): "<tmp_file>.py",
+    re.compile(r"\bat 0x[0-9a-fA-F]+\b"): "at 0x<address>"
+}
+
+# Candidate headers of listwise verification prompts, for stub answers
+# (see pipeline.verify_sp_execution.LISTWISE_CANDIDATE_PROMPT).
+CANDIDATE_ID_PATTERN: re.Pattern = re.compile(
+    r"^--- CANDIDATE (\d+) ---$", re.MULTILINE
+)
+
+# URLs of a prompt, for stub answers.
+URL_PATTERN: re.Pattern = re.compile(r"https?://[^\s\"'`<>()\[\]{}\\]+")
+
+# Plain text answer of the stub. A code block, so that code extraction
+# (e.g. in the spider combination) finds something.
+STUB_RESPONSE_TEXT: str = "```python\n# Stub LLM response.\n```"
+
+# Spider of the stub: prints output, so candidates get verified.
+STUB_SPIDER_CODE: str = """```python
+# Stub spider.
+base_url = "{url}"
+print(f"Stub spider output of {{base_url}}.")
+```"""
+
+# Stub values of fields, by name, from the URLs of the prompt. They
+# carry a stub run through every stage: the mindmap and the plan point
+# at the recorded pages, ROIs are kept and their spiders print output.
+FIELD_NAME_TO_STUB: dict[str, Callable[[list[str]], Any]] = {
+    "mermaid_code": lambda urls: "graph TD\n" + "\n".join(
+        f'    page{idx}["{url}"]' for idx, url in enumerate(urls)
+    ),
+    "url": lambda urls: urls[0] if urls else "",
+    "urls": lambda urls: urls,
+    "result": lambda urls: True,
+    "spider_code": lambda urls: STUB_SPIDER_CODE.format(
+        url=urls[0] if urls else ""
+    )
+}
+
+
+def get_local_addresses(text: str) -> list[str]:
+    """Local server addresses in `text`, in order of first appearance."""
+    return list(dict.fromkeys(LOCAL_ADDRESS_PATTERN.findall(text)))
+
+
+def get_normalized_prompt(prompt: str) -> str:
+    """
+    `prompt` without what differs between runs of the same task: local
+    server ports and volatile spider output (see
+    VOLATILE_OUTPUT_PATTERN_TO_PLACEHOLDER).
+    """
+    prompt = LOCAL_ADDRESS_PATTERN.sub(LOCAL_ADDRESS_PLACEHOLDER, prompt)
+    for pattern, placeholder in\
+            VOLATILE_OUTPUT_PATTERN_TO_PLACEHOLDER.items():
+        prompt = pattern.sub(placeholder, prompt)
+    return prompt
+
+
+def get_fixture_key(prompt: str, llm_string: str) -> str:
+    """
+    Hash of the normalized prompt (see get_normalized_prompt), the model
+    and the output schema. Client settings (retries, timeouts...) are
+    left out of the llm string, so recordings replay across runs and
+    client changes.
+    """
+    _, _, params = llm_string.partition("---")
+    return get_cache_key(
+        prompt=get_normalized_prompt(prompt),
+        llm_string=f"{get_llm_string_model(llm_string)}---{params}"
+    )
+
+
+class FixtureStore(BaseCache):
+    """
+    LLM responses as JSON fixtures in `folder`, one file per call, keyed
+    by get_fixture_key.
+
+    Used as the cache of every chat model (see shared.get_chat_model).
+    Recording, every call goes to the API and its response is saved.
+    Replaying, every call is served from its fixture, and a call without
+    one raises instead of reaching the API.
+
+    Local server addresses in a replayed response are mapped to the ones
+    of the current prompt, so replayed spiders reach the servers of the
+    current run.
+    """
+    def __init__(self, folder: Path, replay: bool):
+        self.folder = Path(folder)
+        self.replay = replay
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.writes: int = 0
+
+    def get_fixture_path(self, key: str) -> Path:
+        return self.folder / f"{key}.json"
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        if not self.replay:
+            return None
+
+        key: str = get_fixture_key(prompt=prompt, llm_string=llm_string)
+        fixture_path = self.get_fixture_path(key)
+        if not fixture_path.is_file():
+            raise RuntimeError(
+                f"No LLM fixture for this "
+                f"{get_llm_string_model(llm_string)} call: {fixture_path}. "
+                "Record the run again with the record LLM backend."
+            )
+
+        with fixture_path.open("r", encoding="utf-8") as f:
+            fixture: dict[str, Any] = json.load(f)
+
+        RECORDED_TO_CURRENT: dict[str, str] = dict(
+            zip(fixture["local_addresses"], get_local_addresses(prompt))
+        )
+        generations: str = LOCAL_ADDRESS_PATTERN.sub(
+            lambda match: RECORDED_TO_CURRENT.get(
+                match.group(0), match.group(0)
+            ),
+            fixture["generations"]
+        )
+
+        with self._lock:
+            self.hits += 1
+        return load_generations(generations)
+
+    def update(
+        self,
+        prompt: str,
+        llm_string: str,
+        return_val: RETURN_VAL_TYPE
+            ):
+        if self.replay:
+            return
+
+        key: str = get_fixture_key(prompt=prompt, llm_string=llm_string)
+        fixture: dict[str, Any] = {
+            "model": get_llm_string_model(llm_string),
+            "local_addresses": get_local_addresses(prompt),
+            "generations": dump_generations(return_val)
+        }
+
+        fixture_path = self.get_fixture_path(key)
+        tmp_path = fixture_path.with_name(
+            f"{fixture_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(fixture, f, indent=4)
+        os.replace(tmp_path, fixture_path)
+
+        with self._lock:
+            self.writes += 1
+
+    def clear(self, **kwargs: Any):
+        for fixture_path in self.folder.glob("*.json"):
+            fixture_path.unlink()
+
+
+def get_prompt_urls(prompt: str) -> list[str]:
+    """
+    URLs in `prompt`, in order of first appearance, without the local
+    server addresses.
+    """
+    urls: list[str] = [
+        url.rstrip(".,;:")
+        for url in URL_PATTERN.findall(prompt)
+        if not LOCAL_ADDRESS_PATTERN.match(url)
+    ]
+    return list(dict.fromkeys(urls))
+
+
+def get_prompt_candidate_ids(prompt: str) -> list[int]:
+    """Ids of the candidates of a listwise verification prompt."""
+    return list(
+        dict.fromkeys(
+            int(candidate_id)
+            for candidate_id in CANDIDATE_ID_PATTERN.findall(prompt)
+        )
+    )
+
+
+def get_stub_value(annotation: Any, prompt: str) -> Any:
+    """Deterministic placeholder for a field of type `annotation`."""
+    origin = get_origin(annotation)
+    if origin in [Union, UnionType]:
+        if NoneType in get_args(annotation):
+            return None
+        return get_stub_value(get_args(annotation)[0], prompt)
+    if origin is list:
+        item_annotation = next(iter(get_args(annotation)), None)
+        if isinstance(item_annotation, type) and\
+                issubclass(item_annotation, BaseModel):
+            item = get_stub_instance(item_annotation, prompt)
+            if "candidate_id" in item_annotation.model_fields:
+                # One result per candidate of the prompt.
+                return [
+                    item.model_copy(update={"candidate_id": candidate_id})
+                    for candidate_id in get_prompt_candidate_ids(prompt)
+                ]
+            # One item, so that stages looping over them have work.
+            return [item]
+    if origin is not None:
+        annotation = origin
+
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return get_stub_instance(annotation, prompt)
+
+    TYPE_TO_STUB_VALUE: dict[type, Any] = {
+        str: "",
+        bool: False,
+        int: 0,
+        float: 0.0,
+        list: [],
+        dict: {}
+    }
+    return TYPE_TO_STUB_VALUE.get(annotation)
+
+
+def get_stub_instance(schema: type[BaseModel], prompt: str = "") -> BaseModel:
+    """
+    Instance of `schema` with defaults, or placeholders drawn from
+    `prompt`, as values (see FIELD_NAME_TO_STUB).
+    """
+    prompt_urls: list[str] = get_prompt_urls(prompt)
+    return schema.model_validate(
+        {
+            name: (
+                FIELD_NAME_TO_STUB[name](prompt_urls)
+                if name in FIELD_NAME_TO_STUB
+                else get_stub_value(field.annotation, prompt)
+            )
+            for name, field in schema.model_fields.items()
+            if field.is_required()
+        }
+    )
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Offline chat model with deterministic answers: STUB_RESPONSE_TEXT,
+    or for structured output an instance of the schema made of
+    placeholders drawn from the prompt (see get_stub_instance), enough
+    to run every stage of the pipeline. Calls still go through the
+    callbacks, so tracing and budgets see them.
+    """
+    model_name: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: Any = None,
+        stub_schema: type[BaseModel] | None = None,
+        **kwargs: Any
+            ) -> ChatResult:
+        additional_kwargs: dict[str, Any] = {}
+        if stub_schema is not None:
+            prompt: str = "\n".join(
+                str(message.content) for message in messages
+            )
+            additional_kwargs["parsed"] = get_stub_instance(
+                stub_schema,
+                prompt=prompt
+            )
+        message = AIMessage(
+            content=STUB_RESPONSE_TEXT,
+            additional_kwargs=additional_kwargs,
+            usage_metadata={
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "total_tokens": 0
+            },
+            response_metadata={"model_name": self.model_name}
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def with_structured_output(self, schema: Any, **kwargs: Any):
+        def get_parsed(message: BaseMessage) -> BaseModel:
+            parsed = message.additional_kwargs["parsed"]
+            # Cached answers are stored as dicts, see dump_generations.
+            if isinstance(parsed, dict):
+                return schema.model_validate(parsed)
+            return parsed
+
+        return self.bind(stub_schema=schema) | RunnableLambda(get_parsed)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import attrs
+from attrs_strict import type_validator
+
+from langchain_core._api.beta_decorator import suppress_langchain_beta_warning
+from langchain_core.caches import BaseCache
+from langchain_core.caches import RETURN_VAL_TYPE
+from langchain_core.load import dumps
+from langchain_core.load import loads
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+from langchain_core.outputs import Generation
+
+from typing import Any
+
+
+# Shared by all tasks: identical calls are identical across tasks too.
+LLM_CACHE_PATH: Path = Path("results") / "llm_cache.sqlite3"
+LLM_CACHE_TTL_SECONDS: float = 30 * 24 * 3600
+LLM_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+# Share of max_bytes kept by an eviction, so a full cache is not
+# evicted again on every write.
+LLM_CACHE_EVICTION_TARGET: float = 0.9
+
+# Set on the response metadata of messages served from the cache, so
+# callbacks can tell them apart (see utils.llm_callbacks).
+LLM_CACHE_HIT_KEY: str = "llm_cache_hit"
+
+
+def get_cache_key(prompt: str, llm_string: str) -> str:
+    """
+    SHA-256 of the serialized prompt and the model configuration.
+    The llm string holds the model, its parameters and, for structured
+    output, the output schema, so all of them are part of the key.
+    """
+    key_source: str = llm_string + "\x00" + prompt
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def get_llm_string_model(llm_string: str) -> str | None:
+    """Model name of an llm string, for the metrics."""
+    serialized_repr, _, _ = llm_string.partition("---")
+    try:
+        serialized = json.loads(serialized_repr)
+    except json.JSONDecodeError:
+        return None
+    kwargs: dict[str, Any] = serialized.get("kwargs") or {}
+    return kwargs.get("model_name") or kwargs.get("model")
+
+
+def dump_generations(generations: RETURN_VAL_TYPE) -> str:
+    cacheable: list[Generation] = []
+    for generation in generations:
+        message = getattr(generation, "message", None)
+        parsed = (
+            message.additional_kwargs.get("parsed")
+            if message is not None else None
+        )
+        # Structured output is parsed into a pydantic object, which
+        # does not serialize. Its parser also accepts a dict.
+        if hasattr(parsed, "model_dump"):
+            generation = generation.model_copy(
+                update={
+                    "message": message.model_copy(
+                        update={
+                            "additional_kwargs": {
+                                **message.additional_kwargs,
+                                "parsed": parsed.model_dump(mode="json")
+                            }
+                        }
+                    )
+                }
+            )
+        cacheable.append(generation)
+    return dumps(cacheable)
+
+
+def load_generations(value: str) -> RETURN_VAL_TYPE:
+    with suppress_langchain_beta_warning():
+        # Only what update() stores: responses, no model configurations.
+        generations: list[Generation] = loads(
+            value,
+            allowed_objects=[ChatGeneration, Generation, AIMessage]
+        )
+    for generation in generations:
+        message = getattr(generation, "message", None)
+        if message is not None:
+            message.response_metadata[LLM_CACHE_HIT_KEY] = True
+    return generations
+
+
+@attrs.define()
+class LLMCacheStats:
+    hits: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    misses: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    # Lookups skipped because of bypass.
+    bypassed: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    # Entries found but older than the TTL (also counted as misses).
+    expired: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    writes: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    evictions: int = attrs.field(
+        validator=type_validator(),
+        default=0
+    )
+
+    @property
+    def hit_rate(self) -> float:
+        lookups: int = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    LangChain LLM cache in a SQLite file, keyed by model, prompt and
+    output schema (see get_cache_key). Install it with
+    shared.using_llm_cache to cache every chat model of the pipeline.
+
+    Entries older than `ttl_seconds` are misses and get deleted. Once
+    the cached responses take more than `max_bytes` (tracked on every
+    write), the least recently used ones are evicted, down to
+    LLM_CACHE_EVICTION_TARGET of it. With `bypass`, lookups always miss but fresh
+    responses are still stored, refreshing the cache.
+    """
+    def __init__(
+        self,
+        db_path: Path = LLM_CACHE_PATH,
+        ttl_seconds: float | None = LLM_CACHE_TTL_SECONDS,
+        max_bytes: int | None = LLM_CACHE_MAX_BYTES,
+        bypass: bool = False
+            ):
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+
+        self.stats = LLMCacheStats()
+        self.MODEL_TO_STATS: dict[str, LLMCacheStats] = {}
+
+        self._lock = threading.Lock()
+        # Bytes of the cached responses, kept up to date on writes so
+        # that eviction only runs when the cache is over max_bytes.
+        self._size_bytes: int = 0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Pipeline stages call models from several threads, the
+        # connection is shared under the lock.
+        self._connection = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    value TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_last_used_at "
+                "ON llm_cache (last_used_at)"
+            )
+        # Drops what expired since the last run, and sets _size_bytes.
+        self.evict()
+
+    def _count(self, llm_string: str, **increments: int):
+        model: str = get_llm_string_model(llm_string) or "unknown"
+        with self._lock:
+            model_stats = self.MODEL_TO_STATS.setdefault(
+                model, LLMCacheStats()
+            )
+            for stats in [self.stats, model_stats]:
+                for name, increment in increments.items():
+                    setattr(stats, name, getattr(stats, name) + increment)
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        if self.bypass:
+            self._count(llm_string, bypassed=1, misses=1)
+            return None
+
+        key: str = get_cache_key(prompt=prompt, llm_string=llm_string)
+        now: float = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, created_at, size_bytes FROM llm_cache "
+                "WHERE key = ?",
+                (key,)
+            ).fetchone()
+            expired: bool = (
+                row is not None
+                and self.ttl_seconds is not None
+                and now - row[1] > self.ttl_seconds
+            )
+            if expired:
+                self._connection.execute(
+                    "DELETE FROM llm_cache WHERE key = ?", (key,)
+                )
+                self._size_bytes -= row[2]
+            elif row is not None:
+                self._connection.execute(
+                    "UPDATE llm_cache SET last_used_at = ? WHERE key = ?",
+                    (now, key)
+                )
+
+        if row is None or expired:
+            self._count(llm_string, misses=1, expired=int(expired))
+            return None
+
+        try:
+            generations = load_generations(row[0])
+        except Exception as e:
+            print(f"[LLM CACHE] Ignoring unreadable entry {key}: {e}")
+            self._count(llm_string, misses=1)
+            return None
+
+        self._count(llm_string, hits=1)
+        return generations
+
+    def update(
+        self,
+        prompt: str,
+        llm_string: str,
+        return_val: RETURN_VAL_TYPE
+            ):
+        key: str = get_cache_key(prompt=prompt, llm_string=llm_string)
+        value: str = dump_generations(return_val)
+        size_bytes: int = len(value.encode("utf-8"))
+        now: float = time.time()
+        with self._lock, self._connection:
+            replaced = self._connection.execute(
+                "SELECT size_bytes FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            self._connection.execute(
+                """
+                INSERT OR REPLACE INTO llm_cache
+                (key, model, value, size_bytes, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key,
+                    get_llm_string_model(llm_string),
+                    value,
+                    size_bytes,
+                    now,
+                    now
+                )
+            )
+            self._size_bytes += size_bytes - (replaced[0] if replaced else 0)
+            over_size: bool = (
+                self.max_bytes is not None
+                and self._size_bytes > self.max_bytes
+            )
+        self._count(llm_string, writes=1)
+        if over_size:
+            self.evict()
+
+    def evict(self):
+        """Deletes expired entries, then the least recently used ones
+        beyond LLM_CACHE_EVICTION_TARGET of max_bytes."""
+        with self._lock, self._connection:
+            evicted: int = 0
+            if self.ttl_seconds is not None:
+                evicted += self._connection.execute(
+                    "DELETE FROM llm_cache WHERE created_at < ?",
+                    (time.time() - self.ttl_seconds,)
+                ).rowcount
+            if self.max_bytes is not None:
+                evicted += self._connection.execute(
+                    """
+                    DELETE FROM llm_cache WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size_bytes) OVER (
+                                ORDER BY last_used_at DESC, key
+                            ) AS running_bytes
+                            FROM llm_cache
+                        )
+                        WHERE running_bytes > ?
+                    )
+                    """,
+                    (int(self.max_bytes * LLM_CACHE_EVICTION_TARGET),)
+                ).rowcount
+            self.stats.evictions += evicted
+            self._size_bytes = self._connection.execute(
+                "SELECT COALESCE(SUM(size_bytes), 0) FROM llm_cache"
+            ).fetchone()[0]
+
+    def clear(self, **kwargs: Any):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM llm_cache")
+            self._size_bytes = 0
+
+    def get_size(self) -> tuple[int, int]:
+        """Returns (entries, bytes) in the cache."""
+        with self._lock:
+            entries, size_bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_cache"
+            ).fetchone()
+        return entries, size_bytes
+
+    def print_stats(self):
+        print("\n--- LLM CACHE ---")
+        print(
+            f"{'MODEL':<28}{'HITS':>7}{'MISSES':>8}{'HIT RATE':>10}"
+            f"{'WRITES':>8}{'EXPIRED':>9}{'BYPASSED':>10}"
+        )
+        rows: list[tuple[str, LLMCacheStats]] = [
+            *sorted(self.MODEL_TO_STATS.items()),
+            ("TOTAL", self.stats)
+        ]
+        for model, stats in rows:
+            print(
+                f"{model:<28}{stats.hits:>7}{stats.misses:>8}"
+                f"{stats.hit_rate:>9.0%} {stats.writes:>8}"
+                f"{stats.expired:>9}{stats.bypassed:>10}"
+            )
+        entries, size_bytes = self.get_size()
+        print(
+            f"{entries} entries, {size_bytes / 1024 / 1024:.1f} MB, "
+            f"{self.stats.evictions} evicted: {self.db_path}"
+        )
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import threading
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from typing import Any
+
+from utils.budget import BudgetController
+from utils.budget import CURRENT_BUDGET
+from utils.budget import CURRENT_BUDGET_STAGE
+from utils.llm_cache import LLM_CACHE_HIT_KEY
+from utils.rate_limiter import ModelRateLimiter
+from utils.tracing import CURRENT_TRACER
+from utils.tracing import Span
+from utils.tracing import Tracer
+from utils.tracing import end_span
+from utils.tracing import start_span
+
+
+def get_messages_bytes(messages: list[list[BaseMessage]]) -> int:
+    """UTF-8 size of the text content of the prompt messages."""
+    prompt_bytes: int = 0
+    for message_list in messages:
+        for message in message_list:
+            content = message.content
+            if isinstance(content, list):
+                content = "".join(
+                    part.get("text", "") if isinstance(part, dict) else str(part)
+                    for part in content
+                )
+            prompt_bytes += len(content.encode("utf-8"))
+    return prompt_bytes
+
+
+def get_model_name(
+    metadata: dict[str, Any] | None,
+    invocation_params: dict[str, Any] | None
+        ) -> str | None:
+    invocation_params = invocation_params or {}
+    return (
+        (metadata or {}).get("ls_model_name")
+        or invocation_params.get("model")
+        or invocation_params.get("model_name")
+    )
+
+
+def get_token_usage(response: LLMResult) -> tuple[int | None, int | None]:
+    """
+    Returns (input_tokens, output_tokens) of a chat model response,
+    or None for counts the provider did not report.
+    """
+    for generation_list in response.generations:
+        for generation in generation_list:
+            message = getattr(generation, "message", None)
+            usage_metadata = getattr(message, "usage_metadata", None)
+            if usage_metadata:
+                return (
+                    usage_metadata.get("input_tokens"),
+                    usage_metadata.get("output_tokens")
+                )
+
+    token_usage: dict[str, Any] = (response.llm_output or {}).get(
+        "token_usage") or {}
+    return (
+        token_usage.get("prompt_tokens"),
+        token_usage.get("completion_tokens")
+    )
+
+
+def is_cache_hit(response: LLMResult) -> bool:
+    """Whether the response was served by the LLM cache."""
+    return any(
+        getattr(generation, "message", None) is not None
+        and generation.message.response_metadata.get(LLM_CACHE_HIT_KEY, False)
+        for generation_list in response.generations
+        for generation in generation_list
+    )
+
+
+def get_response_bytes(response: LLMResult) -> int:
+    output_bytes: int = 0
+    for generation_list in response.generations:
+        for generation in generation_list:
+            output_bytes += len((generation.text or "").encode("utf-8"))
+            message = getattr(generation, "message", None)
+            # Structured output comes back as tool call arguments.
+            for tool_call in getattr(message, "tool_calls", None) or []:
+                output_bytes += len(str(tool_call.get("args")).encode("utf-8"))
+    return output_bytes
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records an `llm` span for every chat model call made while a tracer
+    is current (see utils.tracing.tracing_to), with the model, token
+    counts, prompt and output sizes and whether the LLM cache answered
+    it. Registered once on each client
+    in shared.get_chat_model.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.RUN_ID_TO_SPAN: dict[UUID, tuple[Span, Tracer]] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any
+            ):
+        tracer: Tracer | None = CURRENT_TRACER.get()
+        if tracer is None:
+            return
+
+        llm_span = start_span(
+            "llm",
+            model=get_model_name(
+                metadata=metadata,
+                invocation_params=kwargs.get("invocation_params")
+            ),
+            prompt_bytes=get_messages_bytes(messages)
+        )
+        with self._lock:
+            self.RUN_ID_TO_SPAN[run_id] = (llm_span, tracer)
+
+    def _pop_span(self, run_id: UUID) -> tuple[Span, Tracer] | None:
+        with self._lock:
+            return self.RUN_ID_TO_SPAN.pop(run_id, None)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        span_and_tracer = self._pop_span(run_id)
+        if span_and_tracer is None:
+            return
+        llm_span, tracer = span_and_tracer
+
+        input_tokens, output_tokens = get_token_usage(response)
+        llm_span.set(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            output_bytes=get_response_bytes(response),
+            cache_hit=is_cache_hit(response)
+        )
+        end_span(llm_span, tracer=tracer)
+
+    def on_llm_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        **kwargs: Any
+            ):
+        span_and_tracer = self._pop_span(run_id)
+        if span_and_tracer is None:
+            return
+        llm_span, tracer = span_and_tracer
+        end_span(llm_span, error=error, tracer=tracer)
+
+
+class BudgetCallbackHandler(BaseCallbackHandler):
+    """
+    Charges the tokens and cost of every chat model call made while a
+    budget controller is current (see utils.budget.budget_to) to the
+    task and to the caller's budget stage. Registered once on each
+    client in shared.get_chat_model.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.RUN_ID_TO_CALL: dict[
+            UUID, tuple[BudgetController, str | None, str | None]] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any
+            ):
+        budget: BudgetController | None = CURRENT_BUDGET.get()
+        if budget is None:
+            return
+
+        model: str | None = get_model_name(
+            metadata=metadata,
+            invocation_params=kwargs.get("invocation_params")
+        )
+        with self._lock:
+            self.RUN_ID_TO_CALL[run_id] = (
+                budget,
+                model,
+                CURRENT_BUDGET_STAGE.get()
+            )
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            call = self.RUN_ID_TO_CALL.pop(run_id, None)
+        if call is None:
+            return
+        budget, model, stage = call
+        if is_cache_hit(response):
+            # Cached responses cost nothing, their tokens were paid once.
+            return
+
+        input_tokens, output_tokens = get_token_usage(response)
+        budget.record_usage(
+            model=model,
+            input_tokens=input_tokens or 0,
+            output_tokens=output_tokens or 0,
+            stage=stage
+        )
+
+    def on_llm_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        **kwargs: Any
+            ):
+        with self._lock:
+            self.RUN_ID_TO_CALL.pop(run_id, None)
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """
+    Debits the tokens of every call of a model from its process-wide
+    tokens-per-minute quota (see utils.rate_limiter). Registered on the
+    model's client in shared.get_chat_model.
+    """
+    def __init__(self, rate_limiter: ModelRateLimiter):
+        self.rate_limiter = rate_limiter
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        if is_cache_hit(response):
+            return
+        input_tokens, output_tokens = get_token_usage(response)
+        self.rate_limiter.record_tokens(
+            tokens=(input_tokens or 0) + (output_tokens or 0)
+        )
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import socket
+
+
+def bind_listening_socket(
+    host: str = "127.0.0.1",
+    port: int = 0
+        ) -> socket.socket:
+    """
+    Binds and listens on `port`. With port=0 the OS picks a free
+    ephemeral port, read it with `get_socket_port`.
+
+    Once this returns, connections are already accepted into the backlog,
+    so clients can't race a server that is still starting. Hand the socket
+    to the server (or to a child process, by file descriptor) instead of
+    handing it a port number.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    return sock
+
+
+def get_socket_port(sock: socket.socket) -> int:
+    return sock.getsockname()[1]
+
+
+# Printed by a child server once it accepts requests, see format_ready_line.
+READY_LINE_PREFIX: str = "SERVER READY ON PORT"
+
+
+def format_ready_line(port: int) -> str:
+    return f"{READY_LINE_PREFIX} {port}"
+
+
+def parse_ready_line(line: str) -> int | None:
+    """
+    Returns the port announced by a line printed with format_ready_line,
+    or None for any other line.
+    """
+    line = line.strip()
+    if not line.startswith(READY_LINE_PREFIX):
+        return None
+    try:
+        return int(line[len(READY_LINE_PREFIX):])
+    except ValueError:
+        return None
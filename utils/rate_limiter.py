@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import asyncio
+import collections
+import email.utils
+import random
+import threading
+import time
+
+import attrs
+from attrs_strict import type_validator
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+import httpx
+
+
+# Retries of a call rejected by a rate limit or a server error. The
+# OpenAI client backs off exponentially with jitter and honors
+# Retry-After, see shared.get_chat_model.
+LLM_MAX_RETRIES: int = 6
+
+# Pause of a model after a 429 without Retry-After: doubles on each
+# consecutive 429, up to the max.
+RATE_LIMIT_BASE_PAUSE_SECONDS: float = 1.0
+RATE_LIMIT_MAX_PAUSE_SECONDS: float = 60.0
+
+WINDOW_SECONDS: float = 60.0
+
+
+@attrs.define()
+class RateLimits:
+    """Per-minute quota of a model. None means unlimited."""
+    requests_per_minute: int | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    tokens_per_minute: int | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+
+# Quotas of the pipeline's models, shared by every stage of the process.
+# Set them to the organization's tier before the first model is built.
+MODEL_TO_RATE_LIMITS: dict[str, RateLimits] = {
+    "gpt-4.1": RateLimits(
+        requests_per_minute=5000,
+        tokens_per_minute=450_000
+    ),
+    "gpt-4.1-mini": RateLimits(
+        requests_per_minute=5000,
+        tokens_per_minute=2_000_000
+    ),
+    "o3": RateLimits(
+        requests_per_minute=5000,
+        tokens_per_minute=450_000
+    )
+}
+
+
+def get_retry_after_seconds(headers: httpx.Headers) -> float | None:
+    """Seconds asked by retry-after-ms or Retry-After, if any."""
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    # An HTTP date.
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class ModelRateLimiter(BaseRateLimiter):
+    """
+    Process-wide limiter of the calls to one model, shared by all the
+    threads calling it (see shared.get_chat_model).
+
+    A call may start once the requests and the tokens of the last minute
+    are under `limits`, and the model is not paused. Waiting callers
+    start in arrival order. Tokens are debited after each call by
+    RateLimitCallbackHandler. A 429 response pauses the model for its
+    Retry-After, or for an exponential backoff with jitter.
+    """
+    def __init__(self, model: str, limits: RateLimits):
+        self.model = model
+        self.limits = limits
+
+        self._condition = threading.Condition()
+        self._request_times: collections.deque[float] = collections.deque()
+        self._token_uses: collections.deque[tuple[float, int]] =\
+            collections.deque()
+        self._window_tokens: int = 0
+        self._paused_until: float = 0.0
+        self._consecutive_rate_limits: int = 0
+        # FIFO order of waiting callers.
+        self._next_ticket: int = 0
+        self._serving_ticket: int = 0
+
+    def _prune(self, now: float):
+        while self._request_times and\
+                self._request_times[0] <= now - WINDOW_SECONDS:
+            self._request_times.popleft()
+        while self._token_uses and\
+                self._token_uses[0][0] <= now - WINDOW_SECONDS:
+            self._window_tokens -= self._token_uses.popleft()[1]
+
+    def get_wait_seconds(self, now: float) -> float:
+        """Seconds until a call may start, 0 if it may start now."""
+        self._prune(now)
+        wait_seconds: float = self._paused_until - now
+
+        requests_per_minute = self.limits.requests_per_minute
+        if requests_per_minute is not None and\
+                len(self._request_times) >= requests_per_minute:
+            wait_seconds = max(
+                wait_seconds,
+                self._request_times[0] + WINDOW_SECONDS - now
+            )
+
+        tokens_per_minute = self.limits.tokens_per_minute
+        if tokens_per_minute is not None and\
+                self._window_tokens >= tokens_per_minute:
+            # Until enough of the oldest uses leave the window.
+            excess_tokens: int = self._window_tokens - tokens_per_minute
+            for use_time, tokens in self._token_uses:
+                excess_tokens -= tokens
+                if excess_tokens < 0:
+                    wait_seconds = max(
+                        wait_seconds,
+                        use_time + WINDOW_SECONDS - now
+                    )
+                    break
+
+        return max(0.0, wait_seconds)
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        with self._condition:
+            if not blocking:
+                now: float = time.monotonic()
+                if self._next_ticket != self._serving_ticket or\
+                        self.get_wait_seconds(now) > 0:
+                    return False
+                self._request_times.append(now)
+                return True
+
+            ticket: int = self._next_ticket
+            self._next_ticket += 1
+            while True:
+                now = time.monotonic()
+                wait_seconds: float = self.get_wait_seconds(now)
+                if ticket == self._serving_ticket and wait_seconds <= 0:
+                    self._request_times.append(now)
+                    self._serving_ticket += 1
+                    self._condition.notify_all()
+                    return True
+                if ticket != self._serving_ticket:
+                    # Woken up when the callers ahead start.
+                    wait_seconds = WINDOW_SECONDS
+                self._condition.wait(timeout=wait_seconds)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        return await asyncio.to_thread(self.acquire, blocking=blocking)
+
+    def record_tokens(self, tokens: int):
+        """Debits the tokens of a finished call from the quota."""
+        with self._condition:
+            self._consecutive_rate_limits = 0
+            if tokens > 0:
+                self._token_uses.append((time.monotonic(), tokens))
+                self._window_tokens += tokens
+
+    def pause(self, retry_after: float | None = None):
+        """Holds back every caller after a 429."""
+        with self._condition:
+            self._consecutive_rate_limits += 1
+            if retry_after is None:
+                backoff: float = min(
+                    RATE_LIMIT_MAX_PAUSE_SECONDS,
+                    RATE_LIMIT_BASE_PAUSE_SECONDS
+                    * 2 ** (self._consecutive_rate_limits - 1)
+                )
+                retry_after = backoff * random.uniform(0.5, 1.0)
+            self._paused_until = max(
+                self._paused_until,
+                time.monotonic() + retry_after
+            )
+        print(f"[RATE LIMIT] {self.model} rate limited, pausing {retry_after:.1f}s.")
+
+    def on_http_response(self, response: httpx.Response):
+        """httpx response hook of the model's client."""
+        if response.status_code == 429:
+            self.pause(retry_after=get_retry_after_seconds(response.headers))
+
+
+RATE_LIMITERS_LOCK = threading.Lock()
+MODEL_TO_RATE_LIMITER: dict[str, ModelRateLimiter] = {}
+
+
+def get_rate_limiter(model: str) -> ModelRateLimiter:
+    """The process-wide limiter of `model`."""
+    with RATE_LIMITERS_LOCK:
+        if model not in MODEL_TO_RATE_LIMITER:
+            MODEL_TO_RATE_LIMITER[model] = ModelRateLimiter(
+                model=model,
+                limits=MODEL_TO_RATE_LIMITS.get(model, RateLimits())
+            )
+        return MODEL_TO_RATE_LIMITER[model]
@@ -1,25 +1,179 @@
 #!/usr/bin/env python3
 
+import base64
 import json
 import os
+from pathlib import Path
 
+import attrs
+from attrs_strict import type_validator
 
-def load_recordings(directory: str):
-    """Loads and parses all JSON files from the specified directory."""
-    recordings = []
+from typing import Any
 
-    for filename in sorted(
-        os.listdir(directory),
-        key=lambda x: int(x.split('.')[0])
-            ):
-        if filename.endswith(".json"):
-            filepath = os.path.join(directory, filename)
+from utils.session_store import get_step_filename
+from utils.session_store import load_html_blob
+from utils.session_store import read_manifest
+from utils.session_store import scan_legacy_step_ids
 
-            try:
-                with open(filepath, "r", encoding="utf-8") as file:
-                    data = json.load(file)
-                    recordings.append(data)
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
+
+# Small fields kept in memory for every step.
+# Everything else is read from disk on first access.
+EAGER_STEP_KEYS: list[str] = [
+    "url",
+    "model_thoughts",
+    "model_actions",
+    "extracted_content"
+]
+
+# Page snapshot fields, inline in steps recorded before blob storage.
+# Never kept in memory.
+SNAPSHOT_STEP_KEYS: list[str] = [
+    "website_html",
+    "website_screenshot"
+]
+
+
+@attrs.define()
+class RecordingStep:
+    """
+    Lightweight view of a recorded step.
+
+    Metadata (url, thoughts, actions and extracted content) is loaded
+    eagerly. The remaining fields are read from disk on first access and
+    kept, except the website HTML and the screenshot, which are read
+    each time they are accessed.
+    Item access (`step["url"]`) works like it did on the old step dicts.
+    """
+    filepath: str = attrs.field(
+        validator=type_validator()
+    )
+
+    metadata: dict[str, Any] = attrs.field(
+        validator=type_validator()
+    )
+
+    website_html_ref: str | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    website_screenshot_ref: str | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    _fields: dict[str, Any] | None = attrs.field(
+        validator=type_validator(),
+        default=None,
+        init=False,
+        repr=False
+    )
+
+    def _read_step_file(self) -> dict[str, Any]:
+        with open(self.filepath, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _get_fields(self) -> dict[str, Any]:
+        """The step fields but the snapshot, parsed once."""
+        if self._fields is None:
+            self._fields = {
+                key: value
+                for key, value in self._read_step_file().items()
+                if key not in SNAPSHOT_STEP_KEYS
+            }
+        return self._fields
+
+    @property
+    def website_html(self) -> str | None:
+        if self.website_html_ref is not None:
+            return load_html_blob(self.website_html_ref)
+        # Recorded before blob storage existed: the HTML is inline.
+        return self._read_step_file().get("website_html")
+
+    @property
+    def website_screenshot(self) -> bytes | None:
+        """PNG bytes of the screenshot. Read only when a stage asks."""
+        if self.website_screenshot_ref is not None:
+            with open(self.website_screenshot_ref, "rb") as f:
+                return f.read()
+        # Recorded before sidecars existed: the screenshot is inline base64.
+        website_screenshot = self._read_step_file().get("website_screenshot")
+        if website_screenshot is None:
+            return None
+        return base64.b64decode(website_screenshot)
+
+    def get_metadata(self) -> dict[str, Any]:
+        return dict(self.metadata)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.metadata:
+            return self.metadata[key]
+        if key == "website_html":
+            return self.website_html
+        if key == "website_screenshot":
+            return self.website_screenshot
+        return self._get_fields()[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def list_step_filenames(directory: str) -> list[str]:
+    """
+    Returns the step filenames of a session in step order.
+    Reads the manifest written by SessionStore, and falls back to
+    listing the directory for sessions recorded without one.
+    """
+    folder = Path(directory)
+
+    manifest = read_manifest(folder)
+    if manifest:
+        return [entry["filename"] for entry in manifest]
+
+    return [
+        get_step_filename(step_id)
+        for step_id in scan_legacy_step_ids(folder)
+    ]
+
+
+def load_recording_step(directory: str, filename: str) -> RecordingStep:
+    # Absolute, so lazy reads don't depend on the working directory.
+    directory = os.path.abspath(directory)
+    filepath: str = os.path.join(directory, filename)
+
+    with open(filepath, "r", encoding="utf-8") as file:
+        data = json.load(file)
+
+    # Make blob references usable without the directory.
+    refs: dict[str, str | None] = {}
+    for ref_key in ["website_html_ref", "website_screenshot_ref"]:
+        refs[ref_key] = None
+        if data.get(ref_key) is not None:
+            refs[ref_key] = os.path.join(directory, data[ref_key])
+
+    return RecordingStep(
+        filepath=filepath,
+        metadata={key: data.get(key) for key in EAGER_STEP_KEYS},
+        **refs
+    )
+
+
+def load_recordings(directory: str) -> list[RecordingStep]:
+    """
+    Loads the steps of a recording session from the specified directory.
+    Only step metadata is kept in memory, see RecordingStep.
+    """
+    recordings: list[RecordingStep] = []
+
+    for filename in list_step_filenames(directory):
+        try:
+            recordings.append(
+                load_recording_step(directory=directory, filename=filename)
+            )
+        except Exception as e:
+            print(f"Error loading {filename}: {e}")
 
     return recordings
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+
+import attrs
+from attrs_strict import type_validator
+
+from typing import Any
+
+
+MANIFEST_FILENAME: str = "manifest.jsonl"
+BLOBS_FOLDER_NAME: str = "blobs"
+SCREENSHOTS_FOLDER_NAME: str = "screenshots"
+
+# Blob references come from the recorder. Only these shapes are accepted,
+# so a reference can't point outside the session folder.
+BLOB_REF_PATTERN: re.Pattern = re.compile(
+    rf"^({BLOBS_FOLDER_NAME}/[0-9a-f]{{64}}\.html\.gz"
+    rf"|{SCREENSHOTS_FOLDER_NAME}/[0-9a-f]{{64}}\.png)$"
+)
+
+# Blob reference keys of a step record and the suffix of their blobs.
+REF_KEY_TO_SUFFIX: dict[str, str] = {
+    "website_html_ref": ".html.gz",
+    "website_screenshot_ref": ".png"
+}
+
+
+def get_step_filename(step_id: int) -> str:
+    return f"{step_id}.json"
+
+
+def get_html_blob_ref(html: str) -> str:
+    """
+    Returns the reference of an HTML blob, relative to the session folder.
+    Blobs are addressed by the SHA-256 of their content, so steps that
+    carry the same page share a single blob.
+    """
+    digest: str = hashlib.sha256(html.encode("utf-8")).hexdigest()
+    return f"{BLOBS_FOLDER_NAME}/{digest}.html.gz"
+
+
+def get_screenshot_ref(screenshot: bytes) -> str:
+    """
+    Returns the reference of a PNG screenshot, relative to the
+    session folder. Screenshots are addressed by content, like HTML blobs.
+    """
+    digest: str = hashlib.sha256(screenshot).hexdigest()
+    return f"{SCREENSHOTS_FOLDER_NAME}/{digest}.png"
+
+
+def split_step_payloads(
+    data: dict[str, Any]
+        ) -> tuple[dict[str, Any], dict[str, bytes]]:
+    """
+    Splits a recorded step into a step record and its blobs.
+
+    The website HTML becomes a gzip-compressed blob and the base64
+    screenshot a PNG sidecar. The record keeps only their references,
+    under `website_html_ref` and `website_screenshot_ref`.
+    A step whose page did not change may carry the references of an
+    earlier step instead of the payloads; they are kept as they are.
+    Returns the record and the blob contents keyed by reference.
+    """
+    record = dict(data)
+    blobs: dict[str, bytes] = {}
+
+    if "website_html" in record:
+        website_html = record.pop("website_html")
+        record["website_html_ref"] = None
+        if isinstance(website_html, str):
+            blob_ref: str = get_html_blob_ref(website_html)
+            blobs[blob_ref] = gzip.compress(
+                website_html.encode("utf-8"),
+                compresslevel=6
+            )
+            record["website_html_ref"] = blob_ref
+
+    if "website_screenshot" in record:
+        website_screenshot = record.pop("website_screenshot")
+        record["website_screenshot_ref"] = None
+        if isinstance(website_screenshot, str):
+            screenshot: bytes = base64.b64decode(website_screenshot)
+            screenshot_ref: str = get_screenshot_ref(screenshot)
+            blobs[screenshot_ref] = screenshot
+            record["website_screenshot_ref"] = screenshot_ref
+
+    record.setdefault("website_html_ref", None)
+    record.setdefault("website_screenshot_ref", None)
+
+    return record, blobs
+
+
+def validate_blob(blob_ref: str, content: bytes):
+    """
+    Raises ValueError unless `blob_ref` is a valid reference and its
+    digest is the SHA-256 of the blob content (of the decompressed HTML
+    for HTML blobs), see get_html_blob_ref and get_screenshot_ref.
+    """
+    if not isinstance(blob_ref, str) or\
+            BLOB_REF_PATTERN.match(blob_ref) is None:
+        raise ValueError(f"Invalid blob reference: {blob_ref}")
+
+    if blob_ref.endswith(".html.gz"):
+        try:
+            content = gzip.decompress(content)
+        except (OSError, EOFError, zlib.error) as e:
+            raise ValueError(f"Invalid HTML blob {blob_ref}: {e}") from e
+
+    digest: str = hashlib.sha256(content).hexdigest()
+    if Path(blob_ref).name.split(".")[0] != digest:
+        raise ValueError(f"Blob content does not match its reference: {blob_ref}")
+
+
+def load_html_blob(blob_path: str) -> str:
+    """
+    Reads and decompresses an HTML blob. Not cached, so decoded pages
+    are only kept by their callers.
+    """
+    with gzip.open(blob_path, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+def scan_legacy_step_ids(folder: Path) -> list[int]:
+    """
+    Returns the step ids of a session folder by listing its `<n>.json`
+    files. Only used for sessions recorded before the manifest existed.
+    """
+    step_ids: list[int] = []
+    for item in folder.iterdir():
+        if item.is_file() and item.suffix == ".json":
+            try:
+                step_ids.append(int(item.stem))
+            except ValueError:
+                # Ignore files that don't have an integer as the stem
+                pass
+    return sorted(step_ids)
+
+
+def read_manifest(folder: Path) -> list[dict[str, Any]]:
+    """
+    Reads the manifest of a session folder and returns its entries
+    sorted by step id. Returns an empty list if there is no manifest.
+    """
+    manifest_path = folder / MANIFEST_FILENAME
+    if not manifest_path.is_file():
+        return []
+
+    entries: list[dict[str, Any]] = []
+    with manifest_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn last line from an interrupted write.
+                print(f"Skipping malformed manifest line: {line[:80]}")
+
+    return sorted(entries, key=lambda entry: entry["step_id"])
+
+
+@attrs.define()
+class SessionStore:
+    """
+    Append-only store for the steps of one recording session.
+
+    Step ids come from an in-memory counter guarded by a lock, and each
+    saved step is appended to `manifest.jsonl`. Saving a step never lists
+    the session folder, and concurrent writers never share a step id.
+    """
+    folder_name: str = attrs.field(
+        validator=type_validator()
+    )
+
+    folder: Path = attrs.field(
+        init=False
+    )
+
+    last_step_id: int = attrs.field(
+        validator=type_validator(),
+        init=False
+    )
+
+    _lock: threading.Lock = attrs.field(
+        init=False,
+        factory=threading.Lock,
+        repr=False
+    )
+
+    def __attrs_post_init__(self):
+        self.folder = Path(self.folder_name)
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        manifest = read_manifest(self.folder)
+        if not manifest:
+            # Index sessions recorded before the manifest existed,
+            # so new steps continue their numbering.
+            for step_id in scan_legacy_step_ids(self.folder):
+                self._append_to_manifest(step_id=step_id)
+            manifest = read_manifest(self.folder)
+
+        self.last_step_id = max(
+            [entry["step_id"] for entry in manifest],
+            default=0
+        )
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.folder / MANIFEST_FILENAME
+
+    def next_step_id(self) -> int:
+        with self._lock:
+            self.last_step_id += 1
+            return self.last_step_id
+
+    def _append_to_manifest(self, step_id: int):
+        line: str = json.dumps(
+            {
+                "step_id": step_id,
+                "filename": get_step_filename(step_id)
+            }
+        )
+        with self._lock:
+            with self.manifest_path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _write_blob(self, blob_ref: str, content: bytes):
+        blob_path = self.folder / blob_ref
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so a concurrent reader
+        # never sees a partially written blob.
+        tmp_path = blob_path.with_name(
+            f"{blob_path.name}.{threading.get_ident()}.tmp"
+        )
+        with tmp_path.open("wb") as f:
+            f.write(content)
+        os.replace(tmp_path, blob_path)
+
+    def put_blob(self, blob_ref: str, content: bytes) -> str:
+        """
+        Stores an already encoded blob (gzip HTML or PNG) under its
+        reference, unless it already exists.
+        """
+        validate_blob(blob_ref=blob_ref, content=content)
+        if not (self.folder / blob_ref).exists():
+            self._write_blob(blob_ref=blob_ref, content=content)
+
+        return blob_ref
+
+    def save_step_record(self, record: dict[str, Any]) -> Path:
+        """
+        Saves a step record, whose payloads are already stored as blobs,
+        under the next step id and returns its file path.
+        The manifest entry is written after the step file, so readers
+        never see an entry whose file is missing.
+        """
+        step_id: int = self.next_step_id()
+
+        file_path = self.folder / get_step_filename(step_id)
+        with file_path.open("w", encoding="utf-8") as f:
+            json.dump(record, f)
+
+        self._append_to_manifest(step_id=step_id)
+
+        return file_path
+
+    def save_step(self, data: dict[str, Any]) -> Path:
+        """
+        Saves a step as sent by the recorder and returns its file path.
+        The website HTML and the screenshot are moved to blobs,
+        see split_step_payloads.
+        """
+        record, blobs = split_step_payloads(data=data)
+        return self.save_step_batch(records=[record], blobs=blobs)[0]
+
+    def save_step_batch(
+        self,
+        records: list[dict[str, Any]],
+        blobs: dict[str, bytes]
+            ) -> list[Path]:
+        """
+        Saves step records in order, after storing the blobs they
+        reference. Blobs are written as received, once their content is
+        checked against their reference.
+
+        Raises ValueError, before writing anything, if a blob is invalid
+        or a record references a blob that is neither in `blobs` nor
+        already stored.
+        """
+        new_blobs: dict[str, bytes] = {}
+        for blob_ref, content in blobs.items():
+            if not isinstance(blob_ref, str) or\
+                    BLOB_REF_PATTERN.match(blob_ref) is None:
+                raise ValueError(f"Invalid blob reference: {blob_ref}")
+            if not (self.folder / blob_ref).exists():
+                validate_blob(blob_ref=blob_ref, content=content)
+                new_blobs[blob_ref] = content
+
+        for record in records:
+            if not isinstance(record, dict):
+                raise ValueError(f"Invalid step record: {record!r:.80}")
+            for ref_key, suffix in REF_KEY_TO_SUFFIX.items():
+                blob_ref = record.get(ref_key)
+                if blob_ref is None:
+                    continue
+                if not isinstance(blob_ref, str) or\
+                        BLOB_REF_PATTERN.match(blob_ref) is None or\
+                        not blob_ref.endswith(suffix):
+                    raise ValueError(f"Invalid {ref_key}: {blob_ref}")
+                if blob_ref not in blobs and\
+                        not (self.folder / blob_ref).is_file():
+                    raise ValueError(f"Unknown {ref_key}: {blob_ref}")
+
+        for blob_ref, content in new_blobs.items():
+            self._write_blob(blob_ref=blob_ref, content=content)
+
+        return [self.save_step_record(record=record) for record in records]
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import contextvars
+import time
+
+import attrs
+from attrs_strict import type_validator
+
+from typing import Any, Callable
+
+from utils.tracing import span
+
+
+@attrs.define()
+class Stage:
+    """
+    A pipeline stage. `func` is called with one keyword argument per
+    name in `inputs`, each being the output of the stage of that name
+    (or an initial value of the run). Its return value is the output
+    of the stage, available to other stages under `name`.
+    """
+    name: str = attrs.field(
+        validator=type_validator()
+    )
+
+    func: Callable[..., Any] = attrs.field(
+        repr=False
+    )
+
+    inputs: list[str] = attrs.field(
+        validator=type_validator(),
+        factory=list
+    )
+
+    # Stages whose output nothing consumes (printed for inspection only).
+    # They run only when requested, see StageGraph.run.
+    debug_only: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+
+
+@attrs.define()
+class StageTiming:
+    name: str = attrs.field(
+        validator=type_validator()
+    )
+
+    # Seconds since the run started.
+    start: float = attrs.field(
+        validator=type_validator()
+    )
+
+    end: float = attrs.field(
+        validator=type_validator()
+    )
+
+    on_critical_path: bool = attrs.field(
+        validator=type_validator(),
+        default=False
+    )
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@attrs.define()
+class StageGraph:
+    """
+    Dependency graph of pipeline stages.
+
+    `run` executes only the stages needed for the requested outputs,
+    each as soon as its inputs are ready, so independent stages run
+    concurrently on a thread pool. Stages run in a copy of the caller's
+    context, so context variables set by the caller are visible to them.
+    """
+    stages: dict[str, Stage] = attrs.field(
+        validator=type_validator(),
+        factory=dict
+    )
+
+    STAGE_TIMINGS: dict[str, StageTiming] = attrs.field(
+        validator=type_validator(),
+        factory=dict,
+        repr=False
+    )
+
+    def add_stage(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        inputs: list[str] | None = None,
+        debug_only: bool = False
+            ):
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        self.stages[name] = Stage(
+            name=name,
+            func=func,
+            inputs=inputs or [],
+            debug_only=debug_only
+        )
+
+    def get_required_stages(
+        self,
+        targets: list[str],
+        initial_values: dict[str, Any]
+            ) -> set[str]:
+        """Returns the stages the targets depend on, targets included."""
+        required: set[str] = set()
+        pending: list[str] = list(targets)
+
+        while pending:
+            name = pending.pop()
+            if name in required or name in initial_values:
+                continue
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage or input: {name}")
+            required.add(name)
+            pending.extend(self.stages[name].inputs)
+
+        return required
+
+    def run(
+        self,
+        initial_values: dict[str, Any],
+        targets: list[str],
+        debug_stages: list[str] | None = None,
+        max_workers: int = 4
+            ) -> dict[str, Any]:
+        """
+        Runs the stages needed for `targets`, plus the debug-only stages
+        in `debug_stages`, and returns all outputs by stage name.
+        If a stage raises, no new stages are started and the error is
+        raised once the running stages are done.
+        """
+        debug_stages = debug_stages or []
+        for name in debug_stages:
+            if name not in self.stages or not self.stages[name].debug_only:
+                raise ValueError(f"Not a debug-only stage: {name}")
+
+        required: set[str] = self.get_required_stages(
+            targets=list(targets) + list(debug_stages),
+            initial_values=initial_values
+        )
+        skipped: list[str] = sorted(set(self.stages) - required)
+        if skipped:
+            print(f"[STAGES] Skipping unused stages: {skipped}")
+
+        outputs: dict[str, Any] = dict(initial_values)
+        self.STAGE_TIMINGS = {}
+        run_start: float = time.monotonic()
+
+        def run_stage(stage: Stage) -> Any:
+            start: float = time.monotonic() - run_start
+            with span(f"stage.{stage.name}"):
+                output = stage.func(
+                    **{name: outputs[name] for name in stage.inputs}
+                )
+            self.STAGE_TIMINGS[stage.name] = StageTiming(
+                name=stage.name,
+                start=start,
+                end=time.monotonic() - run_start
+            )
+            return output
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers) as executor:
+            FUTURE_TO_STAGE: dict[concurrent.futures.Future, str] = {}
+            waiting: set[str] = set(required)
+            error: BaseException | None = None
+
+            while waiting or FUTURE_TO_STAGE:
+                if error is None:
+                    ready = [
+                        name for name in sorted(waiting)
+                        if all(
+                            name_in in outputs
+                            for name_in in self.stages[name].inputs
+                        )
+                    ]
+                    for name in ready:
+                        waiting.discard(name)
+                        context = contextvars.copy_context()
+                        future = executor.submit(
+                            context.run, run_stage, self.stages[name]
+                        )
+                        FUTURE_TO_STAGE[future] = name
+
+                if not FUTURE_TO_STAGE:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    FUTURE_TO_STAGE,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    name = FUTURE_TO_STAGE.pop(future)
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                        continue
+                    outputs[name] = future.result()
+
+            if error is not None:
+                raise error
+
+        self.mark_critical_path(targets=targets)
+
+        return outputs
+
+    def mark_critical_path(self, targets: list[str]):
+        """
+        Marks the chain of stages that determined the end time: from the
+        target that finished last, back through the input of each stage
+        that finished last.
+        """
+        timed_targets = [
+            name for name in targets if name in self.STAGE_TIMINGS
+        ]
+        if not timed_targets:
+            return
+
+        name: str | None = max(
+            timed_targets,
+            key=lambda target: self.STAGE_TIMINGS[target].end
+        )
+        while name is not None:
+            self.STAGE_TIMINGS[name].on_critical_path = True
+            timed_inputs = [
+                name_in for name_in in self.stages[name].inputs
+                if name_in in self.STAGE_TIMINGS
+            ]
+            name = max(
+                timed_inputs,
+                key=lambda name_in: self.STAGE_TIMINGS[name_in].end,
+                default=None
+            )
+
+    def print_timing_report(self):
+        print("\n--- STAGE TIMINGS ---")
+        print(f"{'':2}{'STAGE':<40}{'START':>10}{'DURATION':>10}")
+        for timing in sorted(
+                self.STAGE_TIMINGS.values(), key=lambda t: t.start):
+            marker: str = "*" if timing.on_critical_path else ""
+            print(
+                f"{marker:2}{timing.name:<40}"
+                f"{timing.start:>9.1f}s{timing.duration:>9.1f}s"
+            )
+
+        wall_time: float = max(
+            [timing.end for timing in self.STAGE_TIMINGS.values()],
+            default=0.0
+        )
+        critical_time: float = sum(
+            timing.duration for timing in self.STAGE_TIMINGS.values()
+            if timing.on_critical_path
+        )
+        print(
+            f"Wall time: {wall_time:.1f}s. "
+            f"Critical path (*): {critical_time:.1f}s."
+        )
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import contextlib
+import contextvars
+import json
+import threading
+import time
+import uuid
+from enum import StrEnum
+from pathlib import Path
+
+import attrs
+from attrs_strict import type_validator
+
+from typing import Any, Iterator
+
+
+TRACE_FILENAME: str = "trace.jsonl"
+
+# The tracer of the current run and the innermost open span. Context
+# variables follow the work into threads started with a copied context
+# (see StageGraph), so spans opened there get the right parent.
+CURRENT_TRACER: contextvars.ContextVar["Tracer | None"] =\
+    contextvars.ContextVar("CURRENT_TRACER", default=None)
+CURRENT_SPAN_ID: contextvars.ContextVar[str | None] =\
+    contextvars.ContextVar("CURRENT_SPAN_ID", default=None)
+
+
+class SpanOutcome(StrEnum):
+    OK: str = "ok"
+    ERROR: str = "error"
+
+
+@attrs.define()
+class Span:
+    """
+    A timed operation. Attributes are free-form: the pipeline sets
+    `model`, `input_tokens`, `output_tokens`, `prompt_bytes`,
+    `output_bytes` and the like.
+    """
+    name: str = attrs.field(
+        validator=type_validator()
+    )
+
+    span_id: str = attrs.field(
+        validator=type_validator(),
+        factory=lambda: uuid.uuid4().hex[:16]
+    )
+
+    parent_id: str | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    start_time: float = attrs.field(
+        validator=type_validator(),
+        factory=time.time
+    )
+
+    duration: float = attrs.field(
+        validator=type_validator(),
+        default=0.0
+    )
+
+    outcome: str = attrs.field(
+        validator=type_validator(),
+        default=SpanOutcome.OK
+    )
+
+    error: str | None = attrs.field(
+        validator=type_validator(),
+        default=None
+    )
+
+    attributes: dict[str, Any] = attrs.field(
+        validator=type_validator(),
+        factory=dict
+    )
+
+    _start_monotonic: float = attrs.field(
+        init=False,
+        factory=time.monotonic,
+        repr=False
+    )
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error: BaseException | None = None):
+        self.duration = time.monotonic() - self._start_monotonic
+        if error is not None:
+            self.outcome = SpanOutcome.ERROR
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_record(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "outcome": self.outcome,
+            "error": self.error,
+            **self.attributes
+        }
+
+
+@attrs.define()
+class Tracer:
+    """
+    Appends finished spans to a JSONL file, one span per line, and keeps
+    them in memory for the summary.
+    """
+    trace_path: Path = attrs.field(
+        validator=type_validator()
+    )
+
+    spans: list[Span] = attrs.field(
+        validator=type_validator(),
+        factory=list,
+        repr=False
+    )
+
+    _lock: threading.Lock = attrs.field(
+        init=False,
+        factory=threading.Lock,
+        repr=False
+    )
+
+    def __attrs_post_init__(self):
+        self.trace_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, span: Span):
+        line: str = json.dumps(span.to_record(), default=str)
+        with self._lock:
+            self.spans.append(span)
+            with self.trace_path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def print_summary(self):
+        """Prints span count, time, tokens and errors per span name."""
+        NAME_TO_TOTALS: dict[str, dict[str, float]] = {}
+        with self._lock:
+            spans = list(self.spans)
+
+        for recorded_span in spans:
+            attributes = recorded_span.attributes
+            # LLM spans are broken down by model.
+            summary_name: str = recorded_span.name
+            if attributes.get("model"):
+                summary_name += f" ({attributes['model']}"
+                summary_name += ", cached)" if attributes.get("cache_hit") else ")"
+            totals = NAME_TO_TOTALS.setdefault(
+                summary_name,
+                {
+                    "count": 0,
+                    "duration": 0.0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "errors": 0
+                }
+            )
+            totals["count"] += 1
+            totals["duration"] += recorded_span.duration
+            totals["input_tokens"] += attributes.get("input_tokens") or 0
+            totals["output_tokens"] += attributes.get("output_tokens") or 0
+            totals["errors"] += recorded_span.outcome == SpanOutcome.ERROR
+
+        print("\n--- TRACE SUMMARY ---")
+        print(
+            f"{'SPAN':<40}{'COUNT':>7}{'TIME':>10}"
+            f"{'IN TOKENS':>12}{'OUT TOKENS':>12}{'ERRORS':>8}"
+        )
+        for name, totals in sorted(
+                NAME_TO_TOTALS.items(),
+                key=lambda item: item[1]["duration"],
+                reverse=True):
+            print(
+                f"{name:<40}{totals['count']:>7}"
+                f"{totals['duration']:>9.1f}s"
+                f"{totals['input_tokens']:>12}{totals['output_tokens']:>12}"
+                f"{totals['errors']:>8}"
+            )
+        print(f"Trace written to: {self.trace_path}")
+
+
+@contextlib.contextmanager
+def tracing_to(tracer: Tracer) -> Iterator[Tracer]:
+    """Makes `tracer` the tracer of the current context."""
+    token = CURRENT_TRACER.set(tracer)
+    try:
+        yield tracer
+    finally:
+        CURRENT_TRACER.reset(token)
+
+
+def start_span(name: str, **attributes) -> Span:
+    """
+    Starts a span under the innermost open span. For callers that can't
+    use `span` (e.g. callback handlers); finish it with `end_span`.
+    """
+    return Span(
+        name=name,
+        parent_id=CURRENT_SPAN_ID.get(),
+        attributes=dict(attributes)
+    )
+
+
+def end_span(
+    span: Span,
+    error: BaseException | None = None,
+    tracer: Tracer | None = None
+        ):
+    span.finish(error=error)
+    tracer = tracer or CURRENT_TRACER.get()
+    if tracer is not None:
+        tracer.record(span)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Times the enclosed block as a span, child of the innermost open span.
+    Without a current tracer the span is still timed, but not recorded.
+    """
+    current_span = start_span(name, **attributes)
+    token = CURRENT_SPAN_ID.set(current_span.span_id)
+    try:
+        yield current_span
+    except BaseException as e:
+        end_span(current_span, error=e)
+        raise
+    else:
+        end_span(current_span)
+    finally:
+        CURRENT_SPAN_ID.reset(token)
@@ -4,6 +4,23 @@ import re
 
 import base64
 
+import prettyprinter
+
+
+# prettyprinter extras for types the pipeline never prints. Each one
+# imports its package (IPython, Django...), which slows down startup.
+PRETTYPRINTER_UNUSED_EXTRAS: list[str] = [
+    "django",
+    "ipython",
+    "ipython_repr_pretty",
+    "numpy",
+    "requests"
+]
+
+
+def install_prettyprinter_extras():
+    prettyprinter.install_extras(exclude=PRETTYPRINTER_UNUSED_EXTRAS)
+
 
 def extract_first_python_code(markdown_text: str) -> str:
     """
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import struct
+import zlib
+
+from typing import Any
+
+
+# Binary format of a batch of recorded steps:
+#
+#   magic (4 bytes) | header length (4 bytes, big-endian) | header | blobs
+#
+# The header is gzip-compressed JSON with the step records and the
+# reference and size of every blob. Blobs follow the header, in header
+# order, already encoded as they are stored on disk (gzip HTML, PNG),
+# so the server writes them without decoding.
+WIRE_MAGIC: bytes = b"SCS1"
+WIRE_CONTENT_TYPE: str = "application/x-spidercreator-steps"
+
+_HEADER_LENGTH = struct.Struct(">I")
+
+
+def encode_step_batch(
+    records: list[dict[str, Any]],
+    blobs: dict[str, bytes]
+        ) -> bytes:
+    blob_refs: list[str] = list(blobs)
+
+    header: dict[str, Any] = {
+        "records": records,
+        "blobs": [
+            {"ref": blob_ref, "size": len(blobs[blob_ref])}
+            for blob_ref in blob_refs
+        ]
+    }
+    header_bytes: bytes = gzip.compress(
+        json.dumps(header).encode("utf-8"),
+        compresslevel=6
+    )
+
+    return b"".join(
+        [
+            WIRE_MAGIC,
+            _HEADER_LENGTH.pack(len(header_bytes)),
+            header_bytes,
+            *[blobs[blob_ref] for blob_ref in blob_refs]
+        ]
+    )
+
+
+def decode_step_batch(
+    body: bytes
+        ) -> tuple[list[dict[str, Any]], dict[str, bytes]]:
+    """
+    Decodes a batch encoded by encode_step_batch.
+    Returns the step records and the blob contents keyed by reference.
+    Raises ValueError if the body is malformed.
+    """
+    if body[:len(WIRE_MAGIC)] != WIRE_MAGIC:
+        raise ValueError("Not a step batch: bad magic bytes.")
+
+    try:
+        offset: int = len(WIRE_MAGIC)
+        (header_length,) = _HEADER_LENGTH.unpack_from(body, offset)
+        offset += _HEADER_LENGTH.size
+
+        header: dict[str, Any] = json.loads(
+            gzip.decompress(body[offset:offset + header_length])
+        )
+        offset += header_length
+
+        records: list[dict[str, Any]] = header["records"]
+        blobs: dict[str, bytes] = {}
+        for blob in header["blobs"]:
+            blobs[blob["ref"]] = body[offset:offset + blob["size"]]
+            offset += blob["size"]
+    except (struct.error, OSError, EOFError, zlib.error,
+            KeyError, TypeError) as e:
+        raise ValueError(f"Malformed step batch: {e}") from e
+
+    if offset != len(body):
+        raise ValueError("Step batch size does not match its header.")
+
+    return records, blobs